@@ -15,6 +15,22 @@ from ._utils import absolutify_path_from_root
 class Const:
     API_LOCAL_URL = "http://127.0.0.1:8000"
 
+    # HTTP connection pool size, timeouts in seconds and retries of the
+    # ApiRequestor. Retries wait API_RETRY_BACKOFF * 2^(retry - 1) seconds.
+    API_POOL_SIZE = 10
+    API_CONNECT_TIMEOUT = 5.0
+    API_READ_TIMEOUT = 120.0
+    API_RETRIES = 5
+    API_RETRY_BACKOFF = 0.5
+
+    # Maximum number of concurrent requests of the AsyncApiRequestor
+    API_MAX_CONCURRENT_REQUESTS = 4
+
+    # Maximum number of worker threads per API process which run database
+    # calls, each blocks on one query at a time. Kept below the connection
+    # pool of the Supabase client, 100 connections by default.
+    DB_MAX_THREADS = 64
+
     PATH_BASE_VOCAB = absolutify_path_from_root(
         "/backend/assets/reference-vocabulary/vocabulary.base.txt"
     )
@@ -34,6 +50,34 @@ class Const:
     SPILL_LINE_NUM = 3
     CONTEXT_LINE_NUM = 10
 
+    # Number of context windows the nlp pipeline processes at once
+    NLP_BATCH_SIZE = 64
+
+    # Number of content shards per worker process for parallel parsing
+    SHARDS_PER_WORKER = 4
+
+    # Number of contexts and seconds after which buffered ingest writes
+    # are flushed to the API
+    WRITE_BUFFER_SIZE = 100
+    WRITE_BUFFER_FLUSH_INTERVAL = 30.0
+
+    # Maximum number of lemma -> id entries cached by LexDbIntegrator and
+    # ApiRequestor
+    LEMMA_ID_CACHE_SIZE = 100_000
+
+    # Number of buffered writes which are pending while parsing goes on.
+    # The relations of one write overlap with the lemmata and contexts of
+    # the next, more only queue up.
+    WRITE_MAX_IN_FLIGHT = 2
+
+    # Bloom filter of the compiled vocabulary indexes, about 1% false
+    # positives, number of memoised lookups per index, and number of
+    # entries appended to a vocabulary before its index is rebuilt
+    VOCAB_BLOOM_BITS_PER_ENTRY = 10
+    VOCAB_BLOOM_HASH_NUM = 7
+    VOCAB_MEMO_SIZE = 100_000
+    VOCAB_MAX_APPENDED = 10_000
+
     UPOS_RELEVANT = [
         UposTag.NOUN.value,
         UposTag.VERB.value,
@@ -4,16 +4,17 @@ db
 Lex database API
 """
 
-import os
-import re
-from collections import Counter, OrderedDict
-from typing import Union
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, TypeVar, Union
 
-from dotenv import load_dotenv
+import anyio
+import anyio.to_thread
+from anyio.lowlevel import RunVar
 from pydantic import parse_obj_as
-from supabase import Client, create_client
 from tabulate import tabulate
 
+from ._const import Const
 from ._dbtypes import (
     Context,
     ContextId,
@@ -34,6 +35,22 @@ from ._dbtypes import (
     StatusVal,
     UposTag,
 )
+from ._storage import StorageBackend, create_backend
+from ._utils import LruCache, chunked
+
+# Maximum number of values in a single in_ filter. Filters are encoded in
+# the request URL, which has a length limit.
+IN_FILTER_CHUNK_SIZE = 200
+
+# Unique constraint of the lemma_context table, see db/migrations
+LEMMA_CONTEXT_UNIQUE_COLUMNS = "lemma_id,context_id,upos_tag,detailed_tag"
+
+T = TypeVar("T")
+
+# Worker thread limiter of the AsyncLexDbIntegrator, one per event loop
+_db_thread_limiter: RunVar[anyio.CapacityLimiter] = RunVar(
+    "_db_thread_limiter"
+)
 
 
 class LexDbIntegrator:
@@ -41,31 +58,61 @@ class LexDbIntegrator:
     Exposes methods to interact with the database
     """
 
-    def __init__(self, env: DbEnvironment) -> None:
+    def __init__(
+        self, env: DbEnvironment, backend: Union[StorageBackend, None] = None
+    ) -> None:
         """
-        Initializes the database connection
+        Initializes the database connection. Without a backend, the one
+        configured in .env is used, see _storage.create_backend.
         """
         self.env = env
-        load_dotenv()
-        # Updated environment variables for Supabase
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
-
-        # Get the appropriate schema based on environment
-        self.schema = os.getenv(
-            "SUPABASE_SCHEMA_PROD"
-            if env == DbEnvironment.PROD
-            else "SUPABASE_SCHEMA_DEV",
-            "public",
+        self.connection: StorageBackend = backend or create_backend(env)
+        # Rows of the lookup tables (lemma_status, source_kind), see _lookup
+        self._lookup_tables: dict[str, list[dict[str, Any]]] = {}
+        # Ids of recently looked up or added lemmata. Lemmata deleted by
+        # other processes stay in it until a relation to them is refused,
+        # see _all_lemmata_exist.
+        self.lemma_id_cache: LruCache[str, LemmaId] = LruCache(
+            Const.LEMMA_ID_CACHE_SIZE
         )
 
-        if not supabase_url or not supabase_key:
-            raise ValueError(
-                "SUPABASE_URL and SUPABASE_KEY must be set in .env"
-            )
+    def _lookup(
+        self, table: str, matches: Callable[[dict[str, Any]], bool]
+    ) -> Union[dict[str, Any], None]:
+        """
+        Returns the first row of a lookup table which matches, or None.
+        The rows are cached per process. The cache is reloaded when no row
+        matches, as another process may have added it in the meantime.
+        """
+        if (rows := self._lookup_tables.get(table)) is not None:
+            if row := next(filter(matches, rows), None):
+                return row
+
+        rows = self.connection.table(table).select("*").execute().data or []
+        self._lookup_tables[table] = rows
+        return next(filter(matches, rows), None)
+
+    @staticmethod
+    def _paginate(
+        query: Any,
+        page: int,
+        page_size: int,
+        after_id: Union[int, None],
+        key: str = "id",
+    ) -> Any:
+        """
+        Orders the query by key and restricts it to one page.
+
+        With after_id, the page starts after the row whose key is after_id
+        (keyset pagination) and page is ignored. Unlike an offset, this
+        costs the same for deep pages as for the first one.
+        """
+        query = query.order(key)
+        if after_id is not None:
+            return query.gt(key, after_id).limit(page_size)
 
-        # Changed connection from MySQL to Supabase
-        self.connection: Client = create_client(supabase_url, supabase_key)
+        start = (page - 1) * page_size
+        return query.range(start, start + page_size - 1)
 
     def truncate_all_tables(self):
         """
@@ -83,10 +130,9 @@ class LexDbIntegrator:
             "lemma_context",
         ]
 
-        truncate_query = (
-            f"TRUNCATE TABLE {', '.join(tables)} RESTART IDENTITY CASCADE;"
-        )
-        self.connection.rpc("execute_sql", {"sql": truncate_query}).execute()
+        self.connection.truncate(tables)
+        self._lookup_tables.clear()
+        self.lemma_id_cache.clear()
 
     def add_source_kind(self, source_kind: SourceKindVal) -> SourceKindId:
         """
@@ -104,6 +150,7 @@ class LexDbIntegrator:
             .insert({"kind": source_kind.value})
             .execute()
         )
+        self._lookup_tables.pop("source_kind", None)
 
         if not response.data or len(response.data) == 0:
             return SourceKindId(-1)
@@ -114,17 +161,10 @@ class LexDbIntegrator:
         """
         Returns the id of a source kind. Returns -1 if the kind doesn't exist.
         """
-        response = (
-            self.connection.table("source_kind")
-            .select("id")
-            .eq("kind", source_kind.value)
-            .execute()
+        row = self._lookup(
+            "source_kind", lambda row: row["kind"] == source_kind.value
         )
-
-        if not response.data or len(response.data) == 0:
-            return SourceKindId(-1)
-
-        return SourceKindId(response.data[0]["id"])
+        return SourceKindId(row["id"] if row else -1)
 
     def get_source_kind(
         self, source_kind_id: SourceKindId
@@ -133,17 +173,10 @@ class LexDbIntegrator:
         Returns a SourceKind object. Returns None if the kind doesn't
         exist.
         """
-        response = (
-            self.connection.table("source_kind")
-            .select("*")
-            .eq("id", source_kind_id)
-            .execute()
+        row = self._lookup(
+            "source_kind", lambda row: row["id"] == source_kind_id
         )
-
-        if not response.data or len(response.data) == 0:
-            return None
-
-        return parse_obj_as(SourceKind, response.data[0])
+        return parse_obj_as(SourceKind, row) if row else None
 
     def add_source(self, source: Source) -> SourceId:
         """
@@ -214,14 +247,35 @@ class LexDbIntegrator:
 
         return parse_obj_as(Source, response.data[0])
 
+    def get_sources(self, source_ids: list[SourceId]) -> list[Source]:
+        """
+        Returns the sources with the given ids, in the order of the ids.
+        Skips ids of sources which don't exist.
+        """
+        unique_ids = list(dict.fromkeys(source_ids))
+        sources = {}
+        for chunk in chunked(unique_ids, IN_FILTER_CHUNK_SIZE):
+            response = (
+                self.connection.table("source")
+                .select("*")
+                .in_("id", chunk)
+                .execute()
+            )
+            for item in response.data or []:
+                sources[item["id"]] = parse_obj_as(Source, item)
+
+        return [sources[sid] for sid in unique_ids if sid in sources]
+
     def get_paginated_sources(
         self,
         page: int,
         page_size: int,
         filter_params: Union[dict[str, Union[int, str]], None] = None,
+        after_id: Union[SourceId, None] = None,
     ) -> list[Source]:
         """
-        Returns a list of all sources within the pagination range.
+        Returns a list of all sources within the pagination range, see
+        _paginate.
 
         filter_params is an optional filter parameter which is a dict of
         {column_name: value} items.
@@ -233,11 +287,7 @@ class LexDbIntegrator:
             for col_name, value in filter_params.items():
                 query = query.eq(col_name, value)
 
-        # Apply pagination
-        start = (page - 1) * page_size
-        end = start + page_size - 1
-
-        response = query.order("id").range(start, end).execute()
+        response = self._paginate(query, page, page_size, after_id).execute()
 
         if not response.data:
             return []
@@ -260,6 +310,7 @@ class LexDbIntegrator:
             .insert({"status": status_val.value})
             .execute()
         )
+        self._lookup_tables.pop("lemma_status", None)
 
         if not response.data or len(response.data) == 0:
             return StatusId(-1)
@@ -270,34 +321,18 @@ class LexDbIntegrator:
         """
         Returns the id of a status. Returns -1 if the status doesn't exist.
         """
-        response = (
-            self.connection.table("lemma_status")
-            .select("id")
-            .eq("status", status_val.value)
-            .execute()
+        row = self._lookup(
+            "lemma_status", lambda row: row["status"] == status_val.value
         )
-
-        if not response.data or len(response.data) == 0:
-            return StatusId(-1)
-
-        return StatusId(response.data[0]["id"])
+        return StatusId(row["id"] if row else -1)
 
     def get_status_by_id(self, status_id: StatusId) -> Union[Status, None]:
         """
         Returns the status of a lemma. Returns None if the status doesn't
         exist.
         """
-        response = (
-            self.connection.table("lemma_status")
-            .select("*")
-            .eq("id", status_id)
-            .execute()
-        )
-
-        if not response.data or len(response.data) == 0:
-            return None
-
-        return parse_obj_as(Status, response.data[0])
+        row = self._lookup("lemma_status", lambda row: row["id"] == status_id)
+        return parse_obj_as(Status, row) if row else None
 
     def add_lemma(self, lemma: Lemma) -> LemmaId:
         """
@@ -329,7 +364,9 @@ class LexDbIntegrator:
         if not response.data or len(response.data) == 0:
             return LemmaId(-1)
 
-        return LemmaId(response.data[0]["id"])
+        lemma_id = LemmaId(response.data[0]["id"])
+        self.lemma_id_cache.put(lemma.lemma, lemma_id)
+        return lemma_id
 
     def bulk_add_lemma(
         self,
@@ -349,16 +386,12 @@ class LexDbIntegrator:
         if not self.get_source(found_in_source):
             return {}
 
-        result = {}
-        remaining_lemmata = []
-
-        # Check which lemmata already exist
-        for lemma in lemmata_values:
-            lemma_id = self.get_lemma_id(lemma)
-            if lemma_id != -1:
-                result[lemma] = lemma_id
-            else:
-                remaining_lemmata.append(lemma)
+        # Check which lemmata already exist with a single lookup
+        unique_lemmata = list(dict.fromkeys(lemmata_values))
+        result = self.bulk_get_lemma_id_dict(unique_lemmata)
+        remaining_lemmata = [
+            lemma for lemma in unique_lemmata if lemma not in result
+        ]
 
         # Insert new lemmata in batches if any remain
         if remaining_lemmata:
@@ -372,15 +405,26 @@ class LexDbIntegrator:
                 for lemma in remaining_lemmata
             ]
 
-            # Batch insert using Supabase
+            # Lemmata inserted concurrently by another request are skipped
+            # instead of failing the whole batch
             response = (
-                self.connection.table("lemma").insert(insert_data).execute()
+                self.connection.table("lemma")
+                .upsert(
+                    insert_data, on_conflict="lemma", ignore_duplicates=True
+                )
+                .execute()
             )
 
-            if response.data:
-                # Map the inserted lemmata to their new IDs
-                for item in response.data:
-                    result[item["lemma"]] = item["id"]
+            # Map the inserted lemmata to their new IDs
+            for item in response.data or []:
+                result[item["lemma"]] = LemmaId(item["id"])
+
+            if skipped_lemmata := [
+                lemma for lemma in remaining_lemmata if lemma not in result
+            ]:
+                result.update(self.bulk_get_lemma_id_dict(skipped_lemmata))
+
+            self.lemma_id_cache.put_many(result)
 
         return result
 
@@ -427,25 +471,23 @@ class LexDbIntegrator:
         status_val: StatusVal,
         page: int = 1,
         page_size: int = 100,
+        after_id: Union[LemmaId, None] = None,
     ) -> list[Lemma]:
         """
-        Returns a list of all lemmata with the given status.
+        Returns a list of all lemmata with the given status, paginated as
+        described in _paginate.
         """
         status_id = self.get_status_id(status_val)
 
-        # Set up pagination
-        start = (page - 1) * page_size
-        end = start + page_size - 1
-
         # Query for lemmata with the given status
-        response = (
+        response = self._paginate(
             self.connection.table("lemma")
             .select("*")
-            .eq("status_id", status_id)
-            .order("id")
-            .range(start, end)
-            .execute()
-        )
+            .eq("status_id", status_id),
+            page,
+            page_size,
+            after_id,
+        ).execute()
 
         if not response.data:
             return []
@@ -490,6 +532,9 @@ class LexDbIntegrator:
         """
         Returns the id of a lemma. Returns -1 if the lemma doesn't exist.
         """
+        if (lemma_id := self.lemma_id_cache.get(lemma_value)) is not None:
+            return lemma_id
+
         response = (
             self.connection.table("lemma")
             .select("id")
@@ -500,7 +545,9 @@ class LexDbIntegrator:
         if not response.data or len(response.data) == 0:
             return LemmaId(-1)
 
-        return LemmaId(response.data[0]["id"])
+        lemma_id = LemmaId(response.data[0]["id"])
+        self.lemma_id_cache.put(lemma_value, lemma_id)
+        return lemma_id
 
     def bulk_get_lemma_id_dict(
         self, lemmata_values: list[str]
@@ -511,19 +558,27 @@ class LexDbIntegrator:
         if not lemmata_values:
             return {}
 
-        # Using Supabase's .in_() filter to get multiple lemmata at once
-        response = (
-            self.connection.table("lemma")
-            .select("id, lemma")
-            .in_("lemma", lemmata_values)
-            .execute()
-        )
+        result = self.lemma_id_cache.get_many(lemmata_values)
+        uncached = [lemma for lemma in lemmata_values if lemma not in result]
+        # Using Supabase's .in_() filter to get multiple lemmata at once,
+        # chunked to keep the request URL short
+        for chunk in chunked(uncached, IN_FILTER_CHUNK_SIZE):
+            response = (
+                self.connection.table("lemma")
+                .select("id, lemma")
+                .in_("lemma", chunk)
+                .execute()
+            )
 
-        if not response.data:
-            return {}
+            # Map lemma values to IDs
+            found = {
+                item["lemma"]: LemmaId(item["id"])
+                for item in response.data or []
+            }
+            self.lemma_id_cache.put_many(found)
+            result.update(found)
 
-        # Map lemma values to IDs
-        return {item["lemma"]: LemmaId(item["id"]) for item in response.data}
+        return result
 
     def get_lemma_status(self, lemma_id: LemmaId) -> Union[Status, None]:
         """
@@ -556,19 +611,21 @@ class LexDbIntegrator:
         ) or not self.get_source(lemma_source_relation.source_id):
             return False
 
-        # Insert new relation using Supabase
+        # Insert new relation using Supabase, an existing relation is kept
         response = (
             self.connection.table("lemma_source")
-            .insert(
+            .upsert(
                 {
                     "lemma_id": lemma_source_relation.lemma_id,
                     "source_id": lemma_source_relation.source_id,
-                }
+                },
+                on_conflict="lemma_id,source_id",
+                ignore_duplicates=True,
             )
             .execute()
         )
 
-        return response.data is not None and len(response.data) > 0
+        return response.data is not None
 
     def bulk_add_lemma_source_relations(
         self, rels: list[LemmaSourceRelation]
@@ -583,23 +640,30 @@ class LexDbIntegrator:
             return False
 
         # Remove duplicates
-        rels = [rel for i, rel in enumerate(rels) if rel not in rels[i + 1 :]]
+        keys = dict.fromkeys((rel.lemma_id, rel.source_id) for rel in rels)
 
-        if not self._all_lemmata_exist([rel.lemma_id for rel in rels]):
+        if not self._all_lemmata_exist([lemma_id for lemma_id, _ in keys]):
             return False
 
         # Prepare data for bulk insert
         insert_data = [
-            {"lemma_id": rel.lemma_id, "source_id": rel.source_id}
-            for rel in rels
+            {"lemma_id": lemma_id, "source_id": source_id}
+            for lemma_id, source_id in keys
         ]
 
-        # Batch insert using Supabase
+        # Batch insert using Supabase, relations which are already in the
+        # database are skipped
         response = (
-            self.connection.table("lemma_source").insert(insert_data).execute()
+            self.connection.table("lemma_source")
+            .upsert(
+                insert_data,
+                on_conflict="lemma_id,source_id",
+                ignore_duplicates=True,
+            )
+            .execute()
         )
 
-        return response.data is not None and len(response.data) > 0
+        return response.data is not None
 
     def get_lemma_sources(self, lemma_id: LemmaId) -> list[Source]:
         """
@@ -616,16 +680,10 @@ class LexDbIntegrator:
         if not response.data:
             return []
 
-        # Extract unique source IDs
-        source_ids = [SourceId(item["source_id"]) for item in response.data]
-
-        # Get all sources using these IDs
-        sources = []
-        for source_id in source_ids:
-            if source := self.get_source(source_id):
-                sources.append(source)
-
-        return sources
+        # Get all sources using these IDs in one go
+        return self.get_sources(
+            [SourceId(item["source_id"]) for item in response.data]
+        )
 
     def get_lemma_source_relation_ids(
         self,
@@ -660,37 +718,51 @@ class LexDbIntegrator:
         Adds a new context to the database if it doesn't exist already.
         Returns -1 if the source doesn't exist.
         """
-        if not self.get_source(context.source_id):
+        # Looked up and inserted in one transaction, see bulk_add_contexts
+        if not (context_ids := self.bulk_add_contexts([context])):
             print(
                 "Did not add context because source id not associated with"
                 " source"
             )
             return ContextId(-1)
 
-        # Check if context exists first
-        if (
-            context_id := self.get_context_id(
-                context.context_value, context.source_id
-            )
-        ) != -1:
-            return context_id
+        return context_ids[0]
 
-        # Insert new context using Supabase
-        response = (
-            self.connection.table("context")
-            .insert(
-                {
-                    "context_value": context.context_value,
-                    "source_id": context.source_id,
-                }
-            )
-            .execute()
-        )
+    def bulk_add_contexts(self, contexts: list[Context]) -> list[ContextId]:
+        """
+        Adds multiple contexts if they don't exist already, like
+        add_context. Returns their ids in the order of the input, contexts
+        which occur more than once in the input share one row.
+        Returns an empty list if one of the sources doesn't exist.
 
-        if not response.data or len(response.data) == 0:
-            return ContextId(-1)
+        Runs in the bulk_add_contexts database function (db/migrations), so
+        adding the same contexts again, e.g. on a rerun ingest or a retried
+        request, doesn't duplicate them.
+        """
+        if not contexts:
+            return []
 
-        return ContextId(response.data[0]["id"])
+        for source_id in {context.source_id for context in contexts}:
+            if not self.get_source(source_id):
+                return []
+
+        response = self.connection.rpc(
+            "bulk_add_contexts",
+            {
+                "contexts": [
+                    {
+                        "context_value": context.context_value,
+                        "source_id": context.source_id,
+                    }
+                    for context in contexts
+                ]
+            },
+        ).execute()
+
+        if not response.data or len(response.data) != len(contexts):
+            return []
+
+        return [ContextId(context_id) for context_id in response.data]
 
     def get_context(self, context_id: ContextId) -> Union[Context, None]:
         """
@@ -732,23 +804,21 @@ class LexDbIntegrator:
         return [parse_obj_as(Context, item) for item in response.data]
 
     def get_paginated_contexts(
-        self, page: int, page_size: int
+        self,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
     ) -> list[Context]:
         """
-        Returns a list of contexts.
+        Returns a list of contexts, paginated as described in _paginate.
         """
-        # Set up pagination
-        start = (page - 1) * page_size
-        end = start + page_size - 1
-
         # Query using Supabase
-        response = (
-            self.connection.table("context")
-            .select("*")
-            .order("id")
-            .range(start, end)
-            .execute()
-        )
+        response = self._paginate(
+            self.connection.table("context").select("*"),
+            page,
+            page_size,
+            after_id,
+        ).execute()
 
         if not response.data:
             return []
@@ -756,24 +826,25 @@ class LexDbIntegrator:
         return [parse_obj_as(Context, item) for item in response.data]
 
     def get_paginated_source_contexts(
-        self, source_id: SourceId, page: int, page_size: int
+        self,
+        source_id: SourceId,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
     ) -> list[Context]:
         """
-        Returns a list of contexts from a specific source with pagination.
+        Returns a list of contexts from a specific source with pagination,
+        see _paginate.
         """
-        # Set up pagination
-        start = (page - 1) * page_size
-        end = start + page_size - 1
-
         # Query using Supabase
-        response = (
+        response = self._paginate(
             self.connection.table("context")
             .select("*")
-            .eq("source_id", source_id)
-            .order("id")
-            .range(start, end)
-            .execute()
-        )
+            .eq("source_id", source_id),
+            page,
+            page_size,
+            after_id,
+        ).execute()
 
         if not response.data:
             return []
@@ -813,24 +884,29 @@ class LexDbIntegrator:
         ):
             return LemmaContextId(-1)
 
-        # Insert using Supabase
+        # Insert using Supabase, an existing relation is kept
         response = (
             self.connection.table("lemma_context")
-            .insert(
+            .upsert(
                 {
                     "lemma_id": lemma_context.lemma_id,
                     "context_id": lemma_context.context_id,
                     "upos_tag": lemma_context.upos_tag.value,
                     "detailed_tag": lemma_context.detailed_tag,
-                }
+                },
+                on_conflict=LEMMA_CONTEXT_UNIQUE_COLUMNS,
+                ignore_duplicates=True,
             )
             .execute()
         )
 
-        if not response.data or len(response.data) == 0:
-            return LemmaContextId(-1)
+        if response.data:
+            return LemmaContextId(response.data[0]["id"])
+
+        if existing := self.get_lemma_context_relations(lemma_context):
+            return existing[0].id
 
-        return LemmaContextId(response.data[0]["id"])
+        return LemmaContextId(-1)
 
     def bulk_add_lemma_context_relations(
         self, rels: list[LemmaContextRelation]
@@ -848,28 +924,35 @@ class LexDbIntegrator:
             return False
 
         # Remove duplicates
-        rels = [rel for i, rel in enumerate(rels) if rel not in rels[i + 1 :]]
+        keys = dict.fromkeys(
+            (rel.lemma_id, rel.context_id, rel.upos_tag, rel.detailed_tag)
+            for rel in rels
+        )
 
         # Prepare data for bulk insert
-        insert_data = []
-        for rel in rels:
-            insert_data.append(
-                {
-                    "lemma_id": rel.lemma_id,
-                    "context_id": rel.context_id,
-                    "upos_tag": rel.upos_tag.value,
-                    "detailed_tag": rel.detailed_tag,
-                }
-            )
+        insert_data = [
+            {
+                "lemma_id": lemma_id,
+                "context_id": context_id,
+                "upos_tag": upos_tag.value,
+                "detailed_tag": detailed_tag,
+            }
+            for lemma_id, context_id, upos_tag, detailed_tag in keys
+        ]
 
-        # Batch insert using Supabase
+        # Batch insert using Supabase, relations which are already in the
+        # database are skipped
         response = (
             self.connection.table("lemma_context")
-            .insert(insert_data)
+            .upsert(
+                insert_data,
+                on_conflict=LEMMA_CONTEXT_UNIQUE_COLUMNS,
+                ignore_duplicates=True,
+            )
             .execute()
         )
 
-        return response.data is not None and len(response.data) > 0
+        return response.data is not None
 
     def get_lemma_context_relation(
         self, lemma_context_id: LemmaContextId
@@ -892,46 +975,33 @@ class LexDbIntegrator:
         return parse_obj_as(LemmaContextRelation, result_data)
 
     def get_lemma_contexts(
-        self, lemma_id: LemmaId, page: int, page_size: int
+        self,
+        lemma_id: LemmaId,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
     ) -> list[Context]:
         """
-        Returns all contexts a lemma appears in.
-        """
-        # Calculate pagination limits
-        limit = page_size
-        offset = (page - 1) * page_size
+        Returns all contexts a lemma appears in, paginated by context id as
+        described in _paginate.
 
-        # First get context_ids from lemma_context table
-        response = (
-            self.connection.table("lemma_context")
-            .select("context_id")
-            .eq("lemma_id", lemma_id)
-            .order("context_id")
-            .range(offset, offset + limit - 1)
-            .execute()
-        )
+        Reads from lemma_context_view (db/migrations), so that a page is a
+        single query whose cost doesn't depend on how often the lemma
+        occurs.
+        """
+        response = self._paginate(
+            self.connection.table("lemma_context_view")
+            .select("id, context_value, created, source_id")
+            .eq("lemma_id", lemma_id),
+            page,
+            page_size,
+            after_id,
+        ).execute()
 
         if not response.data:
             return []
 
-        # Extract unique context IDs
-        context_ids = sorted({item["context_id"] for item in response.data})
-
-        # Now fetch the actual contexts
-        if not context_ids:
-            return []
-
-        contexts_response = (
-            self.connection.table("context")
-            .select("*")
-            .in_("id", context_ids)
-            .execute()
-        )
-
-        if not contexts_response.data:
-            return []
-
-        return [parse_obj_as(Context, item) for item in contexts_response.data]
+        return [parse_obj_as(Context, item) for item in response.data]
 
     def get_lemma_context_relations(
         self, lemma_context: LemmaContextRelation
@@ -970,18 +1040,7 @@ class LexDbIntegrator:
         """
         Returns a status.
         """
-        # This is the same as get_status_by_id, using Supabase
-        response = (
-            self.connection.table("lemma_status")
-            .select("*")
-            .eq("id", status_id)
-            .execute()
-        )
-
-        if not response.data or len(response.data) == 0:
-            return None
-
-        return parse_obj_as(Status, response.data[0])
+        return self.get_status_by_id(status_id)
 
     def update_lemmata_status(
         self, lemma_ids: list[LemmaId], new_status_id: StatusId
@@ -994,30 +1053,47 @@ class LexDbIntegrator:
         if not self.get_status_by_id(new_status_id):
             return False
 
-        # Verify all lemma IDs exist
-        for lid in lemma_ids:
-            if not self.get_lemma(lid):
-                return False
-            if s := self.get_lemma_status(lid):
-                if s.id == new_status_id:
-                    return False
+        unique_ids = list(dict.fromkeys(lemma_ids))
+        chunks = list(chunked(unique_ids, IN_FILTER_CHUNK_SIZE))
 
-        # Update using Supabase
-        response = (
-            self.connection.table("lemma")
-            .update({"status_id": new_status_id})
-            .in_("id", lemma_ids)
-            .execute()
-        )
+        # Verify all lemma IDs exist and don't have the new status yet,
+        # with one select per chunk
+        status_ids = {}
+        for chunk in chunks:
+            response = (
+                self.connection.table("lemma")
+                .select("id, status_id")
+                .in_("id", chunk)
+                .execute()
+            )
+            for item in response.data or []:
+                status_ids[item["id"]] = item["status_id"]
 
-        if not response.data or len(response.data) == 0:
+        if (
+            not unique_ids
+            or len(status_ids) != len(unique_ids)
+            or new_status_id in status_ids.values()
+        ):
             return False
 
-        # Verify update was successful
-        if lemma_ids:
-            status = self.get_lemma_status(lemma_ids[0])
-            return status is not None and status.id == new_status_id
-        return True
+        # Update using Supabase. Lemmata whose status changed in the
+        # meantime are left alone and fail the verification below.
+        updated = {}
+        for chunk in chunks:
+            response = (
+                self.connection.table("lemma")
+                .update({"status_id": new_status_id})
+                .in_("id", chunk)
+                .neq("status_id", new_status_id)
+                .execute()
+            )
+            for item in response.data or []:
+                updated[item["id"]] = item["status_id"]
+
+        # Verify update was successful, using the updated rows returned
+        return updated.keys() == status_ids.keys() and all(
+            status_id == new_status_id for status_id in updated.values()
+        )
 
     def update_lemma_context_relation(
         self,
@@ -1078,165 +1154,57 @@ class LexDbIntegrator:
         Keeps source and contexts even if they were only associated with
         the deleted lemma.
         """
-        # Check if lemma exists
-        lemma = self.get_lemma(lemma_id)
-        if not lemma:
-            return False
-
-        # Get the found_in_source of the lemma before deleting
-        found_in_source = lemma.found_in_source
-
-        # Get all context IDs associated with the lemma from lemma_context
-        response = (
-            self.connection.table("lemma_context")
-            .select("context_id")
-            .eq("lemma_id", lemma_id)
-            .execute()
-        )
-        context_ids = {
-            ContextId(item["context_id"]) for item in response.data or []
-        }
-
-        # For each context ID, update the context_value to remove this
-        # lemma_id references
-        for context_id in context_ids:
-            # First get the context value
-            context_response = (
-                self.connection.table("context")
-                .select("context_value")
-                .eq("id", context_id)
-                .execute()
-            )
-            if context_response.data and len(context_response.data) > 0:
-                context_value = context_response.data[0]["context_value"]
-                # Remove lemma_id references using regex
-                updated_context_value = re.sub(
-                    rf"(::{lemma_id})(\D)", r"\g<2>", context_value
-                )
-                # Update the context value
-                self.connection.table("context").update(
-                    {"context_value": updated_context_value}
-                ).eq("id", context_id).execute()
-
-        # Delete all entries in lemma_context with this lemma_id
-        self.connection.table("lemma_context").delete().eq(
-            "lemma_id", lemma_id
-        ).execute()
-
-        # Delete all entries in lemma_source with this lemma_id
-        self.connection.table("lemma_source").delete().eq(
-            "lemma_id", lemma_id
-        ).execute()
-
-        # If the source exists, increase its removed_lemmata_num counter
-        source = self.get_source(found_in_source)
-        if source:
-            self.connection.table("source").update(
-                {"removed_lemmata_num": source.removed_lemmata_num + 1}
-            ).eq("id", found_in_source).execute()
-
-        # Finally delete the lemma itself
-        self.connection.table("lemma").delete().eq("id", lemma_id).execute()
-
-        # Verify deletion was successful
-        return self.get_lemma(lemma_id) is None
+        return self.bulk_delete_lemmata({lemma_id})
 
     def bulk_delete_lemmata(self, lemma_ids: set[LemmaId]) -> bool:
         """
-        Bulk delete multiple lemmata and their related data
-        """
-        lemma_ids = list(lemma_ids)
-        if not self._all_lemmata_exist(lemma_ids):
-            return False
-
-        # Get all lemma data before deletion
-        lemmata = self.bulk_get_lemmata(lemma_ids)
-
-        # Track source IDs for later updating removed_lemmata_num
-        source_counter = Counter([lemma.found_in_source for lemma in lemmata])
-
-        # Get all context IDs associated with the lemmata from lemma_context
-        response = (
-            self.connection.table("lemma_context")
-            .select("context_id")
-            .in_("lemma_id", lemma_ids)
-            .execute()
-        )
-        context_ids = {
-            ContextId(item["context_id"]) for item in response.data or []
-        }
-
-        # For each context ID, update the context_value to remove lemma_id
-        # references
-        for context_id in context_ids:
-            # First get the context value
-            context_response = (
-                self.connection.table("context")
-                .select("context_value")
-                .eq("id", context_id)
-                .execute()
-            )
-            if context_response.data and len(context_response.data) > 0:
-                context_value = context_response.data[0]["context_value"]
-                updated_context_value = context_value
-
-                # Apply regex replacement for each lemma ID
-                for lemma_id in lemma_ids:
-                    updated_context_value = re.sub(
-                        rf"(::{lemma_id})(\D)", r"\g<2>", updated_context_value
-                    )
-
-                # Update the context value if changed
-                if updated_context_value != context_value:
-                    self.connection.table("context").update(
-                        {"context_value": updated_context_value}
-                    ).eq("id", context_id).execute()
-
-        # Delete all entries in lemma_context with these lemma_ids
-        self.connection.table("lemma_context").delete().in_(
-            "lemma_id", lemma_ids
-        ).execute()
+        Bulk delete multiple lemmata and their related data.
 
-        # Delete all entries in lemma_source with these lemma_ids
-        self.connection.table("lemma_source").delete().in_(
-            "lemma_id", lemma_ids
+        Removes the lemma ids from the context values, deletes the
+        relations, increases removed_lemmata_num of the sources the lemmata
+        were found in and deletes the lemmata. All of this runs in the
+        bulk_delete_lemmata database function (db/migrations), i.e. in a
+        single transaction.
+        Doesn't delete any of them if one of the ids doesn't exist.
+        """
+        response = self.connection.rpc(
+            "bulk_delete_lemmata", {"lemma_ids": list(lemma_ids)}
         ).execute()
 
-        # Update removed_lemmata_num for each affected source
-        for source_id, count in source_counter.items():
-            source = self.get_source(source_id)
-            if source:
-                self.connection.table("source").update(
-                    {"removed_lemmata_num": source.removed_lemmata_num + count}
-                ).eq("id", source_id).execute()
-
-        # Finally delete the lemmata themselves
-        self.connection.table("lemma").delete().in_("id", lemma_ids).execute()
+        if response.data is not True:
+            return False
 
-        # Verify deletion was successful (none of the lemmata should exist
-        # anymore)
-        return len(self.bulk_get_lemmata(lemma_ids)) == 0
+        self.lemma_id_cache.discard_values(lemma_ids)
+        return True
 
     def _all_lemmata_exist(self, lemma_ids: list[LemmaId]) -> bool:
         """
         Check if all lemmata in a list exist
+
+        The ids which don't exist are evicted from the lemma id cache. They
+        were handed out from it after another process deleted the lemmata,
+        the next lookup of the lemmata goes to the database again.
         """
         if not lemma_ids:
             return True
 
+        unique_ids = list(dict.fromkeys(lemma_ids))
+
         # Supabase requires a different approach than count(*)
-        response = (
-            self.connection.table("lemma")
-            .select("id")
-            .in_("id", lemma_ids)
-            .execute()
-        )
+        found_ids: set[LemmaId] = set()
+        for chunk in chunked(unique_ids, IN_FILTER_CHUNK_SIZE):
+            response = (
+                self.connection.table("lemma")
+                .select("id")
+                .in_("id", chunk)
+                .execute()
+            )
+            found_ids.update(item["id"] for item in response.data or [])
 
-        if not response.data:
+        if missing_ids := set(unique_ids) - found_ids:
+            self.lemma_id_cache.discard_values(missing_ids)
             return False
-
-        # Compare the count of returned IDs with the count of requested IDs
-        return len(response.data) == len(lemma_ids)
+        return True
 
     def _all_contexts_exist(self, context_ids: list[ContextId]) -> bool:
         """
@@ -1245,18 +1213,20 @@ class LexDbIntegrator:
         if not context_ids:
             return True
 
-        response = (
-            self.connection.table("context")
-            .select("id")
-            .in_("id", context_ids)
-            .execute()
-        )
+        unique_ids = list(dict.fromkeys(context_ids))
 
-        if not response.data:
-            return False
+        found_num = 0
+        for chunk in chunked(unique_ids, IN_FILTER_CHUNK_SIZE):
+            response = (
+                self.connection.table("context")
+                .select("id")
+                .in_("id", chunk)
+                .execute()
+            )
+            found_num += len(response.data or [])
 
         # Compare the count of returned IDs with the count of requested IDs
-        return len(response.data) == len(context_ids)
+        return found_num == len(unique_ids)
 
     def delete_lemma_context_relation(
         self, lemma_context_id: LemmaContextId
@@ -1279,6 +1249,218 @@ class LexDbIntegrator:
         return response.data is not None and len(response.data) > 0
 
 
+class AsyncLexDbIntegrator:
+    """
+    Awaitable counterpart of the LexDbIntegrator methods the API uses, e.g.
+
+        db = AsyncLexDbIntegrator(LexDbIntegrator(env))
+        lemma = await db.get_lemma(lemma_id)
+
+    The storage backends are synchronous, so rather than a second, async
+    implementation of every query, each method runs the blocking call of
+    the wrapped integrator in a worker thread and the event loop keeps
+    serving other requests in the meantime. The threads are limited to
+    Const.DB_MAX_THREADS per event loop, independently of the thread pool
+    of the framework.
+    """
+
+    def __init__(self, db: LexDbIntegrator) -> None:
+        self.sync = db
+        self.env = db.env
+
+    @staticmethod
+    async def _run(fn: Callable[..., T], *args: Any) -> T:
+        try:
+            limiter = _db_thread_limiter.get()
+        except LookupError:
+            limiter = anyio.CapacityLimiter(Const.DB_MAX_THREADS)
+            _db_thread_limiter.set(limiter)
+        return await anyio.to_thread.run_sync(fn, *args, limiter=limiter)
+
+    async def add_source_kind(
+        self, source_kind: SourceKindVal
+    ) -> SourceKindId:
+        return await self._run(self.sync.add_source_kind, source_kind)
+
+    async def get_source_kind(
+        self, source_kind_id: SourceKindId
+    ) -> Union[SourceKind, None]:
+        return await self._run(self.sync.get_source_kind, source_kind_id)
+
+    async def add_source(self, source: Source) -> SourceId:
+        return await self._run(self.sync.add_source, source)
+
+    async def get_source(self, source_id: SourceId) -> Union[Source, None]:
+        return await self._run(self.sync.get_source, source_id)
+
+    async def get_sources(self, source_ids: list[SourceId]) -> list[Source]:
+        return await self._run(self.sync.get_sources, source_ids)
+
+    async def get_paginated_sources(
+        self,
+        page: int,
+        page_size: int,
+        filter_params: Union[dict[str, Union[int, str]], None] = None,
+        after_id: Union[SourceId, None] = None,
+    ) -> list[Source]:
+        return await self._run(
+            self.sync.get_paginated_sources,
+            page,
+            page_size,
+            filter_params,
+            after_id,
+        )
+
+    async def add_status(self, status_val: StatusVal) -> StatusId:
+        return await self._run(self.sync.add_status, status_val)
+
+    async def get_status_id(self, status_val: StatusVal) -> StatusId:
+        return await self._run(self.sync.get_status_id, status_val)
+
+    async def get_status_by_id(
+        self, status_id: StatusId
+    ) -> Union[Status, None]:
+        return await self._run(self.sync.get_status_by_id, status_id)
+
+    async def add_lemma(self, lemma: Lemma) -> LemmaId:
+        return await self._run(self.sync.add_lemma, lemma)
+
+    async def bulk_add_lemma(
+        self,
+        lemmata_values: list[str],
+        status_id: StatusId,
+        found_in_source: SourceId,
+    ) -> dict[str, LemmaId]:
+        return await self._run(
+            self.sync.bulk_add_lemma,
+            lemmata_values,
+            status_id,
+            found_in_source,
+        )
+
+    async def get_lemma(self, lemma_id: LemmaId) -> Union[Lemma, None]:
+        return await self._run(self.sync.get_lemma, lemma_id)
+
+    async def get_status_lemma_rows(
+        self,
+        status_val: StatusVal,
+        page: int = 1,
+        page_size: int = 100,
+        after_id: Union[LemmaId, None] = None,
+    ) -> list[Lemma]:
+        return await self._run(
+            self.sync.get_status_lemma_rows,
+            status_val,
+            page,
+            page_size,
+            after_id,
+        )
+
+    async def get_status_lemma_rows_table(
+        self,
+        status_val: StatusVal,
+        page: int = 1,
+        page_size: int = 100,
+    ) -> str:
+        return await self._run(
+            self.sync.get_status_lemma_rows_table, status_val, page, page_size
+        )
+
+    async def get_lemma_id(self, lemma_value: str) -> LemmaId:
+        return await self._run(self.sync.get_lemma_id, lemma_value)
+
+    async def bulk_get_lemma_id_dict(
+        self, lemmata_values: list[str]
+    ) -> dict[str, LemmaId]:
+        return await self._run(
+            self.sync.bulk_get_lemma_id_dict, lemmata_values
+        )
+
+    async def add_lemma_source_relation(
+        self, lemma_source_relation: LemmaSourceRelation
+    ) -> bool:
+        return await self._run(
+            self.sync.add_lemma_source_relation, lemma_source_relation
+        )
+
+    async def bulk_add_lemma_source_relations(
+        self, rels: list[LemmaSourceRelation]
+    ) -> bool:
+        return await self._run(self.sync.bulk_add_lemma_source_relations, rels)
+
+    async def get_lemma_sources(self, lemma_id: LemmaId) -> list[Source]:
+        return await self._run(self.sync.get_lemma_sources, lemma_id)
+
+    async def add_context(self, context: Context) -> ContextId:
+        return await self._run(self.sync.add_context, context)
+
+    async def bulk_add_contexts(
+        self, contexts: list[Context]
+    ) -> list[ContextId]:
+        return await self._run(self.sync.bulk_add_contexts, contexts)
+
+    async def get_paginated_contexts(
+        self,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
+    ) -> list[Context]:
+        return await self._run(
+            self.sync.get_paginated_contexts, page, page_size, after_id
+        )
+
+    async def get_paginated_source_contexts(
+        self,
+        source_id: SourceId,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
+    ) -> list[Context]:
+        return await self._run(
+            self.sync.get_paginated_source_contexts,
+            source_id,
+            page,
+            page_size,
+            after_id,
+        )
+
+    async def add_lemma_context_relation(
+        self,
+        lemma_context: LemmaContextRelation,
+    ) -> LemmaContextId:
+        return await self._run(
+            self.sync.add_lemma_context_relation, lemma_context
+        )
+
+    async def bulk_add_lemma_context_relations(
+        self, rels: list[LemmaContextRelation]
+    ) -> bool:
+        return await self._run(
+            self.sync.bulk_add_lemma_context_relations, rels
+        )
+
+    async def get_lemma_contexts(
+        self,
+        lemma_id: LemmaId,
+        page: int,
+        page_size: int,
+        after_id: Union[ContextId, None] = None,
+    ) -> list[Context]:
+        return await self._run(
+            self.sync.get_lemma_contexts, lemma_id, page, page_size, after_id
+        )
+
+    async def update_lemmata_status(
+        self, lemma_ids: list[LemmaId], new_status_id: StatusId
+    ) -> bool:
+        return await self._run(
+            self.sync.update_lemmata_status, lemma_ids, new_status_id
+        )
+
+    async def bulk_delete_lemmata(self, lemma_ids: set[LemmaId]) -> bool:
+        return await self._run(self.sync.bulk_delete_lemmata, lemma_ids)
+
+
 if __name__ == "__main__":
     """
     Examples of how to use the Supabase-based LexDbIntegrator
@@ -0,0 +1,147 @@
+"""
+Metrics
+=======
+Prometheus metrics of the API, exposed on /metrics: latency, response size
+and number of database calls per route, and the requests in progress.
+
+Under gunicorn, every worker writes its metrics to the directory in
+PROMETHEUS_MULTIPROC_DIR and /metrics adds them up, see gunicorn.conf.py.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Union
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from ._storage import StorageCall
+
+REQUEST_LATENCY = Histogram(
+    "lex_http_request_duration_seconds",
+    "Latency of the API requests.",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "lex_http_requests_in_progress",
+    "API requests which are being handled.",
+    multiprocess_mode="livesum",
+)
+REQUEST_DB_CALLS = Histogram(
+    "lex_http_request_db_calls",
+    "Database calls per API request.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf")),
+)
+RESPONSE_SIZE = Histogram(
+    "lex_http_response_size_bytes",
+    "Size of the API response bodies.",
+    ["method", "route"],
+    buckets=(1e2, 1e3, 1e4, 1e5, 1e6, 1e7, float("inf")),
+)
+DB_CALLS = Counter(
+    "lex_db_calls_total",
+    "Database calls by table and operation.",
+    ["table", "op"],
+)
+DB_CALL_LATENCY = Histogram(
+    "lex_db_call_duration_seconds",
+    "Latency of the database calls.",
+    ["table", "op"],
+)
+
+# Number of database calls of the request being handled. Worker threads
+# which run the queries see the same counter as they copy the context.
+_request_db_calls: ContextVar[Union[list[int], None]] = ContextVar(
+    "_request_db_calls", default=None
+)
+
+# Label of requests which didn't match a route, e.g. 404s, to keep the
+# number of label values bounded
+UNMATCHED_ROUTE = "unmatched"
+
+
+def record_db_call(call: StorageCall) -> None:
+    """
+    Storage observer which records the call for the current request.
+    """
+    DB_CALLS.labels(call.table, call.op).inc()
+    DB_CALL_LATENCY.labels(call.table, call.op).observe(call.seconds)
+    if (calls := _request_db_calls.get()) is not None:
+        calls[0] += 1
+
+
+def latest_metrics() -> bytes:
+    """
+    Returns the metrics in Prometheus text format, those of all workers in
+    multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware which records the request metrics. Requests are
+    labelled with the path template of their route, not the actual path.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+        self._route_paths: dict[Any, str] = {}
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message: dict) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        db_calls = [0]
+        token = _request_db_calls.set(db_calls)
+        start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            seconds = time.perf_counter() - start
+            _request_db_calls.reset(token)
+
+            method, route = scope["method"], self._route(scope)
+            REQUEST_LATENCY.labels(method, route, status).observe(seconds)
+            REQUEST_DB_CALLS.labels(method, route).observe(db_calls[0])
+            RESPONSE_SIZE.labels(method, route).observe(size)
+
+    def _route(self, scope: dict) -> str:
+        # The router stores the matched endpoint in the scope
+        if (endpoint := scope.get("endpoint")) is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self._route_paths:
+            self._route_paths = {
+                getattr(route, "endpoint", None): getattr(
+                    route, "path", UNMATCHED_ROUTE
+                )
+                for route in scope["app"].routes
+            }
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE)
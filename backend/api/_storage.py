@@ -0,0 +1,628 @@
+"""
+Storage
+=======
+Storage backends of the Lex database API.
+
+LexDbIntegrator builds its queries with the PostgREST query builder
+interface (table(...).select(...).eq(...).execute()). SupabaseBackend
+passes them on to Supabase, SqliteBackend runs the same queries against an
+embedded SQLite database. ObservedBackend wraps either of them to report
+the queries they execute.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any, NamedTuple, Protocol, Union
+
+from dotenv import load_dotenv
+from supabase import Client, create_client
+
+from ._dbtypes import DbEnvironment
+from ._utils import absolutify_path_from_root, chunked
+
+
+class StorageBackend(Protocol):
+    """
+    Interface LexDbIntegrator uses to access the database.
+    """
+
+    def table(self, table_name: str) -> Any:
+        """
+        Returns a PostgREST-style query builder for the table.
+        """
+        ...
+
+    def rpc(self, fn: str, params: dict[str, Any]) -> Any:
+        """
+        Returns a request calling the database function fn.
+        """
+        ...
+
+    def truncate(self, tables: list[str]) -> None:
+        """
+        Wipes the rows of the tables and resets their ids.
+        """
+        ...
+
+
+def create_backend(env: DbEnvironment) -> StorageBackend:
+    """
+    Creates the backend configured by LEX_DB_BACKEND ('supabase' or
+    'sqlite'). The SQLite database file is set by LEX_SQLITE_PATH_<ENV>.
+    """
+    load_dotenv()
+    backend = os.getenv("LEX_DB_BACKEND", "supabase")
+
+    if backend == "sqlite":
+        return SqliteBackend(
+            os.getenv(
+                f"LEX_SQLITE_PATH_{env.value}",
+                absolutify_path_from_root(
+                    f"/backend/db/lex.{env.value.lower()}.sqlite3"
+                ),
+            )
+        )
+
+    if backend == "supabase":
+        return SupabaseBackend.from_env(env)
+
+    raise ValueError(f"Unknown LEX_DB_BACKEND '{backend}'")
+
+
+class SupabaseBackend:
+    """
+    Backend for the hosted Supabase database.
+    """
+
+    def __init__(self, client: Client, schema: str = "public") -> None:
+        self.client = client
+        self.schema = schema
+
+    @classmethod
+    def from_env(cls, env: DbEnvironment) -> "SupabaseBackend":
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+
+        # Get the appropriate schema based on environment
+        schema = os.getenv(
+            "SUPABASE_SCHEMA_PROD"
+            if env == DbEnvironment.PROD
+            else "SUPABASE_SCHEMA_DEV",
+            "public",
+        )
+
+        if not supabase_url or not supabase_key:
+            raise ValueError(
+                "SUPABASE_URL and SUPABASE_KEY must be set in .env"
+            )
+
+        return cls(create_client(supabase_url, supabase_key), schema)
+
+    def table(self, table_name: str) -> Any:
+        return self.client.table(table_name)
+
+    def rpc(self, fn: str, params: dict[str, Any]) -> Any:
+        return self.client.rpc(fn, params)
+
+    def truncate(self, tables: list[str]) -> None:
+        truncate_query = (
+            f"TRUNCATE TABLE {', '.join(tables)} RESTART IDENTITY CASCADE;"
+        )
+        self.client.rpc("execute_sql", {"sql": truncate_query}).execute()
+
+
+class SqliteResponse(NamedTuple):
+    data: Any
+    count: Union[int, None] = None
+
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Rows per statement, keeps the number of bound parameters below
+# SQLite's limit
+_INSERT_CHUNK_SIZE = 500
+
+
+def _identifier(name: str) -> str:
+    name = name.strip()
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid identifier '{name}'")
+    return name
+
+
+class SqliteQuery:
+    """
+    Subset of the PostgREST query builder used by LexDbIntegrator.
+    """
+
+    def __init__(self, backend: "SqliteBackend", table: str) -> None:
+        self._backend = backend
+        self._table = _identifier(table)
+        self._operation = "select"
+        self._columns = "*"
+        self._count: Union[str, None] = None
+        self._rows: list[dict[str, Any]] = []
+        self._values: dict[str, Any] = {}
+        self._on_conflict: list[str] = []
+        self._ignore_duplicates = False
+        self._filters: list[tuple[str, list[Any]]] = []
+        self._order: list[str] = []
+        self._limit: Union[int, None] = None
+        self._offset: Union[int, None] = None
+
+    def select(
+        self, *columns: str, count: Union[str, None] = None
+    ) -> "SqliteQuery":
+        names = [c for c in ",".join(columns).split(",") if c.strip()]
+        if names and names != ["*"]:
+            self._columns = ", ".join(_identifier(c) for c in names)
+        self._count = count
+        return self
+
+    def insert(self, json: Union[dict, list], **kwargs: Any) -> "SqliteQuery":
+        self._operation = "insert"
+        self._rows = [json] if isinstance(json, dict) else list(json)
+        return self
+
+    def upsert(
+        self,
+        json: Union[dict, list],
+        on_conflict: str = "",
+        ignore_duplicates: bool = False,
+        **kwargs: Any,
+    ) -> "SqliteQuery":
+        self.insert(json)
+        self._operation = "upsert"
+        self._on_conflict = [
+            _identifier(c) for c in on_conflict.split(",") if c.strip()
+        ] or ["id"]
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json: dict, **kwargs: Any) -> "SqliteQuery":
+        self._operation = "update"
+        self._values = json
+        return self
+
+    def delete(self, **kwargs: Any) -> "SqliteQuery":
+        self._operation = "delete"
+        return self
+
+    def _filter(self, column: str, op: str, value: Any) -> "SqliteQuery":
+        self._filters.append((f"{_identifier(column)} {op} ?", [value]))
+        return self
+
+    def eq(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, "<>", value)
+
+    def gt(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "SqliteQuery":
+        return self._filter(column, "<=", value)
+
+    def in_(self, column: str, values: list[Any]) -> "SqliteQuery":
+        values = list(values)
+        placeholders = ", ".join("?" * len(values))
+        self._filters.append(
+            (f"{_identifier(column)} IN ({placeholders})", values)
+        )
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "SqliteQuery":
+        self._order.append(
+            f"{_identifier(column)} {'DESC' if desc else 'ASC'}"
+        )
+        return self
+
+    def limit(self, size: int) -> "SqliteQuery":
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int) -> "SqliteQuery":
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def _where(self) -> tuple[str, list[Any]]:
+        if not self._filters:
+            return "", []
+        clause = " AND ".join(f for f, _ in self._filters)
+        params = [p for _, ps in self._filters for p in ps]
+        return f" WHERE {clause}", params
+
+    def execute(self) -> SqliteResponse:
+        if self._operation == "select":
+            return self._execute_select()
+        if self._operation in ("insert", "upsert"):
+            return self._execute_insert()
+        if self._operation == "update":
+            return self._execute_update()
+        return self._execute_delete()
+
+    def _execute_select(self) -> SqliteResponse:
+        where, params = self._where()
+        sql = f"SELECT {self._columns} FROM {self._table}{where}"
+        if self._order:
+            sql += f" ORDER BY {', '.join(self._order)}"
+        if self._limit is not None or self._offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [
+                -1 if self._limit is None else self._limit,
+                self._offset or 0,
+            ]
+
+        count = None
+        with self._backend.read() as connection:
+            data = [dict(row) for row in connection.execute(sql, params)]
+            if self._count:
+                where, count_params = self._where()
+                (count,) = connection.execute(
+                    f"SELECT count(*) FROM {self._table}{where}", count_params
+                ).fetchone()
+        return SqliteResponse(data, count)
+
+    def _execute_insert(self) -> SqliteResponse:
+        if not self._rows:
+            return SqliteResponse([])
+
+        columns = [_identifier(c) for c in self._rows[0]]
+        sql = (
+            f"INSERT INTO {self._table} ({', '.join(columns)})"
+            f" VALUES ({', '.join('?' * len(columns))})"
+        )
+        if self._operation == "upsert":
+            conflict = f" ON CONFLICT ({', '.join(self._on_conflict)})"
+            if self._ignore_duplicates:
+                sql += f"{conflict} DO NOTHING"
+            else:
+                updates = ", ".join(f"{c} = excluded.{c}" for c in columns)
+                sql += f"{conflict} DO UPDATE SET {updates} RETURNING *"
+
+        params = [tuple(row[c] for c in columns) for row in self._rows]
+
+        with self._backend.transaction() as connection:
+            if sql.endswith("RETURNING *"):
+                # Updated rows keep their ids, fetch them one by one
+                data = [
+                    dict(connection.execute(sql, p).fetchone()) for p in params
+                ]
+                return SqliteResponse(data)
+
+            # Ids are assigned in ascending order and the transaction holds
+            # the write lock, so all rows above the previous maximum id are
+            # the inserted ones
+            (max_id,) = connection.execute(
+                f"SELECT coalesce(max(id), 0) FROM {self._table}"
+            ).fetchone()
+            for chunk in chunked(params, _INSERT_CHUNK_SIZE):
+                connection.executemany(sql, chunk)
+            data = [
+                dict(row)
+                for row in connection.execute(
+                    f"SELECT * FROM {self._table} WHERE id > ? ORDER BY id",
+                    (max_id,),
+                )
+            ]
+        return SqliteResponse(data)
+
+    def _execute_update(self) -> SqliteResponse:
+        where, params = self._where()
+        columns = [_identifier(c) for c in self._values]
+        assignments = ", ".join(f"{c} = ?" for c in columns)
+        sql = f"UPDATE {self._table} SET {assignments}{where} RETURNING *"
+        with self._backend.transaction() as connection:
+            data = [
+                dict(row)
+                for row in connection.execute(
+                    sql, [self._values[c] for c in columns] + params
+                )
+            ]
+        return SqliteResponse(data)
+
+    def _execute_delete(self) -> SqliteResponse:
+        where, params = self._where()
+        sql = f"DELETE FROM {self._table}{where} RETURNING *"
+        with self._backend.transaction() as connection:
+            data = [dict(row) for row in connection.execute(sql, params)]
+        return SqliteResponse(data)
+
+
+class SqliteRpc(NamedTuple):
+    backend: "SqliteBackend"
+    fn: Callable[..., Any]
+    params: dict[str, Any]
+
+    def execute(self) -> SqliteResponse:
+        with self.backend.transaction() as connection:
+            return SqliteResponse(self.fn(connection, **self.params))
+
+
+class SqliteBackend:
+    """
+    Backend for an embedded SQLite database, e.g. for offline ingests and
+    tests. path may be ':memory:'.
+
+    The database functions of db/migrations are implemented in Python and
+    run in a single transaction like their Postgres counterparts.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # A single connection shared by all threads, access is serialised
+        # with the lock
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._connection.create_function(
+            "regexp_replace",
+            3,
+            lambda value, pattern, replacement: re.sub(
+                pattern, replacement, value
+            ),
+            deterministic=True,
+        )
+
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA busy_timeout = 5000")
+
+        with open(
+            absolutify_path_from_root("/backend/db/schema.sqlite.sql")
+        ) as f:
+            self._connection.executescript(f.read())
+
+        self._functions: dict[str, Callable[..., Any]] = {
+            "bulk_add_contexts": _bulk_add_contexts,
+            "bulk_delete_lemmata": _bulk_delete_lemmata,
+        }
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            yield self._connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def table(self, table_name: str) -> SqliteQuery:
+        return SqliteQuery(self, table_name)
+
+    def rpc(self, fn: str, params: dict[str, Any]) -> SqliteRpc:
+        if fn not in self._functions:
+            raise ValueError(f"Unknown database function '{fn}'")
+        return SqliteRpc(self, self._functions[fn], params)
+
+    def truncate(self, tables: list[str]) -> None:
+        with self.transaction() as connection:
+            for table in tables:
+                connection.execute(f"DELETE FROM {_identifier(table)}")
+            connection.execute(
+                "DELETE FROM sqlite_sequence WHERE name IN"
+                f" ({', '.join('?' * len(tables))})",
+                tables,
+            )
+
+
+class StorageCall(NamedTuple):
+    """
+    A query executed by a storage backend. table is the function name of
+    an rpc.
+    """
+
+    table: str
+    op: str
+    rows: int
+    seconds: float
+
+
+StorageObserver = Callable[[StorageCall], None]
+
+_QUERY_OPS = {"select", "insert", "upsert", "update", "delete"}
+
+
+class ObservedQuery:
+    """
+    Query builder of an ObservedBackend. Passes the calls on to the wrapped
+    builder and reports the query once it is executed.
+    """
+
+    def __init__(
+        self,
+        backend: "ObservedBackend",
+        table: str,
+        query: Any,
+        op: str = "select",
+    ) -> None:
+        self._backend = backend
+        self._table = table
+        self._query = query
+        self._op = op
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return self._wrap(attr, name)
+
+        def build(*args: Any, **kwargs: Any) -> Any:
+            return self._wrap(attr(*args, **kwargs), name)
+
+        return build
+
+    def _wrap(self, query: Any, name: str) -> Any:
+        # Builders are chained until execute, other attributes pass through
+        if not hasattr(query, "execute"):
+            return query
+        op = name if name in _QUERY_OPS else self._op
+        return ObservedQuery(self._backend, self._table, query, op)
+
+    def execute(self) -> Any:
+        rows = 0
+        start = time.perf_counter()
+        try:
+            response = self._query.execute()
+            data = response.data
+            rows = len(data) if isinstance(data, list) else int(bool(data))
+            return response
+        finally:
+            self._backend.notify(
+                StorageCall(
+                    self._table, self._op, rows, time.perf_counter() - start
+                )
+            )
+
+
+class ObservedBackend:
+    """
+    Backend which reports every query it executes to the observers, e.g.
+    to count the database calls of an API request. Observers are called
+    in the thread which executed the query.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        observers: Union[list[StorageObserver], None] = None,
+    ) -> None:
+        self.backend = backend
+        self.observers = observers or []
+
+    def table(self, table_name: str) -> ObservedQuery:
+        return ObservedQuery(self, table_name, self.backend.table(table_name))
+
+    def rpc(self, fn: str, params: dict[str, Any]) -> ObservedQuery:
+        return ObservedQuery(self, fn, self.backend.rpc(fn, params), "rpc")
+
+    def truncate(self, tables: list[str]) -> None:
+        start = time.perf_counter()
+        try:
+            self.backend.truncate(tables)
+        finally:
+            self.notify(
+                StorageCall(
+                    ",".join(tables),
+                    "truncate",
+                    0,
+                    time.perf_counter() - start,
+                )
+            )
+
+    def notify(self, call: StorageCall) -> None:
+        for observer in self.observers:
+            observer(call)
+
+
+def _bulk_add_contexts(
+    connection: sqlite3.Connection, contexts: list[dict[str, Any]]
+) -> list[int]:
+    """
+    See db/migrations/004_bulk_add_contexts.sql. The transaction holds the
+    write lock, which serialises concurrent calls. The contexts are joined
+    with the table rather than matched with IN, which SQLite answers with
+    a scan instead of idx_context_source_value.
+    """
+    keys = [(c["context_value"], c["source_id"]) for c in contexts]
+    unique_keys = list(dict.fromkeys(keys))
+
+    context_ids: dict[tuple[str, int], int] = {}
+    for chunk in chunked(unique_keys, _INSERT_CHUNK_SIZE):
+        context_ids.update(
+            ((row[0], row[1]), row[2])
+            for row in connection.execute(
+                "SELECT k.column1, k.column2, min(context.id)"
+                f" FROM (VALUES {', '.join(['(?, ?)'] * len(chunk))}) AS k"
+                " JOIN context ON context.source_id = k.column2"
+                " AND context.context_value = k.column1"
+                " GROUP BY k.column1, k.column2",
+                [value for key in chunk for value in key],
+            )
+        )
+
+    for key in unique_keys:
+        if key not in context_ids:
+            context_ids[key] = connection.execute(
+                "INSERT INTO context (context_value, source_id) VALUES (?, ?)",
+                key,
+            ).lastrowid
+
+    return [context_ids[key] for key in keys]
+
+
+def _bulk_delete_lemmata(
+    connection: sqlite3.Connection, lemma_ids: list[int]
+) -> bool:
+    """
+    See db/migrations/002_bulk_delete_lemmata.sql
+    """
+    lemma_ids = list(dict.fromkeys(lemma_ids))
+    placeholders = ", ".join("?" * len(lemma_ids))
+
+    (found_num,) = connection.execute(
+        f"SELECT count(*) FROM lemma WHERE id IN ({placeholders})", lemma_ids
+    ).fetchone()
+    if found_num != len(lemma_ids):
+        return False
+
+    connection.executemany(
+        r"""
+        UPDATE context
+        SET context_value = regexp_replace(
+            context_value, '::' || ? || '(\D)', '\1'
+        )
+        WHERE id IN (
+            SELECT context_id FROM lemma_context WHERE lemma_id = ?
+        )
+        """,
+        [(lid, lid) for lid in lemma_ids],
+    )
+
+    connection.execute(
+        f"""
+        UPDATE source
+        SET removed_lemmata_num = removed_lemmata_num + (
+            SELECT count(*) FROM lemma
+            WHERE found_in_source = source.id AND id IN ({placeholders})
+        )
+        WHERE id IN (
+            SELECT found_in_source FROM lemma WHERE id IN ({placeholders})
+        )
+        """,
+        lemma_ids + lemma_ids,
+    )
+
+    for table, column in (
+        ("lemma_context", "lemma_id"),
+        ("lemma_source", "lemma_id"),
+        ("lemma", "id"),
+    ):
+        connection.execute(
+            f"DELETE FROM {table} WHERE {column} IN ({placeholders})",
+            lemma_ids,
+        )
+
+    return True
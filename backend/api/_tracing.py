@@ -0,0 +1,212 @@
+"""
+Query Tracing
+=============
+Records every query LexDbIntegrator executes, with its table, operation,
+row count and duration, attributed to the public LexDbIntegrator method
+which ran it. Shows how many queries an API request or a CLI command fans
+out to.
+
+Enabled by setting LEX_QUERY_TRACE to the path of a json lines file. A
+record is appended to it for every API request, and for every CLI command
+which runs queries in process (LEX_API_MODE=embedded). CLI commands also
+print a summary.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, NamedTuple, Union
+
+from rich import print as rprint
+from tabulate import tabulate
+
+from ._db import LexDbIntegrator
+from ._storage import StorageCall
+
+UNKNOWN_CALLER = "unknown"
+
+
+class QueryTrace(NamedTuple):
+    caller: str
+    table: str
+    op: str
+    rows: int
+    seconds: float
+
+
+# Traces of the request being handled. Worker threads which run the
+# queries see the same list as they copy the context.
+_request_traces: ContextVar[Union[list[QueryTrace], None]] = ContextVar(
+    "_request_traces", default=None
+)
+
+
+def trace_path() -> Union[str, None]:
+    return os.getenv("LEX_QUERY_TRACE") or None
+
+
+def _caller() -> str:
+    """
+    Name of the outermost public LexDbIntegrator method on the stack, i.e.
+    the one called by the API handler.
+    """
+    caller = UNKNOWN_CALLER
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        module = frame.f_globals.get("__name__")
+        if module == LexDbIntegrator.__module__ and not name.startswith("_"):
+            caller = name
+        frame = frame.f_back
+    return caller
+
+
+class QueryTracer:
+    """
+    Storage observer which collects the queries per request, and those of
+    the whole process while collect is active.
+    """
+
+    def __init__(self) -> None:
+        self._collections: list[list[QueryTrace]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, call: StorageCall) -> None:
+        trace = QueryTrace(_caller(), *call)
+        if (traces := _request_traces.get()) is not None:
+            traces.append(trace)
+        with self._lock:
+            for collection in self._collections:
+                collection.append(trace)
+
+    @contextmanager
+    def request(self) -> Iterator[list[QueryTrace]]:
+        traces: list[QueryTrace] = []
+        token = _request_traces.set(traces)
+        try:
+            yield traces
+        finally:
+            _request_traces.reset(token)
+
+    @contextmanager
+    def collect(self) -> Iterator[list[QueryTrace]]:
+        traces: list[QueryTrace] = []
+        with self._lock:
+            self._collections.append(traces)
+        try:
+            yield traces
+        finally:
+            with self._lock:
+                self._collections.remove(traces)
+
+
+TRACER = QueryTracer()
+
+
+def summarise(traces: list[QueryTrace]) -> str:
+    """
+    Table of the queries per caller, table and operation, callers with the
+    most queries first.
+    """
+    groups: dict[tuple[str, str, str], list[QueryTrace]] = defaultdict(list)
+    for trace in traces:
+        groups[trace.caller, trace.table, trace.op].append(trace)
+    caller_queries: dict[str, int] = defaultdict(int)
+    for (caller, _, _), group in groups.items():
+        caller_queries[caller] += len(group)
+
+    return tabulate(
+        [
+            (
+                caller,
+                table,
+                op,
+                len(group),
+                sum(trace.rows for trace in group),
+                f"{sum(trace.seconds for trace in group) * 1_000:.1f}",
+            )
+            for (caller, table, op), group in sorted(
+                groups.items(),
+                key=lambda item: (-caller_queries[item[0][0]], item[0]),
+            )
+        ],
+        headers=["caller", "table", "op", "queries", "rows", "ms"],
+    )
+
+
+def dump(scope: dict[str, Any], traces: list[QueryTrace]) -> None:
+    """
+    Appends a record of the traces to the LEX_QUERY_TRACE file.
+    """
+    if not (path := trace_path()):
+        return
+    record = {
+        **scope,
+        "queries": len(traces),
+        "seconds": sum(trace.seconds for trace in traces),
+        "traces": [trace._asdict() for trace in traces],
+    }
+    # A single write, so that the records of concurrent workers don't mix
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def trace_command(command: str) -> Iterator[None]:
+    """
+    Traces the queries the process runs until the command has finished,
+    e.g. those of the embedded API. Does nothing unless LEX_QUERY_TRACE is
+    set.
+    """
+    if not trace_path():
+        yield
+        return
+
+    start = time.perf_counter()
+    with TRACER.collect() as traces:
+        try:
+            yield
+        finally:
+            if traces:
+                rprint(summarise(traces))
+            dump(
+                {
+                    "command": command,
+                    "elapsed_seconds": time.perf_counter() - start,
+                },
+                traces,
+            )
+
+
+class QueryTraceMiddleware:
+    """
+    ASGI middleware which dumps the queries of every request.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        with TRACER.request() as traces:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                dump(
+                    {
+                        "request": f"{scope['method']} {scope['path']}",
+                        "query_string": scope["query_string"].decode(),
+                        "elapsed_seconds": time.perf_counter() - start,
+                    },
+                    traces,
+                )
@@ -3,8 +3,11 @@ Collection of utility methods
 """
 
 import subprocess
+import threading
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Iterator, Mapping, Sequence
 from pathlib import Path
-from typing import Union
+from typing import Generic, TypeVar, Union
 
 from rich.progress import (
     BarColumn,
@@ -28,6 +31,74 @@ def buf_count_newlines(path: Union[Path, str]) -> int:
     return count
 
 
+T = TypeVar("T")
+
+
+def chunked(items: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LruCache(Generic[K, V]):
+    """
+    Thread-safe mapping with at most max_size entries. When full, the
+    least recently used entry is evicted. Lookups are counted as hits and
+    misses.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Union[V, None]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[K]) -> dict[K, V]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put(self, key: K, value: V) -> None:
+        self.put_many({key: value})
+
+    def put_many(self, entries: Mapping[K, V]) -> None:
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard_values(self, values: Collection[V]) -> None:
+        """
+        Removes all entries with one of the values.
+        """
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v in values]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
 def get_git_root() -> str:
     # E.g. '/Users/ericjanto/Developer/Projects/lex'
     command = ["git", "rev-parse", "--show-toplevel"]
@@ -0,0 +1,276 @@
+"""
+Vocabulary Index
+================
+Compiled, read-only form of a vocabulary text file, which is memory-mapped
+instead of loaded into a set. Processes which map the same index share
+its pages, and opening it costs the same no matter how large the
+vocabulary is.
+
+The index is stored next to the text file (vocabulary.base.txt ->
+vocabulary.base.idx) and rebuilt when the size or modification time of
+the text file no longer match those it was built from. Commands which
+only look up a few entries, e.g. rm, may instead read the entries which
+were only appended to the text file since into memory, until there are
+more than Const.VOCAB_MAX_APPENDED of them.
+
+Layout, all integers little-endian:
+- header, see _HEADER
+- bloom filter of bloom_bytes bytes, padded to 8 bytes
+- entry_num + 1 offsets (uint32) into the entries, the last one is the end
+- the sorted, utf-8 encoded entries without separators
+"""
+
+import hashlib
+import heapq
+import mmap
+import os
+import secrets
+import struct
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Union
+
+from ._const import Const
+
+_MAGIC = b"LEXVOCAB"
+_VERSION = 2
+# magic, version, hash_num, entry_num, bloom_bytes, source_size,
+# source_mtime_ns, source_digest
+_HEADER = struct.Struct("<8sIIQQQQ16s")
+_OFFSET = struct.Struct("<I")
+
+
+def _bloom_positions(entry: bytes, hash_num: int, bit_num: int) -> list[int]:
+    # Double hashing: the i-th position is h1 + i * h2
+    digest = hashlib.blake2b(entry, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bit_num for i in range(hash_num)]
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+def _source_digest(source: bytes) -> bytes:
+    """
+    Digest of the content of a text file, or b"" if it doesn't end between
+    two entries, as what is appended to it then can't be read on its own.
+    """
+    if source and not source[-1:].isspace():
+        return b""
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
+class VocabIndex:
+    """
+    Set-like membership test on a compiled vocabulary.
+
+    A lookup checks the bloom filter first, which rules out most absent
+    entries, and binary searches the sorted entries otherwise. The results
+    are memoised per process, as the same lemmata are looked up over and
+    over while parsing.
+    """
+
+    def __init__(
+        self, index_path: Union[str, Path], appended: Iterable[str] = ()
+    ) -> None:
+        self.index_path = str(index_path)
+        # Entries appended to the text file since the index was built
+        self._appended = frozenset(appended)
+        with open(self.index_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            self._hash_num,
+            self._entry_num,
+            bloom_bytes,
+            self.source_size,
+            self.source_mtime_ns,
+            self.source_digest,
+        ) = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{self.index_path} is not a vocabulary index")
+
+        self._bloom_start = _HEADER.size
+        self._bloom_bits = bloom_bytes * 8
+        self._offsets_start = (
+            self._bloom_start + bloom_bytes + _pad(bloom_bytes)
+        )
+        self._entries_start = (
+            self._offsets_start + (self._entry_num + 1) * _OFFSET.size
+        )
+        self._memo: dict[str, bool] = {}
+
+    @classmethod
+    def load(
+        cls,
+        text_path: Union[str, Path],
+        index_path: Union[str, Path, None] = None,
+        keep_appended: bool = False,
+    ) -> "VocabIndex":
+        """
+        Opens the index of the text file, (re)building it first if it is
+        missing or out of date.
+
+        With keep_appended, entries which were only appended to the text
+        file are kept in memory instead, unless there are too many of
+        them. This saves the rebuild for a few lookups, but reads the whole
+        text file on every load, so it doesn't pay off for parsing.
+        """
+        index_path = index_path or Path(text_path).with_suffix(".idx")
+        stat = os.stat(text_path)
+        try:
+            index = cls(index_path)
+            if (index.source_size, index.source_mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                return index
+            if keep_appended:
+                appended = index._read_appended(text_path)
+                if appended is not None and (
+                    len(appended) <= Const.VOCAB_MAX_APPENDED
+                ):
+                    index._appended = appended
+                    return index
+            index.close()
+        except (OSError, ValueError, struct.error):
+            pass
+
+        cls.build(text_path, index_path)
+        return cls(index_path)
+
+    @staticmethod
+    def build(
+        text_path: Union[str, Path], index_path: Union[str, Path]
+    ) -> None:
+        """
+        Compiles the whitespace separated entries of the text file. The
+        index is written to a temporary file first and moved into place, so
+        that concurrent readers never see a partial index.
+        """
+        stat = os.stat(text_path)
+        with open(text_path, "rb") as f:
+            source = f.read()
+        entries = sorted({entry.encode() for entry in source.decode().split()})
+
+        bloom_bytes = max(
+            -(-len(entries) * Const.VOCAB_BLOOM_BITS_PER_ENTRY // 8), 1
+        )
+        bloom = bytearray(bloom_bytes)
+        for entry in entries:
+            for pos in _bloom_positions(
+                entry, Const.VOCAB_BLOOM_HASH_NUM, bloom_bytes * 8
+            ):
+                bloom[pos >> 3] |= 1 << (pos & 7)
+
+        offsets = [0]
+        for entry in entries:
+            offsets.append(offsets[-1] + len(entry))
+
+        tmp_path = f"{index_path}.{secrets.token_hex(8)}.tmp"
+        # Created with the mode open() would give it, which the umask
+        # restricts, unlike mkstemp, which makes it private to the owner
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    _HEADER.pack(
+                        _MAGIC,
+                        _VERSION,
+                        Const.VOCAB_BLOOM_HASH_NUM,
+                        len(entries),
+                        bloom_bytes,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        _source_digest(source),
+                    )
+                )
+                f.write(bloom)
+                f.write(bytes(_pad(bloom_bytes)))
+                f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+                f.writelines(entries)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> "VocabIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._entry_num + len(self._appended)
+
+    def __contains__(self, entry: Any) -> bool:
+        if (found := self._memo.get(entry)) is None:
+            found = isinstance(entry, str) and (
+                entry in self._appended or self._lookup(entry.encode())
+            )
+            if len(self._memo) >= Const.VOCAB_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[entry] = found
+        return found
+
+    def __iter__(self) -> Iterator[str]:
+        # Sorting the utf-8 encoded entries sorts them by code point too
+        return heapq.merge(
+            (self._entry(i).decode() for i in range(self._entry_num)),
+            sorted(self._appended),
+        )
+
+    def __reduce__(self) -> tuple:
+        # Worker processes map the file themselves instead of receiving a
+        # copy of the entries
+        return (VocabIndex, (self.index_path, self._appended))
+
+    def _read_appended(
+        self, text_path: Union[str, Path]
+    ) -> Union[frozenset[str], None]:
+        """
+        Returns the entries appended to the text file since the index was
+        built which are not in it yet, or None if the file was changed
+        otherwise.
+        """
+        with open(text_path, "rb") as f:
+            source = f.read()
+        digest = _source_digest(source[: self.source_size])
+        if not digest or digest != self.source_digest:
+            return None
+        return frozenset(
+            entry
+            for entry in source[self.source_size :].decode().split()
+            if not self._lookup(entry.encode())
+        )
+
+    def _lookup(self, entry: bytes) -> bool:
+        for pos in _bloom_positions(entry, self._hash_num, self._bloom_bits):
+            if not self._map[self._bloom_start + (pos >> 3)] >> (pos & 7) & 1:
+                return False
+
+        lo, hi = 0, self._entry_num
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (mid_entry := self._entry(mid)) < entry:
+                lo = mid + 1
+            elif mid_entry > entry:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def _entry(self, i: int) -> bytes:
+        start, end = struct.unpack_from(
+            "<II", self._map, self._offsets_start + i * _OFFSET.size
+        )
+        return self._map[
+            self._entries_start + start : self._entries_start + end
+        ]
@@ -3,18 +3,20 @@ API
 ===
 Exposes endpoints to interact with the database.
 
-TODO: merge _db.py into this. Possible with async?
+The handlers await the database through AsyncLexDbIntegrator, which runs
+the blocking queries in worker threads.
 """
 
 import os
 from typing import TypedDict, Union
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel
 from rich import print as rprint
 
-from ._db import LexDbIntegrator
+from ._db import AsyncLexDbIntegrator, LexDbIntegrator
 from ._dbtypes import (
     Context,
     ContextId,
@@ -35,6 +37,9 @@ from ._dbtypes import (
     StatusId,
     StatusVal,
 )
+from ._metrics import MetricsMiddleware, latest_metrics, record_db_call
+from ._storage import ObservedBackend, create_backend
+from ._tracing import TRACER, QueryTraceMiddleware, trace_path
 
 origins = ["*"]
 
@@ -45,13 +50,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware)
+if trace_path():
+    app.add_middleware(QueryTraceMiddleware)
 
 
 def set_db_env(env: DbEnvironment):
     global db
     rprint(f"[green]Connected to {env.value} database schema.")
-    db = LexDbIntegrator(env)
+    observers = [record_db_call, TRACER] if trace_path() else [record_db_call]
+    backend = ObservedBackend(create_backend(env), observers)
+    db = AsyncLexDbIntegrator(LexDbIntegrator(env, backend))
 
 
 if os.environ.get("VERCEL"):
@@ -64,6 +75,15 @@ class EmptyDict(TypedDict, total=False):
     pass
 
 
+def set_next_cursor(response: Response, rows: list, page_size: int) -> None:
+    """
+    Sets the X-Next-Cursor header of a paginated response to the after_id
+    of the next page. Omitted if this is the last page.
+    """
+    if rows and len(rows) >= page_size:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+
+
 class LemmaValue(BaseModel):
     value: str
 
@@ -78,40 +98,55 @@ async def read_root():
     return {"api_status": "working"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    # CONTENT_TYPE_LATEST has a charset already, media_type would add one
+    return Response(
+        latest_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST}
+    )
+
+
 @app.get("/lemma/{lemma_id}")
 async def get_lemma(lemma_id: LemmaId) -> Union[Lemma, EmptyDict]:
-    return db.get_lemma(lemma_id) or EmptyDict()
+    return await db.get_lemma(lemma_id) or EmptyDict()
 
 
 @app.get("/bulk_lemma")
 async def bulk_get_lemma(lemmata_values: list[str]) -> dict[str, LemmaId]:
-    return db.bulk_get_lemma_id_dict(lemmata_values)
+    return await db.bulk_get_lemma_id_dict(lemmata_values)
 
 
 @app.get("/lemma_id")
 async def get_lemma_id(lemma: LemmaValue) -> LemmaId:
-    return db.get_lemma_id(lemma.value)
+    return await db.get_lemma_id(lemma.value)
 
 
 @app.get("/lemma_status/{status_val}")
 async def get_status_id(status_val: StatusVal) -> StatusId:
-    return db.get_status_id(status_val)
+    return await db.get_status_id(status_val)
 
 
 @app.get("/lemma_status_by_id/{status_id}")
 async def get_status_by_id(status_id: StatusId) -> Union[Status, None]:
-    return db.get_status_by_id(status_id)
+    return await db.get_status_by_id(status_id)
 
 
 @app.get("/status_lemmata")
 async def get_status_lemma_rows(
+    response: Response,
     status_val: StatusVal,
-    page: Union[int, None],
-    page_size: Union[int, None] = None,
+    page: int = 1,
+    page_size: int = 100,
+    after_id: Union[LemmaId, None] = None,
 ) -> list[Lemma]:
-    return db.get_status_lemma_rows(
-        status_val=status_val, page=page, page_size=page_size
+    lemmata = await db.get_status_lemma_rows(
+        status_val=status_val,
+        page=page,
+        page_size=page_size,
+        after_id=after_id,
     )
+    set_next_cursor(response, lemmata, page_size)
+    return lemmata
 
 
 @app.get("/status_lemmata_table")
@@ -120,63 +155,105 @@ async def get_status_lemma_rows_table(
     page: Union[int, None],
     page_size: Union[int, None] = None,
 ) -> str:
-    return db.get_status_lemma_rows_table(
+    return await db.get_status_lemma_rows_table(
         status_val=status_val, page=page, page_size=page_size
     )
 
 
 @app.get("/contexts")
-async def get_paginated_contexts(page: int, page_size: int) -> list[Context]:
-    return db.get_paginated_contexts(page, page_size)
+async def get_paginated_contexts(
+    response: Response,
+    page_size: int,
+    page: int = 1,
+    after_id: Union[ContextId, None] = None,
+) -> list[Context]:
+    contexts = await db.get_paginated_contexts(page, page_size, after_id)
+    set_next_cursor(response, contexts, page_size)
+    return contexts
 
 
 @app.get("/lemma_contexts/{lemma_id}")
 async def get_lemma_contexts(
-    lemma_id: LemmaId, page: int, page_size: int
+    response: Response,
+    lemma_id: LemmaId,
+    page_size: int,
+    page: int = 1,
+    after_id: Union[ContextId, None] = None,
 ) -> list[Context]:
-    return db.get_lemma_contexts(lemma_id, page, page_size)
+    contexts = await db.get_lemma_contexts(lemma_id, page, page_size, after_id)
+    set_next_cursor(response, contexts, page_size)
+    return contexts
 
 
 @app.get("/sources")
 async def get_sources(
-    page: int,
+    response: Response,
     page_size: int,
+    page: int = 1,
+    after_id: Union[SourceId, None] = None,
     author: Union[str, None] = None,
     lang: Union[str, None] = None,
     source_kind_id: Union[SourceKindId, None] = None,
 ) -> list[Source]:
-    args = locals()
     filter_params = {
         k: v
-        for k, v in args.items()
-        if v is not None and k not in ["page", "page_size"]
+        for k, v in {
+            "author": author,
+            "lang": lang,
+            "source_kind_id": source_kind_id,
+        }.items()
+        if v is not None
     } or None
 
-    return db.get_paginated_sources(page, page_size, filter_params)
+    sources = await db.get_paginated_sources(
+        page, page_size, filter_params, after_id
+    )
+    set_next_cursor(response, sources, page_size)
+    return sources
 
 
 @app.get("/source/{source_id}")
 async def get_source(source_id: SourceId) -> Union[Source, None]:
-    return db.get_source(source_id)
+    return await db.get_source(source_id)
+
+
+@app.get("/bulk_sources")
+async def bulk_get_sources(
+    ids: list[SourceId] = Query(default=[]),
+) -> list[Source]:
+    return await db.get_sources(ids)
+
+
+@app.get("/lemma_sources/{lemma_id}")
+async def get_lemma_sources(lemma_id: LemmaId) -> list[Source]:
+    return await db.get_lemma_sources(lemma_id)
 
 
 @app.get("/source_kind/{source_kind_id}")
 async def get_source_kind(
     source_kind_id: SourceKindId,
 ) -> Union[SourceKind, None]:
-    return db.get_source_kind(source_kind_id)
+    return await db.get_source_kind(source_kind_id)
 
 
 @app.get("/source_contexts/{source_id}")
 async def get_source_contexts(
-    source_id: SourceId, page: int, page_size: int
+    response: Response,
+    source_id: SourceId,
+    page_size: int,
+    page: int = 1,
+    after_id: Union[ContextId, None] = None,
 ) -> list[Context]:
-    return db.get_paginated_source_contexts(source_id, page, page_size)
+    contexts = await db.get_paginated_source_contexts(
+        source_id, page, page_size, after_id
+    )
+    set_next_cursor(response, contexts, page_size)
+    return contexts
 
 
 @app.post("/lemma")
 async def post_lemma(lemma: Lemma) -> LemmaId:
-    return db.add_lemma(lemma)
+    return await db.add_lemma(lemma)
 
 
 @app.post("/bulk_lemmata")
@@ -189,7 +266,7 @@ async def post_bulk_lemmata(
 
     status_id = lemmata[0].status_id
     found_in_source = lemmata[0].found_in_source
-    return db.bulk_add_lemma(
+    return await db.bulk_add_lemma(
         [lemma.lemma for lemma in lemmata],
         status_id=status_id,
         found_in_source=found_in_source,
@@ -198,57 +275,62 @@ async def post_bulk_lemmata(
 
 @app.post("/lemma_status")
 async def post_status(status_val: StatusVal) -> StatusId:
-    return db.add_status(status_val)
+    return await db.add_status(status_val)
 
 
 @app.post("/lemma_source")
 async def post_lemma_source_relation(
     lemma_source_relation: LemmaSourceRelation,
 ) -> LemmaSourceId:
-    return db.add_lemma_source_relation(lemma_source_relation)
+    return await db.add_lemma_source_relation(lemma_source_relation)
 
 
 @app.post("/bulk_lemma_source")
 async def bulk_post_lemma_source_relations(
     rels: list[LemmaSourceRelation],
 ) -> bool:
-    return db.bulk_add_lemma_source_relations(rels)
+    return await db.bulk_add_lemma_source_relations(rels)
 
 
 @app.post("/source_kind")
 async def post_source_kind(source_kind_val: SourceKindVal) -> SourceKindId:
-    return db.add_source_kind(source_kind_val)
+    return await db.add_source_kind(source_kind_val)
 
 
 @app.post("/source")
 async def post_source(source: Source) -> SourceId:
-    return db.add_source(source)
+    return await db.add_source(source)
 
 
 @app.post("/context")
 async def post_context(context: Context) -> ContextId:
-    return db.add_context(context)
+    return await db.add_context(context)
+
+
+@app.post("/bulk_contexts")
+async def bulk_post_contexts(contexts: list[Context]) -> list[ContextId]:
+    return await db.bulk_add_contexts(contexts)
 
 
 @app.post("/lemma_context")
 async def post_lemma_context_relation(
     lemma_context_relation: LemmaContextRelation,
 ) -> LemmaContextId:
-    return db.add_lemma_context_relation(lemma_context_relation)
+    return await db.add_lemma_context_relation(lemma_context_relation)
 
 
 @app.post("/bulk_lemma_context")
 async def bulk_post_lemma_context_relations(
     rels: list[LemmaContextRelation],
 ) -> bool:
-    return db.bulk_add_lemma_context_relations(rels)
+    return await db.bulk_add_lemma_context_relations(rels)
 
 
 @app.delete("/lemma")
 async def delete_lemma(lemma_ids: list[LemmaId]):
-    return all(db.delete_lemma(lid) for lid in lemma_ids)
+    return await db.bulk_delete_lemmata(set(lemma_ids))
 
 
 @app.patch("/status")
 async def update_status(lemma_ids: list[LemmaId], new_status_id: StatusId):
-    return db.update_lemmata_status(lemma_ids, new_status_id)
+    return await db.update_lemmata_status(lemma_ids, new_status_id)
@@ -0,0 +1,302 @@
+"""
+Ingest Benchmark
+================
+Runs the stages of TextParser.parse_into_db on a reproducible synthetic
+corpus and reports their throughput, so that regressions in textparser.py
+show up before they hit production.
+
+The transformer is replaced by a synthetic tagger on a blank English
+pipeline, and the writes go through the embedded API into a temporary
+SQLite database. Numbers are comparable between runs on the same machine,
+not with real ingests.
+
+Run from backend/: python -m benchmarks.ingest [--lines 1000 --lines ...]
+"""
+
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import zlib
+from itertools import accumulate
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, Union
+
+import spacy
+import typer
+from rich import print as rprint
+from spacy.lang.en.stop_words import STOP_WORDS
+from spacy.language import Language
+from spacy.tokens import Doc
+from tabulate import tabulate
+
+from api._const import Const
+from api._db import AsyncLexDbIntegrator, LexDbIntegrator
+from api._dbtypes import (
+    DbEnvironment,
+    LemmaId,
+    SourceKindVal,
+    StatusVal,
+    UposTag,
+)
+from api._storage import SqliteBackend
+from api._utils import buf_count_newlines
+from cli.stagemetrics import StageMetrics
+
+if TYPE_CHECKING:
+    from cli.apirequestor import ApiRequestor
+
+SYLLABLES = (
+    "ka ri mo te lu sa ven dor fil gra wen tho bel mir og ast ul pre nik"
+    " zor ald yth cor ish em qua ton"
+).split()
+
+UPOS_TAGS = (
+    (UposTag.NOUN, "NN"),
+    (UposTag.VERB, "VBD"),
+    (UposTag.ADJ, "JJ"),
+    (UposTag.ADV, "RB"),
+    (UposTag.PROPN, "NNP"),
+    (UposTag.DET, "DT"),
+    (UposTag.ADP, "IN"),
+    (UposTag.PRON, "PRP"),
+)
+
+
+def generate_corpus(path: str, line_num: int, seed: int = 0) -> None:
+    """
+    Writes line_num lines of synthetic prose to path. The same seed always
+    produces the same text.
+
+    Stop words are mixed with pseudo-words drawn from a Zipf-like
+    distribution, so that common words repeat like they do in books.
+    """
+    rng = random.Random(seed)
+    stop_words = sorted(STOP_WORDS)
+    pseudo_words = list(
+        dict.fromkeys(
+            "".join(rng.choices(SYLLABLES, k=rng.randint(1, 4)))
+            for _ in range(20_000)
+        )
+    )
+    cum_weights = list(
+        accumulate(1 / rank for rank in range(1, len(pseudo_words) + 1))
+    )
+
+    with open(path, "w") as f:
+        for i in range(line_num):
+            if i % 9 == 8:
+                f.write("\n")
+                continue
+
+            words = []
+            for _ in range(rng.randint(8, 16)):
+                if rng.random() < 0.55:
+                    words.append(rng.choice(stop_words))
+                else:
+                    words.extend(
+                        rng.choices(pseudo_words, cum_weights=cum_weights)
+                    )
+            line = " ".join(words)
+            f.write(f"{line[0].upper()}{line[1:]}{rng.choice('.,;!?')}\n")
+
+
+@Language.component("synthetic_tagger")
+def synthetic_tagger(doc: Doc) -> Doc:
+    """
+    Assigns a deterministic lemma, tag and part of speech to every token,
+    in place of the transformer pipes.
+    """
+    for token in doc:
+        lemma = token.lower_
+        pos, tag = UPOS_TAGS[zlib.crc32(lemma.encode()) % len(UPOS_TAGS)]
+        token.lemma_ = lemma
+        token.pos_ = pos.value
+        token.tag_ = tag
+    return doc
+
+
+def use_sqlite() -> None:
+    """
+    Points the PROD database at a throwaway SQLite database. index, which
+    the embedded API and with it the parser import, connects to PROD on
+    import, so this must run before any of them is imported. The benchmark
+    then never needs nor touches Supabase.
+    """
+    os.environ["LEX_DB_BACKEND"] = "sqlite"
+    os.environ["LEX_SQLITE_PATH_PROD"] = ":memory:"
+
+
+def load_synthetic_nlp() -> Language:
+    from cli.textparser import TextParser
+
+    nlp = spacy.blank("en")
+    TextParser._customise_tokenisation(nlp)
+    nlp.add_pipe("synthetic_tagger")
+    return nlp
+
+
+class Stage(NamedTuple):
+    name: str
+    seconds: float
+    peak_rss_mb: float
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if os.uname().sysname == "Darwin" else rss / 2**10
+
+
+def connect_embedded_api(
+    db_path: str,
+) -> tuple["ApiRequestor", list[int]]:
+    """
+    Points the embedded API at a fresh SQLite database. Returns the
+    requestor and a counter of the requests it sends.
+    """
+    from api import index
+    from cli.apirequestor import ApiMode, ApiRequestor
+
+    index.db = AsyncLexDbIntegrator(
+        LexDbIntegrator(DbEnvironment.DEV, SqliteBackend(db_path))
+    )
+    api = ApiRequestor(ApiMode.EMBEDDED)
+    request_num = [0]
+
+    def count_request(_):
+        request_num[0] += 1
+
+    api.session.event_hooks["request"].append(count_request)
+    return api, request_num
+
+
+def run(
+    content_path: str, db_path: str, nlp: Language, batch_size: int
+) -> tuple[list[Stage], dict[str, float]]:
+    """
+    Runs the stages on the content and returns their timings and totals.
+
+    The windows are parsed by TextParser._parse_windows, which records the
+    read, nlp, spill and filter stages. Like in parse_into_db, the stages
+    after normalisation are interleaved in a single streaming pass, their
+    peak RSS is that of the whole pass.
+    """
+    from cli.textparser import TextParser
+
+    metrics = StageMetrics()
+
+    with metrics.time("normalise"):
+        TextParser._normalise_file(content_path)
+    normalise_rss = peak_rss_mb()
+
+    api, request_num = connect_embedded_api(db_path)
+    source_id = api.post_source(
+        title="Synthetic",
+        source_kind_id=api.post_source_kind(SourceKindVal.BOOK),
+        author="benchmarks.ingest",
+        lang="en",
+    )
+    status_id = api.post_status(StatusVal.STAGED)
+    setup_request_num = request_num[0]
+
+    token_num = window_num = 0
+    with TextParser._load_vocabs() as vocabs, open(
+        content_path
+    ) as f, api.buffered_writer(source_id, status_id) as writer:
+        for parsed in TextParser._parse_windows(
+            nlp,
+            TextParser._iter_windows(f),
+            *vocabs,
+            batch_size,
+            metrics,
+        ):
+            # Serialised with placeholder ids, as the writer only does so
+            # once it knows the real ones
+            with metrics.time("serialise"):
+                TextParser._serialise_window(
+                    parsed, {t.lemma: LemmaId(1) for t in parsed.relevant}
+                )
+            with metrics.time("write"):
+                writer.add(TextParser._pending_context(parsed))
+
+            token_num += len(parsed.tokens)
+            window_num += 1
+
+        with metrics.time("write"):
+            writer.flush()
+
+    pass_rss = peak_rss_mb()
+    stages = [Stage("normalise", metrics.seconds("normalise"), normalise_rss)]
+    stages += [
+        Stage(stage, metrics.seconds(stage), pass_rss)
+        for stage in ("read", "nlp", "spill", "filter", "serialise", "write")
+    ]
+    totals = {
+        "lines": buf_count_newlines(content_path),
+        "tokens": token_num,
+        "windows": window_num,
+        "requests": request_num[0] - setup_request_num,
+    }
+    return stages, totals
+
+
+def main(
+    lines: list[int] = typer.Option([1_000, 10_000]),
+    seed: int = 0,
+    batch_size: int = Const.NLP_BATCH_SIZE,
+    out: Union[Path, None] = typer.Option(
+        None, help="Also write the results as json"
+    ),
+):
+    use_sqlite()
+    nlp = load_synthetic_nlp()
+    results = []
+
+    for line_num in lines:
+        with tempfile.TemporaryDirectory() as tmp:
+            corpus_path = f"{tmp}/corpus.txt"
+            generate_corpus(corpus_path, line_num, seed)
+            content_path = shutil.copy(corpus_path, f"{tmp}/content.txt")
+
+            stages, totals = run(
+                content_path, f"{tmp}/lex.sqlite3", nlp, batch_size
+            )
+
+        rprint(
+            f"[bold]{line_num} lines[/bold], {totals['tokens']} tokens,"
+            f" {totals['windows']} windows,"
+            f" {totals['requests'] / max(totals['windows'], 1):.3f}"
+            " requests/window"
+        )
+        rprint(
+            tabulate(
+                [
+                    (
+                        stage.name,
+                        f"{stage.seconds:.3f}",
+                        f"{totals['lines'] / max(stage.seconds, 1e-9):,.0f}",
+                        f"{totals['tokens'] / max(stage.seconds, 1e-9):,.0f}",
+                        f"{stage.peak_rss_mb:.0f}",
+                    )
+                    for stage in stages
+                ],
+                headers=["stage", "s", "lines/s", "tokens/s", "peak RSS MB"],
+            )
+        )
+        results.append(
+            {
+                "lines": line_num,
+                **totals,
+                "stages": [stage._asdict() for stage in stages],
+            }
+        )
+
+    if out:
+        out.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
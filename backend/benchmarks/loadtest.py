@@ -0,0 +1,505 @@
+"""
+Load Test
+=========
+Replays a mix of frontend reads and CLI bulk writes against the API and
+reports the latency percentiles and throughput of every endpoint, so that
+worker counts and query changes can be sized from numbers.
+
+By default the app is served in process on a seeded SQLite database. To
+load a running server instead, seed its database and point the harness at
+it, e.g.:
+
+    python -m benchmarks.loadtest --db /tmp/lex.sqlite3 --seed-only
+    LEX_DB_BACKEND=sqlite LEX_SQLITE_PATH_PROD=/tmp/lex.sqlite3 make apiguni
+    python -m benchmarks.loadtest --db /tmp/lex.sqlite3 \
+        --url http://127.0.0.1:8000
+
+Run from backend/: python -m benchmarks.loadtest [--concurrency 16 ...]
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any, NamedTuple, Union
+
+import httpx
+import typer
+from rich import print as rprint
+from tabulate import tabulate
+
+from api._db import AsyncLexDbIntegrator, LexDbIntegrator
+from api._dbtypes import (
+    Context,
+    ContextId,
+    DbEnvironment,
+    Lemma,
+    LemmaContextRelation,
+    LemmaId,
+    LemmaList,
+    LemmaSourceRelation,
+    Source,
+    SourceId,
+    SourceKindVal,
+    StatusId,
+    StatusVal,
+    UposTag,
+)
+from api._storage import SqliteBackend
+from api._utils import chunked
+
+PAGE_SIZE = 100
+SEED_CHUNK_SIZE = 1_000
+
+
+class Dataset(NamedTuple):
+    """
+    The ids of the seeded rows, which the requests draw from.
+    """
+
+    source_ids: list[SourceId]
+    lemma_ids: list[LemmaId]
+    context_ids: list[ContextId]
+    status_id: StatusId
+
+
+class Sample(NamedTuple):
+    endpoint: str
+    seconds: float
+    ok: bool
+
+
+Scenario = Callable[
+    [httpx.AsyncClient, random.Random, Dataset], Awaitable[httpx.Response]
+]
+
+
+def seed_database(
+    db: LexDbIntegrator,
+    source_num: int,
+    lemma_num: int,
+    context_num: int,
+    seed: int = 0,
+) -> Dataset:
+    """
+    Fills the database with sources, lemmata and contexts, where every
+    context mentions a handful of lemmata. The same seed always produces
+    the same rows.
+    """
+    rng = random.Random(seed)
+    source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+    status_ids = {status: db.add_status(status) for status in StatusVal}
+
+    source_ids = [
+        db.add_source(
+            Source(
+                title=f"Source {i}",
+                source_kind_id=source_kind_id,
+                author=f"Author {i % 7}",
+                lang="en",
+            )
+        )
+        for i in range(source_num)
+    ]
+
+    lemma_ids: list[LemmaId] = []
+    for chunk in chunked(range(lemma_num), SEED_CHUNK_SIZE):
+        lemma_ids.extend(
+            db.bulk_add_lemma(
+                [f"lemma{i}" for i in chunk],
+                status_id=rng.choice(list(status_ids.values())),
+                found_in_source=rng.choice(source_ids),
+            ).values()
+        )
+
+    context_ids: list[ContextId] = []
+    for chunk in chunked(range(context_num), SEED_CHUNK_SIZE):
+        source_id = rng.choice(source_ids)
+        chunk_ids = db.bulk_add_contexts(
+            [
+                Context(context_value=f"Context {i}.", source_id=source_id)
+                for i in chunk
+            ]
+        )
+        db.bulk_add_lemma_context_relations(
+            [
+                LemmaContextRelation(
+                    lemma_id=lemma_id,
+                    context_id=context_id,
+                    upos_tag=UposTag.NOUN,
+                    detailed_tag="NN",
+                )
+                for context_id in chunk_ids
+                for lemma_id in rng.sample(lemma_ids, 4)
+            ]
+        )
+        db.bulk_add_lemma_source_relations(
+            [
+                LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)
+                for lemma_id in rng.sample(lemma_ids, len(chunk) // 10)
+            ]
+        )
+        context_ids.extend(chunk_ids)
+
+    return Dataset(
+        source_ids, lemma_ids, context_ids, status_ids[StatusVal.STAGED]
+    )
+
+
+def read_dataset(db: LexDbIntegrator) -> Dataset:
+    """
+    Reads the ids of a database seeded before, e.g. by --seed-only.
+    """
+
+    def ids(table: str) -> list:
+        return [
+            row["id"]
+            for row in db.connection.table(table).select("id").execute().data
+        ]
+
+    return Dataset(
+        ids("source"),
+        ids("lemma"),
+        ids("context"),
+        db.get_status_id(StatusVal.STAGED),
+    )
+
+
+def cursor(rng: random.Random, ids: list) -> dict:
+    """
+    Mostly the first page, sometimes a page further down, like a reader
+    who clicks "Load more".
+    """
+    if rng.random() < 0.7:
+        return {}
+    return {"after_id": rng.choice(ids)}
+
+
+def page(rng: random.Random) -> int:
+    return 1 if rng.random() < 0.7 else rng.randint(2, 10)
+
+
+async def lemma_contexts(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    return await client.get(
+        f"/lemma_contexts/{rng.choice(data.lemma_ids)}",
+        params={"page_size": PAGE_SIZE, **cursor(rng, data.context_ids)},
+    )
+
+
+async def contexts(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    return await client.get(
+        "/contexts",
+        params={"page_size": PAGE_SIZE, **cursor(rng, data.context_ids)},
+    )
+
+
+async def sources(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    return await client.get(
+        "/sources", params={"page": page(rng), "page_size": PAGE_SIZE}
+    )
+
+
+async def status_lemmata(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    return await client.get(
+        "/status_lemmata",
+        params={
+            "status_val": rng.choice(list(StatusVal)).value,
+            "page": page(rng),
+            "page_size": PAGE_SIZE,
+        },
+    )
+
+
+async def bulk_lemmata(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    # Like a flush of the ingest writer, mostly known lemmata and some new
+    lemmata_values = [
+        f"lemma{rng.randrange(len(data.lemma_ids) * 2)}" for _ in range(200)
+    ]
+    source_id = rng.choice(data.source_ids)
+    return await client.post(
+        "/bulk_lemmata",
+        json=LemmaList(
+            lemmata=[
+                Lemma(
+                    lemma=lemma,
+                    status_id=data.status_id,
+                    found_in_source=source_id,
+                )
+                for lemma in lemmata_values
+            ]
+        ).to_dict(),
+    )
+
+
+async def bulk_contexts(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    source_id = rng.choice(data.source_ids)
+    return await client.post(
+        "/bulk_contexts",
+        json=[
+            Context(
+                context_value=f"Load test context {rng.random()}.",
+                source_id=source_id,
+            ).to_dict()
+            for _ in range(50)
+        ],
+    )
+
+
+async def bulk_lemma_context(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    return await client.post(
+        "/bulk_lemma_context",
+        json=[
+            LemmaContextRelation(
+                lemma_id=rng.choice(data.lemma_ids),
+                context_id=rng.choice(data.context_ids),
+                upos_tag=UposTag.VERB,
+                detailed_tag="VBD",
+            ).to_dict()
+            for _ in range(200)
+        ],
+    )
+
+
+async def bulk_lemma_source(
+    client: httpx.AsyncClient, rng: random.Random, data: Dataset
+) -> httpx.Response:
+    source_id = rng.choice(data.source_ids)
+    return await client.post(
+        "/bulk_lemma_source",
+        json=[
+            LemmaSourceRelation(
+                lemma_id=rng.choice(data.lemma_ids), source_id=source_id
+            ).to_dict()
+            for _ in range(100)
+        ],
+    )
+
+
+# Relative frequency of the requests, reads dominate like in the frontend
+TRAFFIC_MIX: dict[str, tuple[Scenario, int]] = {
+    "GET /lemma_contexts": (lemma_contexts, 35),
+    "GET /contexts": (contexts, 15),
+    "GET /sources": (sources, 10),
+    "GET /status_lemmata": (status_lemmata, 20),
+    "POST /bulk_lemmata": (bulk_lemmata, 5),
+    "POST /bulk_contexts": (bulk_contexts, 5),
+    "POST /bulk_lemma_context": (bulk_lemma_context, 5),
+    "POST /bulk_lemma_source": (bulk_lemma_source, 5),
+}
+
+
+async def run(
+    client: httpx.AsyncClient,
+    data: Dataset,
+    concurrency: int,
+    duration: float,
+    request_num: Union[int, None],
+    seed: int = 0,
+) -> tuple[list[Sample], float]:
+    """
+    Sends requests from concurrency clients until duration seconds passed
+    or request_num requests were sent. Returns the samples and the elapsed
+    seconds.
+    """
+    endpoints = list(TRAFFIC_MIX)
+    weights = [weight for _, weight in TRAFFIC_MIX.values()]
+    samples: list[Sample] = []
+    budget = [request_num if request_num is not None else math.inf]
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def user(user_rng: random.Random):
+        while time.perf_counter() < deadline and budget[0] > 0:
+            budget[0] -= 1
+            endpoint = user_rng.choices(endpoints, weights)[0]
+            scenario, _ = TRAFFIC_MIX[endpoint]
+            request_start = time.perf_counter()
+            try:
+                r = await scenario(client, user_rng, data)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            samples.append(
+                Sample(endpoint, time.perf_counter() - request_start, ok)
+            )
+
+    await asyncio.gather(
+        *(user(random.Random(seed * 1_000 + i)) for i in range(concurrency))
+    )
+    return samples, time.perf_counter() - start
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarise(samples: list[Sample], seconds: float) -> list[dict]:
+    by_endpoint: dict[str, list[Sample]] = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample.endpoint].append(sample)
+        by_endpoint["total"].append(sample)
+
+    rows = []
+    for endpoint in [*TRAFFIC_MIX, "total"]:
+        if not (endpoint_samples := by_endpoint.get(endpoint)):
+            continue
+        latencies = sorted(sample.seconds for sample in endpoint_samples)
+        rows.append(
+            {
+                "endpoint": endpoint,
+                "requests": len(endpoint_samples),
+                "errors": sum(not sample.ok for sample in endpoint_samples),
+                "rps": len(endpoint_samples) / seconds,
+                "p50_ms": percentile(latencies, 50) * 1_000,
+                "p95_ms": percentile(latencies, 95) * 1_000,
+                "p99_ms": percentile(latencies, 99) * 1_000,
+            }
+        )
+    return rows
+
+
+def serve_in_process(integrator: LexDbIntegrator) -> Any:
+    """
+    Returns the API app, serving from the integrator's database.
+
+    index connects to the PROD database when it is imported, so it is
+    imported only here, with PROD pointed at a throwaway SQLite database
+    instead of Supabase.
+    """
+    os.environ["LEX_DB_BACKEND"] = "sqlite"
+    os.environ["LEX_SQLITE_PATH_PROD"] = ":memory:"
+    from api import index
+
+    index.db = AsyncLexDbIntegrator(integrator)
+    return index.app
+
+
+def connect_client(
+    url: Union[str, None], concurrency: int, integrator: LexDbIntegrator
+) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(
+            base_url=url,
+            timeout=120.0,
+            limits=httpx.Limits(max_connections=concurrency),
+        )
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=serve_in_process(integrator)),
+        base_url="http://loadtest",
+        timeout=120.0,
+    )
+
+
+def main(
+    concurrency: int = 16,
+    duration: float = typer.Option(30.0, help="Seconds to send requests"),
+    requests: Union[int, None] = typer.Option(
+        None, help="Stop after this many requests instead"
+    ),
+    url: Union[str, None] = typer.Option(
+        None, help="Load a running server instead of the in-process app"
+    ),
+    db: Union[Path, None] = typer.Option(
+        None,
+        help=(
+            "SQLite database to seed, or to read with --url. A temporary"
+            " one by default"
+        ),
+    ),
+    seed_only: bool = False,
+    sources: int = 50,
+    lemmata: int = 20_000,
+    contexts: int = 50_000,
+    seed: int = 0,
+    out: Union[Path, None] = typer.Option(
+        None, help="Also write the results as json"
+    ),
+):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(db or f"{tmp}/lex.sqlite3")
+        integrator = LexDbIntegrator(DbEnvironment.DEV, SqliteBackend(db_path))
+        if url and not seed_only:
+            # The server reads the database, seeding it again would leave
+            # its caches stale
+            data = read_dataset(integrator)
+        else:
+            integrator.truncate_all_tables()
+            start = time.perf_counter()
+            data = seed_database(integrator, sources, lemmata, contexts, seed)
+            rprint(
+                f"Seeded {len(data.lemma_ids)} lemmata and"
+                f" {len(data.context_ids)} contexts in"
+                f" {time.perf_counter() - start:.1f}s"
+            )
+        if seed_only:
+            return
+
+        async def load() -> tuple[list[Sample], float]:
+            async with connect_client(url, concurrency, integrator) as client:
+                return await run(
+                    client, data, concurrency, duration, requests, seed
+                )
+
+        samples, seconds = asyncio.run(load())
+
+    rows = summarise(samples, seconds)
+    rprint(
+        f"[bold]{len(samples)} requests[/bold] in {seconds:.1f}s,"
+        f" {concurrency} concurrent clients against {url or 'in-process app'}"
+    )
+    rprint(
+        tabulate(
+            [
+                (
+                    row["endpoint"],
+                    row["requests"],
+                    row["errors"],
+                    f"{row['rps']:.1f}",
+                    f"{row['p50_ms']:.1f}",
+                    f"{row['p95_ms']:.1f}",
+                    f"{row['p99_ms']:.1f}",
+                )
+                for row in rows
+            ],
+            headers=[
+                "endpoint",
+                "n",
+                "errors",
+                "rps",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+            ],
+        )
+    )
+
+    if out:
+        out.write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,102 @@
+"""
+Spill Benchmark
+===============
+Compares the throughput of locating the raw context within a spilled
+window by parsing both spills separately (before) against using character
+offsets on the already parsed spilled doc (after).
+
+Run from backend/: python -m benchmarks.spill [content-path ...]
+"""
+
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import typer
+from rich import print as rprint
+from spacy.language import Language
+from spacy.tokens import Doc, Span
+
+from api._const import Const
+from api._utils import absolutify_path_from_root
+from cli.textparser import PARSING_PIPES, ContextWindow, TextParser
+
+DEV_SAMPLES = [
+    absolutify_path_from_root(
+        "/backend/assets/dev-samples/harry-potter-small-1.txt"
+    ),
+    absolutify_path_from_root(
+        "/backend/assets/dev-samples/harry-potter-small-2.txt"
+    ),
+]
+
+ContextLocator = Callable[[Language, Doc, ContextWindow], Span]
+
+
+def locate_by_parsing_spills(
+    nlp: Language, doc_spilled: Doc, window: ContextWindow
+) -> Span:
+    pre_spill_len = len(nlp(" ".join(window.pre_spill)))
+    post_spill_len = len(nlp(" ".join(window.post_spill)))
+    return doc_spilled[pre_spill_len : len(doc_spilled) - post_spill_len]
+
+
+def locate_by_char_offsets(
+    nlp: Language, doc_spilled: Doc, window: ContextWindow
+) -> Span:
+    return TextParser._context_span(doc_spilled, window)
+
+
+def run(
+    nlp: Language,
+    content_path: str,
+    locate: ContextLocator,
+    batch_size: int,
+) -> tuple[int, float]:
+    """
+    Returns the number of context tokens and the elapsed seconds.
+    """
+    token_num = 0
+    start = time.perf_counter()
+    with open(content_path) as f:
+        spilled_docs = nlp.pipe(
+            (
+                (" ".join(w.pre_spill + w.raw_context + w.post_spill), w)
+                for w in TextParser._iter_windows(f)
+            ),
+            as_tuples=True,
+            batch_size=batch_size,
+        )
+        for doc_spilled, window in spilled_docs:
+            token_num += len(locate(nlp, doc_spilled, window))
+    return token_num, time.perf_counter() - start
+
+
+def main(
+    paths: list[Path] = typer.Argument(None),
+    batch_size: int = Const.NLP_BATCH_SIZE,
+):
+    nlp = TextParser._load_nlp()
+    nlp.select_pipes(enable=PARSING_PIPES)
+
+    for path in paths or [Path(p) for p in DEV_SAMPLES]:
+        with tempfile.TemporaryDirectory() as tmp:
+            content_path = shutil.copy(path, tmp)
+            TextParser._normalise_file(content_path)
+
+            rprint(f"[bold]{path.name}")
+            for name, locate in (
+                ("before", locate_by_parsing_spills),
+                ("after", locate_by_char_offsets),
+            ):
+                token_num, elapsed = run(nlp, content_path, locate, batch_size)
+                rprint(
+                    f"  {name:<6} {token_num} tokens in {elapsed:.2f}s,"
+                    f" {token_num / elapsed:.0f} tokens/s"
+                )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,6 +1,19 @@
-from typing import Union
+import asyncio
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import Future, wait
+from enum import Enum
+from typing import Any, NamedTuple, Union
 
+import httpx
 import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from rich import print as rprint
+from urllib3.util.retry import Retry
 
 from api._const import Const
 from api._dbtypes import (
@@ -21,40 +34,270 @@ from api._dbtypes import (
     StatusVal,
     UposTag,
 )
-from api.index import LemmaValue
+from api._utils import LruCache
+from api.index import LemmaValue, app
+
+from .stagemetrics import StageMetrics
+
+# Methods which are retried after the api may have received the request,
+# i.e. on read timeouts and 5xx responses. Repeating the POST requests of
+# the api is harmless: lemmata and relations are upserted, contexts are
+# looked up before they are inserted and sources, statuses and source
+# kinds are unique. Updating the status of lemmata fails if the first
+# attempt updated them already, and so does deleting lemmata, so PATCH
+# and DELETE are only retried if the request never reached the api, like
+# all methods.
+RETRIED_METHODS = frozenset({"GET", "POST"})
+
+# Errors of requests which were not sent
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class PendingLemma(NamedTuple):
+    lemma: str
+    upos_tag: UposTag
+    detailed_tag: str
+
+
+class PendingContext(NamedTuple):
+    """
+    Context which is written on the next flush of a BufferedApiWriter.
+    Its value can only be serialised once the ids of its lemmata are known.
+    """
+
+    lemmata: list[PendingLemma]
+    serialise: Callable[[dict[str, LemmaId]], str]
+
+
+class ApiError(Exception):
+    """
+    Base class of the errors raised by ApiRequestor.
+    """
+
+
+class ApiConnectionError(ApiError):
+    """
+    The api could not be reached, even after retrying.
+    """
+
+
+class ApiRequestError(ApiError):
+    """
+    The api answered with an error status.
+    """
+
+    def __init__(self, response: Any) -> None:
+        self.response = response
+        self.status_code: int = response.status_code
+        super().__init__(
+            f"{response.request.method} {response.request.url} failed with"
+            f" status {response.status_code}: {response.text[:200]}"
+        )
+
+
+class ApiResponseError(ApiError):
+    """
+    The api answered successfully, but the answer is not usable.
+    """
+
+    def __init__(self, response: Any, reason: str) -> None:
+        self.response = response
+        super().__init__(
+            f"{response.request.method} {response.request.url}: {reason}"
+        )
+
+
+class ApiMode(Enum):
+    """
+    How ApiRequestor reaches the api.
+    """
+
+    # Over HTTP, to the API served at Const.API_LOCAL_URL
+    HTTP = "http"
+    # In-process, the app of api.index handles the requests directly
+    EMBEDDED = "embedded"
+
+
+class EmbeddedTransport(httpx.BaseTransport):
+    """
+    Synchronous httpx transport which passes requests on to an ASGI app
+    running in this process, without sockets or a server.
+    """
+
+    def __init__(self, asgi_app: Any) -> None:
+        # Errors of the app become 500 responses, like over HTTP
+        self._transport = httpx.ASGITransport(
+            app=asgi_app, raise_app_exceptions=False
+        )
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            return self._loop.run_until_complete(self._handle(request))
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            content=await response.aread(),
+        )
+
+    def close(self) -> None:
+        self._loop.close()
 
 
 class ApiRequestor:
     """
     Encapsulation class for sending HTTP requests to the api.
 
-    Connects with local API.
+    Connects with the local API, or calls it in-process in embedded mode.
+    The mode defaults to LEX_API_MODE ('http' or 'embedded').
     """
 
-    def __init__(self) -> None:
-        self.api_url = Const.API_LOCAL_URL
+    def __init__(self, mode: Union[ApiMode, None] = None) -> None:
+        load_dotenv()
+        self.mode = mode or ApiMode(
+            os.getenv("LEX_API_MODE", ApiMode.HTTP.value)
+        )
+        self.lemma_id_cache: LruCache[str, LemmaId] = LruCache(
+            Const.LEMMA_ID_CACHE_SIZE
+        )
+        # Time and number of requests per endpoint
+        self.metrics = StageMetrics()
+        self.session: Union[requests.Session, httpx.Client]
+        if self.mode == ApiMode.EMBEDDED:
+            self.api_url = "http://embedded"
+            self.session = httpx.Client(transport=EmbeddedTransport(app))
+        else:
+            self.api_url = Const.API_LOCAL_URL
+            self.session = self._pooled_session()
+
+    @staticmethod
+    def _pooled_session() -> requests.Session:
+        """
+        Session which keeps connections to the api alive and retries
+        failed requests with exponential backoff, see RETRIED_METHODS.
+        """
+        retry = Retry(
+            total=Const.API_RETRIES,
+            backoff_factor=Const.API_RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=RETRIED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=Const.API_POOL_SIZE,
+            pool_maxsize=Const.API_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _request(
+        self, method: str, path: str, check: bool = True, **kwargs: Any
+    ) -> Any:
+        """
+        Sends a request to the api. Raises ApiRequestError on an error
+        status unless check is False.
+        """
+        if self.mode == ApiMode.HTTP:
+            kwargs.setdefault(
+                "timeout", (Const.API_CONNECT_TIMEOUT, Const.API_READ_TIMEOUT)
+            )
+        try:
+            with self.metrics.time(_api_stage(method, path)):
+                r = self.session.request(
+                    method, f"{self.api_url}{path}", **kwargs
+                )
+        except (requests.RequestException, httpx.HTTPError) as e:
+            raise ApiConnectionError(f"{method} {path}: {e}") from e
+
+        if check and r.status_code != 200:
+            raise ApiRequestError(r)
+        return r
+
+    @staticmethod
+    def _valid_id(r: Any) -> int:
+        if (id_ := r.json()) == -1:
+            raise ApiResponseError(r, "no id returned")
+        return id_
+
+    @staticmethod
+    def _succeeded(r: Any) -> bool:
+        if not (succeeded := r.json()):
+            raise ApiResponseError(r, "operation failed")
+        return succeeded
+
+    def buffered_writer(
+        self,
+        source_id: SourceId,
+        status_id: StatusId,
+        buffer_size: int = Const.WRITE_BUFFER_SIZE,
+        flush_interval: float = Const.WRITE_BUFFER_FLUSH_INTERVAL,
+    ) -> "BufferedApiWriter":
+        return BufferedApiWriter(
+            self, source_id, status_id, buffer_size, flush_interval
+        )
+
+    def pipelined_writer(
+        self,
+        source_id: SourceId,
+        status_id: StatusId,
+        buffer_size: int = Const.WRITE_BUFFER_SIZE,
+        flush_interval: float = Const.WRITE_BUFFER_FLUSH_INTERVAL,
+        max_in_flight: int = Const.WRITE_MAX_IN_FLIGHT,
+    ) -> "PipelinedApiWriter":
+        return PipelinedApiWriter(
+            AsyncApiRequestor(
+                self.mode,
+                lemma_id_cache=self.lemma_id_cache,
+                metrics=self.metrics,
+            ),
+            source_id,
+            status_id,
+            buffer_size,
+            flush_interval,
+            max_in_flight,
+        )
 
     def get_lemma_name(self, lemma_id: LemmaId) -> str:
-        r = requests.get(f"{self.api_url}/lemma/{lemma_id}")
+        r = self._request("GET", f"/lemma/{lemma_id}", check=False)
         return Lemma(**dict(r.json())).lemma if r.status_code == 200 else ""
 
     def get_lemma_id(self, lemma: str) -> LemmaId:
-        r = requests.get(
-            f"{self.api_url}/lemma_id", json=LemmaValue(value=lemma).dict()
+        if (lemma_id := self.lemma_id_cache.get(lemma)) is not None:
+            return lemma_id
+
+        r = self._request(
+            "GET",
+            "/lemma_id",
+            json=LemmaValue(value=lemma).dict(),
+            check=False,
         )
-        return LemmaId(r.json()) if r.status_code == 200 else LemmaId(-1)
+        if r.status_code != 200 or (lemma_id := LemmaId(r.json())) == -1:
+            return LemmaId(-1)
+        self.lemma_id_cache.put(lemma, lemma_id)
+        return lemma_id
 
     def bulk_get_lemma_id_dict(
         self,
         lemmata_values: list[str],
     ) -> dict[str, LemmaId]:
-        r = requests.get(f"{self.api_url}/bulk_lemma", json=lemmata_values)
-        assert r.status_code == 200
-        return r.json()
+        result = self.lemma_id_cache.get_many(lemmata_values)
+        if uncached := [
+            lemma for lemma in lemmata_values if lemma not in result
+        ]:
+            r = self._request("GET", "/bulk_lemma", json=uncached)
+            self.lemma_id_cache.put_many(r.json())
+            result.update(r.json())
+        return result
 
     def get_lemma_status(self, status_val: StatusVal) -> StatusId:
-        r = requests.get(f"{self.api_url}/lemma_status/{status_val.value}")
-        assert r.status_code == 200
+        r = self._request("GET", f"/lemma_status/{status_val.value}")
         return StatusId(r.json())
 
     def get_status_lemmata(
@@ -71,25 +314,26 @@ class ApiRequestor:
         if page_size:
             query_params["page_size"] = page_size
         query_params["status_val"] = status_val.value
-        r = requests.get(
-            f"{self.api_url}/status_lemmata{'_table' if table else ''}",
+        r = self._request(
+            "GET",
+            f"/status_lemmata{'_table' if table else ''}",
             params=query_params,
         )
-        assert r.status_code == 200
         return r.json()
 
     def post_lemma(
         self, lemma: str, status_id: StatusId, source_id: SourceId
     ) -> LemmaId:
-        r = requests.post(
-            f"{self.api_url}/lemma",
+        r = self._request(
+            "POST",
+            "/lemma",
             json=Lemma(
                 lemma=lemma, status_id=status_id, found_in_source=source_id
             ).to_dict(),
         )
-        assert r.status_code == 200
-        assert (lid := LemmaId(r.json())) != -1
-        return lid
+        lemma_id = LemmaId(self._valid_id(r))
+        self.lemma_id_cache.put(lemma, lemma_id)
+        return lemma_id
 
     def bulk_post_lemmata(
         self,
@@ -97,45 +341,41 @@ class ApiRequestor:
         status_id: StatusId,
         source_id: SourceId,
     ) -> dict[LemmaValue, LemmaId]:
-        r = requests.post(
-            f"{self.api_url}/bulk_lemmata",
-            json=LemmaList(
-                lemmata=[
-                    Lemma(
-                        lemma=lemma_val,
-                        status_id=status_id,
-                        found_in_source=source_id,
-                    )
-                    for lemma_val in lemmata_values
-                ]
-            ).to_dict(),
-        )
-        assert r.status_code == 200
-        id_lemma_dict: dict[LemmaValue, LemmaId] = r.json()
-        assert set(lemmata_values) == id_lemma_dict.keys()
-        return id_lemma_dict
+        """
+        Adds the lemmata which are not in the lemma id cache.
+        """
+        result = self.lemma_id_cache.get_many(lemmata_values)
+        if uncached := [
+            lemma for lemma in lemmata_values if lemma not in result
+        ]:
+            r = self._request(
+                "POST",
+                "/bulk_lemmata",
+                json=_lemma_list(uncached, status_id, source_id),
+            )
+            result.update(_lemma_id_dict(r, uncached, self.lemma_id_cache))
+        return result
 
     def post_status(self, status_val: StatusVal) -> StatusId:
-        r = requests.post(
-            f"{self.api_url}/lemma_status?status_val={status_val.value}",
+        r = self._request(
+            "POST",
+            f"/lemma_status?status_val={status_val.value}",
         )
-        assert r.status_code == 200
-        assert (sid := StatusId(r.json())) != -1
-        return sid
+        return StatusId(self._valid_id(r))
 
     def post_source_kind(self, source_kind_val: SourceKindVal) -> SourceKindId:
-        r = requests.post(
-            f"{self.api_url}/source_kind?source_kind_val={source_kind_val.value}",
+        r = self._request(
+            "POST",
+            f"/source_kind?source_kind_val={source_kind_val.value}",
         )
-        assert r.status_code == 200
-        assert (skid := SourceKindId(r.json())) != -1
-        return skid
+        return SourceKindId(self._valid_id(r))
 
     def post_source(
         self, title: str, source_kind_id: SourceKindId, author: str, lang: str
     ) -> SourceId:
-        r = requests.post(
-            f"{self.api_url}/source",
+        r = self._request(
+            "POST",
+            "/source",
             json=Source(
                 title=title,
                 source_kind_id=source_kind_id,
@@ -143,22 +383,37 @@ class ApiRequestor:
                 lang=lang,
             ).to_dict(),
         )
-        assert r.status_code == 200
-        assert (sid := SourceId(r.json())) != -1
-        return sid
+        return SourceId(self._valid_id(r))
 
     def post_context(
         self, context_value: str, source_id: SourceId
     ) -> ContextId:
-        r = requests.post(
-            f"{self.api_url}/context",
+        r = self._request(
+            "POST",
+            "/context",
             json=Context(
                 context_value=context_value, source_id=source_id
             ).to_dict(),
         )
-        assert r.status_code == 200
-        assert (cid := ContextId(r.json())) != -1
-        return cid
+        return ContextId(self._valid_id(r))
+
+    def bulk_post_contexts(
+        self, context_values: list[str], source_id: SourceId
+    ) -> list[ContextId]:
+        r = self._request(
+            "POST",
+            "/bulk_contexts",
+            json=[
+                Context(
+                    context_value=context_value, source_id=source_id
+                ).to_dict()
+                for context_value in context_values
+            ],
+        )
+        context_ids = [ContextId(cid) for cid in r.json()]
+        if len(context_ids) != len(context_values):
+            raise ApiResponseError(r, "context ids missing")
+        return context_ids
 
     def post_lemma_context_relation(
         self,
@@ -167,8 +422,9 @@ class ApiRequestor:
         upos_tag: UposTag,
         detailed_tag: str,
     ) -> LemmaContextId:
-        r = requests.post(
-            f"{self.api_url}/lemma_context",
+        r = self._request(
+            "POST",
+            "/lemma_context",
             json=LemmaContextRelation(
                 lemma_id=lemma_id,
                 context_id=context_id,
@@ -176,58 +432,517 @@ class ApiRequestor:
                 detailed_tag=detailed_tag,
             ).to_dict(),
         )
-        assert r.status_code == 200
-        assert (lcid := LemmaContextId(r.json())) != -1
-        return lcid
+        return LemmaContextId(self._valid_id(r))
 
     def bulk_post_lemma_context_relations(
         self, rels: list[LemmaContextRelation]
     ) -> bool:
-        r = requests.post(
-            f"{self.api_url}/bulk_lemma_context",
+        r = self._request(
+            "POST",
+            "/bulk_lemma_context",
             json=[rel.to_dict() for rel in rels],
         )
-        assert r.status_code == 200
-        assert r.json()
-        return r.json()
+        return _relations_added(r, self.lemma_id_cache)
 
     def post_lemma_source_relation(
         self,
         lemma_id: LemmaId,
         source_id: SourceId,
     ) -> LemmaSourceId:
-        r = requests.post(
-            f"{self.api_url}/lemma_source",
+        r = self._request(
+            "POST",
+            "/lemma_source",
             json=LemmaSourceRelation(
                 lemma_id=lemma_id, source_id=source_id
             ).to_dict(),
         )
-        assert r.status_code == 200
-        assert (lsid := LemmaSourceId(r.json())) != -1
-        return lsid
+        return LemmaSourceId(self._valid_id(r))
 
     def bulk_post_lemma_source_relations(
         self, rels: list[LemmaSourceRelation]
     ) -> bool:
-        r = requests.post(
-            f"{self.api_url}/bulk_lemma_source",
+        r = self._request(
+            "POST",
+            "/bulk_lemma_source",
             json=[rel.to_dict() for rel in rels],
         )
-        assert r.status_code == 200
-        assert r.json()
-        return r.json()
+        return _relations_added(r, self.lemma_id_cache)
 
     def delete_lemmata(self, lemma_ids: set[LemmaId]) -> bool:
-        r = requests.delete(f"{self.api_url}/lemma", json=list(lemma_ids))
-        assert r.status_code == 200
-        return r.json()
+        r = self._request("DELETE", "/lemma", json=list(lemma_ids))
+        if deleted := r.json():
+            self.lemma_id_cache.discard_values(lemma_ids)
+        return deleted
 
     def update_multiple_status(
         self, lemma_ids: set[LemmaId], new_status_id: StatusId
     ) -> bool:
-        r = requests.patch(
-            f"{self.api_url}/status?new_status_id={new_status_id}",
+        r = self._request(
+            "PATCH",
+            f"/status?new_status_id={new_status_id}",
             json=list(lemma_ids),
         )
-        assert r.status_code == 200
         return r.json()
+
+
+class AsyncApiRequestor:
+    """
+    asyncio counterpart of ApiRequestor for the ingest writes.
+
+    At most max_concurrent requests are in flight at once. Connection
+    errors and 5xx responses are retried with exponential backoff, like
+    in ApiRequestor, see RETRIED_METHODS.
+    """
+
+    def __init__(
+        self,
+        mode: Union[ApiMode, None] = None,
+        max_concurrent: int = Const.API_MAX_CONCURRENT_REQUESTS,
+        lemma_id_cache: Union[LruCache[str, LemmaId], None] = None,
+        metrics: Union[StageMetrics, None] = None,
+    ) -> None:
+        load_dotenv()
+        self.mode = mode or ApiMode(
+            os.getenv("LEX_API_MODE", ApiMode.HTTP.value)
+        )
+        self.lemma_id_cache = lemma_id_cache or LruCache(
+            Const.LEMMA_ID_CACHE_SIZE
+        )
+        self.metrics = metrics or StageMetrics()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        if self.mode == ApiMode.EMBEDDED:
+            self.api_url = "http://embedded"
+            self.client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(
+                    app=app, raise_app_exceptions=False
+                )
+            )
+        else:
+            self.api_url = Const.API_LOCAL_URL
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    Const.API_READ_TIMEOUT, connect=Const.API_CONNECT_TIMEOUT
+                ),
+                transport=httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=Const.API_POOL_SIZE,
+                        max_keepalive_connections=Const.API_POOL_SIZE,
+                    ),
+                ),
+            )
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self._request_with_retries(method, path, **kwargs)
+        finally:
+            self.metrics.record(
+                _api_stage(method, path), time.perf_counter() - start
+            )
+
+    async def _request_with_retries(
+        self, method: str, path: str, **kwargs: Any
+    ) -> Any:
+        error: ApiError
+        for retry in range(Const.API_RETRIES + 1):
+            if retry:
+                await asyncio.sleep(Const.API_RETRY_BACKOFF * 2 ** (retry - 1))
+            async with self._semaphore:
+                try:
+                    r = await self.client.request(
+                        method, f"{self.api_url}{path}", **kwargs
+                    )
+                except httpx.TransportError as e:
+                    error = ApiConnectionError(f"{method} {path}: {e}")
+                    if method in RETRIED_METHODS or isinstance(
+                        e, UNSENT_ERRORS
+                    ):
+                        continue
+                    break
+            if r.status_code == 200:
+                return r
+            error = ApiRequestError(r)
+            if r.status_code < 500 or method not in RETRIED_METHODS:
+                break
+        raise error
+
+    async def bulk_post_lemmata(
+        self,
+        lemmata_values: list[LemmaValue],
+        status_id: StatusId,
+        source_id: SourceId,
+    ) -> dict[LemmaValue, LemmaId]:
+        result = self.lemma_id_cache.get_many(lemmata_values)
+        if uncached := [
+            lemma for lemma in lemmata_values if lemma not in result
+        ]:
+            r = await self._request(
+                "POST",
+                "/bulk_lemmata",
+                json=_lemma_list(uncached, status_id, source_id),
+            )
+            result.update(_lemma_id_dict(r, uncached, self.lemma_id_cache))
+        return result
+
+    async def bulk_post_contexts(
+        self, context_values: list[str], source_id: SourceId
+    ) -> list[ContextId]:
+        r = await self._request(
+            "POST",
+            "/bulk_contexts",
+            json=[
+                Context(
+                    context_value=context_value, source_id=source_id
+                ).to_dict()
+                for context_value in context_values
+            ],
+        )
+        context_ids = [ContextId(cid) for cid in r.json()]
+        if len(context_ids) != len(context_values):
+            raise ApiResponseError(r, "context ids missing")
+        return context_ids
+
+    async def bulk_post_lemma_context_relations(
+        self, rels: list[LemmaContextRelation]
+    ) -> bool:
+        r = await self._request(
+            "POST",
+            "/bulk_lemma_context",
+            json=[rel.to_dict() for rel in rels],
+        )
+        return _relations_added(r, self.lemma_id_cache)
+
+    async def bulk_post_lemma_source_relations(
+        self, rels: list[LemmaSourceRelation]
+    ) -> bool:
+        r = await self._request(
+            "POST",
+            "/bulk_lemma_source",
+            json=[rel.to_dict() for rel in rels],
+        )
+        return _relations_added(r, self.lemma_id_cache)
+
+
+def _api_stage(method: str, path: str) -> str:
+    return f"api {method} {path.partition('?')[0]}"
+
+
+def _lemma_list(
+    lemmata_values: list[str], status_id: StatusId, source_id: SourceId
+) -> dict:
+    return LemmaList(
+        lemmata=[
+            Lemma(lemma=lemma, status_id=status_id, found_in_source=source_id)
+            for lemma in lemmata_values
+        ]
+    ).to_dict()
+
+
+def _lemma_id_dict(
+    r: Any, lemmata_values: list[str], cache: LruCache[str, LemmaId]
+) -> dict[str, LemmaId]:
+    id_lemma_dict: dict[str, LemmaId] = r.json()
+    if set(lemmata_values) != id_lemma_dict.keys():
+        raise ApiResponseError(r, "lemma ids missing")
+    cache.put_many(id_lemma_dict)
+    return id_lemma_dict
+
+
+def _relations_added(r: Any, cache: LruCache[str, LemmaId]) -> bool:
+    """
+    The api refuses relations to lemmata which don't exist. Their ids may
+    have been cached before another process deleted the lemmata, so the
+    cache is cleared for the next writes to look them up again.
+    """
+    if not r.json():
+        cache.clear()
+    return ApiRequestor._succeeded(r)
+
+
+def _lemmata_values(pending: list[PendingContext]) -> list[str]:
+    return list(
+        dict.fromkeys(lemma.lemma for c in pending for lemma in c.lemmata)
+    )
+
+
+def _lemma_source_relations(
+    lemmata_values: list[str],
+    lemma_id_dict: dict[str, LemmaId],
+    source_id: SourceId,
+) -> list[LemmaSourceRelation]:
+    return [
+        LemmaSourceRelation(lemma_id=lemma_id_dict[lemma], source_id=source_id)
+        for lemma in lemmata_values
+    ]
+
+
+def _lemma_context_relations(
+    pending: list[PendingContext],
+    lemma_id_dict: dict[str, LemmaId],
+    context_ids: list[ContextId],
+) -> list[LemmaContextRelation]:
+    return [
+        LemmaContextRelation(
+            lemma_id=lemma_id_dict[lemma.lemma],
+            context_id=context_id,
+            upos_tag=lemma.upos_tag,
+            detailed_tag=lemma.detailed_tag,
+        )
+        for context, context_id in zip(pending, context_ids)
+        for lemma in context.lemmata
+    ]
+
+
+class _WriteBuffer(ABC):
+    """
+    Write-behind buffer for the contexts of a source and their lemmata.
+
+    Contexts are accumulated and written on flush, which happens once
+    buffer_size contexts are pending, flush_interval seconds have passed
+    since the last flush, or the writer is closed. A flush resolves the
+    ids of all pending lemmata with a single bulk request.
+    """
+
+    def __init__(
+        self,
+        source_id: SourceId,
+        status_id: StatusId,
+        buffer_size: int,
+        flush_interval: float,
+    ) -> None:
+        self.source_id = source_id
+        self.status_id = status_id
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self._pending: list[PendingContext] = []
+        self._last_flush = time.monotonic()
+
+    def add(self, context: PendingContext) -> None:
+        self._pending.append(context)
+        if (
+            len(self._pending) >= self.buffer_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if pending:
+            self._write(pending)
+
+    def _flush_before_error(self) -> None:
+        """
+        Writes the contexts added before an error left the writer's block,
+        as they were parsed successfully. If that fails too, they are
+        reported as lost, the original error propagates either way.
+        """
+        pending_num = len(self._pending)
+        try:
+            self.flush()
+        except Exception as e:
+            rprint(
+                f"[red]Could not write {pending_num} buffered contexts: {e}"
+            )
+
+    @abstractmethod
+    def _write(self, pending: list[PendingContext]) -> None:
+        """
+        Writes the contexts of a flush and their lemmata.
+        """
+
+
+class BufferedApiWriter(_WriteBuffer):
+    """
+    Write buffer whose flushes block until the contexts are written.
+    """
+
+    def __init__(
+        self,
+        api: ApiRequestor,
+        source_id: SourceId,
+        status_id: StatusId,
+        buffer_size: int,
+        flush_interval: float,
+    ) -> None:
+        super().__init__(source_id, status_id, buffer_size, flush_interval)
+        self.api = api
+
+    def __enter__(self) -> "BufferedApiWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self._flush_before_error()
+
+    def _write(self, pending: list[PendingContext]) -> None:
+        lemmata_values = _lemmata_values(pending)
+        lemma_id_dict = (
+            self.api.bulk_post_lemmata(
+                lemmata_values=lemmata_values,
+                status_id=self.status_id,
+                source_id=self.source_id,
+            )
+            if lemmata_values
+            else {}
+        )
+
+        context_ids = self.api.bulk_post_contexts(
+            [context.serialise(lemma_id_dict) for context in pending],
+            self.source_id,
+        )
+
+        if not lemmata_values:
+            return
+
+        self.api.bulk_post_lemma_source_relations(
+            _lemma_source_relations(
+                lemmata_values, lemma_id_dict, self.source_id
+            )
+        )
+        self.api.bulk_post_lemma_context_relations(
+            _lemma_context_relations(pending, lemma_id_dict, context_ids)
+        )
+
+
+class PipelinedApiWriter(_WriteBuffer):
+    """
+    Write buffer whose flushes return immediately. The writes run on an
+    event loop in a background thread, so that the caller can go on
+    parsing while they are in flight.
+
+    Within a flush, lemmata are written before the contexts which
+    reference their ids, and both before the relations. Up to
+    max_in_flight flushes are pending; flush blocks while that many are.
+    Lemmata and contexts are written one flush after another, and so are
+    the relations, so that ids are assigned in the order in which the
+    contexts were added, like in a serial run. Only the relations of a
+    flush are written while the next flush writes its lemmata and
+    contexts.
+
+    The first failed write is raised on a later add/flush or on close,
+    before the pending contexts are taken, so that they are reported as
+    lost with it rather than dropped.
+    """
+
+    def __init__(
+        self,
+        api: AsyncApiRequestor,
+        source_id: SourceId,
+        status_id: StatusId,
+        buffer_size: int,
+        flush_interval: float,
+        max_in_flight: int,
+    ) -> None:
+        super().__init__(source_id, status_id, buffer_size, flush_interval)
+        self.api = api
+
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        # Waiters acquire the locks in the order of the flushes
+        self._ids_lock = asyncio.Lock()
+        self._relations_lock = asyncio.Lock()
+        self._futures: list[Future] = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, daemon=True
+        )
+
+    def __enter__(self) -> "PipelinedApiWriter":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                try:
+                    self.flush()
+                except Exception:
+                    # Reports the contexts which stayed pending
+                    self._flush_before_error()
+                    raise
+                for future in self._futures:
+                    future.result()
+            else:
+                self._flush_before_error()
+                for future in wait(self._futures).done:
+                    if (error := future.exception()) is not None:
+                        rprint(
+                            f"[red]Could not write buffered contexts: {error}"
+                        )
+        finally:
+            wait(self._futures)
+            asyncio.run_coroutine_threadsafe(
+                self.api.aclose(), self._loop
+            ).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def flush(self) -> None:
+        self._raise_failed()
+        super().flush()
+
+    def _write(self, pending: list[PendingContext]) -> None:
+        self._in_flight.acquire()
+        future = asyncio.run_coroutine_threadsafe(
+            self._write_async(pending), self._loop
+        )
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _raise_failed(self) -> None:
+        running = []
+        for future in self._futures:
+            if not future.done():
+                running.append(future)
+            elif future.exception() is not None:
+                raise future.exception()  # type: ignore[misc]
+        self._futures = running
+
+    async def _write_async(self, pending: list[PendingContext]) -> None:
+        async with self._ids_lock:
+            lemmata_values = _lemmata_values(pending)
+            lemma_id_dict = (
+                await self.api.bulk_post_lemmata(
+                    lemmata_values=lemmata_values,
+                    status_id=self.status_id,
+                    source_id=self.source_id,
+                )
+                if lemmata_values
+                else {}
+            )
+
+            context_ids = await self.api.bulk_post_contexts(
+                [context.serialise(lemma_id_dict) for context in pending],
+                self.source_id,
+            )
+
+            # Taken before the next flush can write its ids, so that the
+            # relations are written in flush order too
+            await self._relations_lock.acquire()
+
+        try:
+            if not lemmata_values:
+                return
+
+            # Both relations only depend on the ids written above
+            await asyncio.gather(
+                self.api.bulk_post_lemma_source_relations(
+                    _lemma_source_relations(
+                        lemmata_values, lemma_id_dict, self.source_id
+                    )
+                ),
+                self.api.bulk_post_lemma_context_relations(
+                    _lemma_context_relations(
+                        pending, lemma_id_dict, context_ids
+                    )
+                ),
+            )
+        finally:
+            self._relations_lock.release()
@@ -1,10 +1,14 @@
 import cProfile
+import sys
 from pathlib import Path
+from typing import Union
 
 import typer
 from rich import print as rprint
 
+from api._const import Const
 from api._dbtypes import LemmaId
+from api._tracing import trace_command
 from api._utils import absolutify_path_from_root
 
 from .contentextractor import ContentExtractor
@@ -15,12 +19,32 @@ cli = typer.Typer()
 
 
 @cli.command("add")
-def add(path: Path, bv: bool = False, profile: bool = False):
+def add(
+    path: Path,
+    bv: bool = False,
+    profile: bool = False,
+    batch_size: int = Const.NLP_BATCH_SIZE,
+    workers: int = 1,
+    in_flight: int = Const.WRITE_MAX_IN_FLIGHT,
+    metrics_out: Union[Path, None] = None,
+):
     # sourcery skip: merge-else-if-into-elif
     """
     Parse a new file into the database or base vocabulary (--bv).
     Produce an `add.profile` file (--profile).
-    """
+    Number of context windows passed through the nlp pipeline at once
+    (--batch-size).
+    Parse the file in parallel with a number of worker processes
+    (--workers).
+    Number of database writes running concurrently with parsing
+    (--in-flight).
+    Write the time spent per ingest stage to a .json or Prometheus text
+    file (--metrics-out).
+    """
+    if workers < 1:
+        raise typer.BadParameter("workers")
+    if in_flight < 1:
+        raise typer.BadParameter("in-flight")
     if not path.is_file():
         raise typer.BadParameter("path")
 
@@ -32,7 +56,8 @@ def add(path: Path, bv: bool = False, profile: bool = False):
     if bv:
         (
             cProfile.runctx(
-                "parser.parse_into_base_vocab(content_path)",
+                "parser.parse_into_base_vocab(content_path, batch_size,"
+                " workers)",
                 locals=locals(),
                 globals=globals(),
                 filename=absolutify_path_from_root(
@@ -40,12 +65,15 @@ def add(path: Path, bv: bool = False, profile: bool = False):
                 ),
             )
             if profile
-            else parser.parse_into_base_vocab(content_path)
+            else parser.parse_into_base_vocab(
+                content_path, batch_size, workers
+            )
         )
     else:
         (
             cProfile.runctx(
-                "parser.parse_into_db(content_path, meta_path)",
+                "parser.parse_into_db(content_path, meta_path,"
+                " batch_size, workers, in_flight)",
                 locals=locals(),
                 globals=globals(),
                 filename=absolutify_path_from_root(
@@ -53,8 +81,13 @@ def add(path: Path, bv: bool = False, profile: bool = False):
                 ),
             )
             if profile
-            else parser.parse_into_db(content_path, meta_path)
+            else parser.parse_into_db(
+                content_path, meta_path, batch_size, workers, in_flight
+            )
         )
+        rprint(parser.metrics.summary())
+        if metrics_out:
+            parser.metrics.write(metrics_out)
 
     extractor.clean()
 
@@ -168,4 +201,6 @@ def list(
 
 
 def main():
-    cli()
+    # Dumps the queries of the command if LEX_QUERY_TRACE is set
+    with trace_command(" ".join(sys.argv[1:])):
+        cli()
@@ -0,0 +1,168 @@
+"""
+Stage Metrics
+=============
+Records the wall time and number of calls of the stages of an ingest, and
+renders them as a summary table, json or Prometheus text.
+"""
+
+import json
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TypeVar
+
+from tabulate import tabulate
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageStats:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+class StageMetrics:
+    """
+    Wall time and call count per stage. Stages run concurrently, e.g. API
+    calls in the background writer while parsing goes on, so their times
+    may add up to more than the elapsed time.
+
+    Safe to record from several threads.
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, StageStats] = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, calls: int = 1) -> None:
+        with self._lock:
+            stats = self.stages.setdefault(stage, StageStats())
+            stats.seconds += seconds
+            stats.calls += calls
+
+    def merge(self, stages: dict[str, StageStats]) -> None:
+        """
+        Adds the stages recorded elsewhere, e.g. in a worker process.
+        """
+        for stage, stats in stages.items():
+            self.record(stage, stats.seconds, stats.calls)
+
+    def seconds(self, stage: str) -> float:
+        with self._lock:
+            stats = self.stages.get(stage)
+            return stats.seconds if stats else 0.0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(
+        self, stage: str, items: Iterable[T], nested: Iterable[str] = ()
+    ) -> Iterator[T]:
+        """
+        Yields the items, recording the time spent producing each one.
+
+        Time recorded to the nested stages while an item is produced, e.g.
+        reading the lines a lazy pipeline pulls in, is not counted twice.
+        """
+        nested = tuple(nested)
+        it = iter(items)
+        while True:
+            nested_before = sum(self.seconds(s) for s in nested)
+            start = time.perf_counter()
+            exhausted = False
+            try:
+                item = next(it)
+            except StopIteration:
+                exhausted = True
+            seconds = time.perf_counter() - start
+            nested_seconds = (
+                sum(self.seconds(s) for s in nested) - nested_before
+            )
+            self.record(stage, seconds - nested_seconds, 0 if exhausted else 1)
+            if exhausted:
+                return
+            yield item
+
+    def wrap(self, stage: str, fn: Callable[..., T]) -> Callable[..., T]:
+        def timed_fn(*args, **kwargs) -> T:
+            with self.time(stage):
+                return fn(*args, **kwargs)
+
+        return timed_fn
+
+    def summary(self) -> str:
+        elapsed = self.elapsed()
+        return tabulate(
+            [
+                (
+                    stage,
+                    stats.calls,
+                    f"{stats.seconds:.3f}",
+                    f"{stats.seconds / max(stats.calls, 1) * 1_000:.3f}",
+                    f"{stats.seconds / elapsed:.1%}",
+                )
+                for stage, stats in sorted(
+                    self.stages.items(), key=lambda item: -item[1].seconds
+                )
+            ],
+            headers=["stage", "calls", "total s", "mean ms", "of elapsed"],
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "elapsed_seconds": self.elapsed(),
+                "stages": {
+                    stage: asdict(stats)
+                    for stage, stats in self.stages.items()
+                },
+            },
+            indent=2,
+        )
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP lex_ingest_elapsed_seconds Elapsed time of the ingest.",
+            "# TYPE lex_ingest_elapsed_seconds gauge",
+            f"lex_ingest_elapsed_seconds {self.elapsed()}",
+        ]
+        for metric, help_text, attribute in (
+            ("seconds", "Wall time spent in an ingest stage.", "seconds"),
+            ("calls", "Number of calls of an ingest stage.", "calls"),
+        ):
+            name = f"lex_ingest_stage_{metric}_total"
+            lines += [
+                f"# HELP {name} {help_text}",
+                f"# TYPE {name} counter",
+            ]
+            lines += [
+                f'{name}{{stage="{_escape_label(stage)}"}}'
+                f" {getattr(stats, attribute)}"
+                for stage, stats in self.stages.items()
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        """
+        Writes json if the path ends in .json, Prometheus text otherwise.
+        """
+        path.write_text(
+            self.to_json() if path.suffix == ".json" else self.to_prometheus()
+        )
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -7,8 +7,15 @@ via the API.
 
 
 import json
+import multiprocessing
+import time
+from collections.abc import Container, Iterable, Iterator
+from contextlib import contextmanager
+from functools import partial
 from itertools import islice
-from typing import NamedTuple
+from multiprocessing.pool import Pool
+from multiprocessing.util import Finalize
+from typing import NamedTuple, Union
 
 import en_core_web_trf
 import spacy
@@ -17,20 +24,23 @@ from spacy.lang.en.stop_words import (
     STOP_WORDS,  # TODO @ej localisation-relevant
 )
 from spacy.lang.lex_attrs import is_stop
-from spacy.tokens import Doc, Token
+from spacy.language import Language
+from spacy.tokens import Doc, Span, Token
 
 from api._const import Const
-from api._dbtypes import (
-    LemmaContextRelation,
-    LemmaId,
-    LemmaSourceRelation,
-    SourceMetadata,
-    StatusVal,
-    UposTag,
-)
+from api._dbtypes import LemmaId, SourceMetadata, StatusVal, UposTag
 from api._utils import buf_count_newlines, enhanced_progress_params
+from api._vocabindex import VocabIndex
+
+from .apirequestor import ApiRequestor, PendingContext, PendingLemma
+from .stagemetrics import StageMetrics, StageStats
 
-from .apirequestor import ApiRequestor
+PARSING_PIPES = (
+    "transformer",
+    "tagger",
+    "attribute_ruler",
+    "lemmatizer",
+)
 
 
 class IntermediaryDbDatum(NamedTuple):
@@ -40,6 +50,45 @@ class IntermediaryDbDatum(NamedTuple):
     pos: UposTag
 
 
+class ContextWindow(NamedTuple):
+    pre_spill: list[str]
+    raw_context: list[str]
+    post_spill: list[str]
+
+
+class ContextToken(NamedTuple):
+    text: str
+    whitespace_: str
+
+
+class RelevantToken(NamedTuple):
+    text: str
+    lemma: str
+    tag: str
+    pos: UposTag
+
+
+class ParsedWindow(NamedTuple):
+    """
+    NLP result of a single context window. Holds plain data only so that it
+    can be passed between processes.
+    """
+
+    tokens: list[ContextToken]
+    relevant: list[RelevantToken]
+
+
+class Shard(NamedTuple):
+    """
+    Line range of a content file which is parsed by a single worker.
+    line_num is None for the last shard, i.e. parse until the end of file.
+    """
+
+    content_path: str
+    first_line: int
+    line_num: Union[int, None]
+
+
 class TextParser:
     """
     Parsing class which extracts vocabulary from text.
@@ -55,55 +104,67 @@ class TextParser:
           multiple documents
         """
         self.api = ApiRequestor()
+        # Stages of the last parse_into_db, shares the API call timings
+        self.metrics = self.api.metrics
 
-        self.nlp = en_core_web_trf.load()  # TODO @ej localisation-relevant
-        self._customise_tokenisation()
-        self.nlp_parsing_pipes = self.nlp.select_pipes(
-            enable=(
-                "transformer",
-                "tagger",
-                "attribute_ruler",
-                "lemmatizer",
-            )
-        )
+        self.nlp = self._load_nlp()
+        self.nlp_parsing_pipes = self.nlp.select_pipes(enable=PARSING_PIPES)
 
-    def parse_into_base_vocab(self, content_path: str):
-        """ """
-        existing_base_vocab = self._load_vocab(Const.PATH_BASE_VOCAB)
-        existing_irrelevant_vocab = self._load_vocab(
-            Const.PATH_IRRELEVANT_VOCAB
-        )
+    def parse_into_base_vocab(
+        self,
+        content_path: str,
+        batch_size: int = Const.NLP_BATCH_SIZE,
+        workers: int = 1,
+    ):
+        """
+        Adds all relevant lemmata of the content to the base vocabulary.
+
+        With workers > 1, the content is split into shards which are parsed
+        in separate processes.
+        """
         new_base_vocab: set[str] = set()
 
         content_line_num = buf_count_newlines(content_path)
 
-        with self.nlp_parsing_pipes, open(content_path) as f, Progress(
+        with self._load_vocabs() as (
+            existing_base_vocab,
+            existing_irrelevant_vocab,
+        ), self.nlp_parsing_pipes, open(content_path) as f, Progress(
             *enhanced_progress_params()
         ) as p:
             task = p.add_task(
                 "[yellow]Parsing into base vocabulary", total=content_line_num
             )
 
-            batch = " "
-            while batch:
-                batch = " ".join(
-                    [
-                        line.strip()
-                        for line in islice(f, Const.CONTEXT_LINE_NUM)
-                    ]
-                )
-
-                filtered_doc = filter(
-                    lambda t: self._is_relevant_token(
-                        t, existing_base_vocab, existing_irrelevant_vocab
-                    ),
-                    self.nlp(batch),
+            if workers > 1:
+                shards = self._shard_content(
+                    content_path, content_line_num, workers
                 )
-
-                for t in filtered_doc:
-                    new_base_vocab.add(t.lemma_.lower())
-
-                p.advance(task, Const.CONTEXT_LINE_NUM)
+                with _worker_pool(
+                    workers,
+                    existing_base_vocab,
+                    existing_irrelevant_vocab,
+                    batch_size,
+                ) as pool:
+                    for shard, lemmata in zip(
+                        shards, pool.imap(_parse_base_vocab_shard, shards)
+                    ):
+                        new_base_vocab.update(lemmata)
+                        p.advance(
+                            task,
+                            shard.line_num
+                            or content_line_num - shard.first_line,
+                        )
+            else:
+                for lemmata in self._parse_batches(
+                    self.nlp,
+                    f,
+                    existing_base_vocab,
+                    existing_irrelevant_vocab,
+                    batch_size,
+                ):
+                    new_base_vocab.update(lemmata)
+                    p.advance(task, Const.CONTEXT_LINE_NUM)
 
         with open(Const.PATH_BASE_VOCAB, "a") as f:
             for lemma in new_base_vocab:
@@ -114,15 +175,26 @@ class TextParser:
         self,
         content_path: str,
         metadata_path: str,
+        batch_size: int = Const.NLP_BATCH_SIZE,
+        workers: int = 1,
+        in_flight: int = Const.WRITE_MAX_IN_FLIGHT,
     ):
         """
-        TODO
+        Parses the content into context windows and adds relevant lemmata,
+        contexts and their relations to the database.
+
+        Windows are fed through nlp.pipe so that the transformer processes
+        batch_size windows at once. With workers > 1, the content is split
+        into shards which are parsed in separate processes. The database
+        writes stay in the main process and run in the background while
+        parsing goes on, up to in_flight buffered writes at once. The ids
+        follow the window order either way, so the resulting database state
+        is the same as for a serial run.
+
+        The time spent in every stage is recorded in self.metrics. With
+        workers > 1, the parsing stages are summed over the workers.
         """
-        existing_base_vocab = self._load_vocab(Const.PATH_BASE_VOCAB)
-        existing_irrelevant_vocab = self._load_vocab(
-            Const.PATH_IRRELEVANT_VOCAB
-        )
-
+        self.metrics = self.api.metrics = StageMetrics()
         source_metadata = self._load_metadata(metadata_path)
 
         source_kind_id = self.api.post_source_kind(source_metadata.source_kind)
@@ -134,138 +206,304 @@ class TextParser:
         )
         status_id_staged = self.api.post_status(StatusVal.STAGED)
 
-        self._normalise_file(content_path)
+        with self.metrics.time("normalise"):
+            self._normalise_file(content_path)
         content_line_num = buf_count_newlines(content_path)
-        with self.nlp_parsing_pipes, open(content_path) as f, Progress(
+        with self._load_vocabs() as (
+            existing_base_vocab,
+            existing_irrelevant_vocab,
+        ), self.nlp_parsing_pipes, open(content_path) as f, Progress(
             *enhanced_progress_params()
         ) as p:
             task = p.add_task(
                 "[yellow]Parsing into database", total=content_line_num
             )
 
-            # TODO: [perf] further batch requests (e.g. 1000 lemmata at a time,
-            #              not in every batch loop)
-            raw_context = []
-            pre_spill = []
-            post_spill = []
-            while True:
-                p.advance(task, Const.CONTEXT_LINE_NUM)
-
-                if not post_spill:
-                    raw_context = [
-                        line.strip()
-                        for line in islice(f, Const.CONTEXT_LINE_NUM)
-                    ]
-                else:
-                    raw_context = post_spill + [
-                        line.strip()
-                        for line in islice(
-                            f, Const.CONTEXT_LINE_NUM - Const.SPILL_LINE_NUM
-                        )
-                    ]
+            if workers > 1:
+                # Time the main process waits for the workers
+                parsed_windows = self.metrics.timed(
+                    "workers",
+                    self._parse_windows_parallel(
+                        content_path,
+                        content_line_num,
+                        workers,
+                        existing_base_vocab,
+                        existing_irrelevant_vocab,
+                        batch_size,
+                        self.metrics,
+                    ),
+                )
+            else:
+                parsed_windows = self._parse_windows(
+                    self.nlp,
+                    self._iter_windows(f),
+                    existing_base_vocab,
+                    existing_irrelevant_vocab,
+                    batch_size,
+                    self.metrics,
+                )
 
-                if not raw_context:
-                    break
+            with self.api.pipelined_writer(
+                source_id, status_id_staged, max_in_flight=in_flight
+            ) as writer:
+                for window in parsed_windows:
+                    p.advance(task, Const.CONTEXT_LINE_NUM)
+                    # Blocks while max_in_flight writes are pending
+                    with self.metrics.time("write"):
+                        writer.add(self._pending_context(window, self.metrics))
+                # The writer flushes and waits for the last writes on exit
+                drain_start = time.perf_counter()
+            self.metrics.record(
+                "write", time.perf_counter() - drain_start, calls=0
+            )
 
-                post_spill = [
-                    line.strip() for line in islice(f, Const.SPILL_LINE_NUM)
-                ]
+    @classmethod
+    def _pending_context(
+        cls, window: ParsedWindow, metrics: Union[StageMetrics, None] = None
+    ) -> PendingContext:
+        relevant = {t.text: t for t in window.relevant}
+        serialise = partial(cls._serialise_window, window)
+        return PendingContext(
+            lemmata=[
+                PendingLemma(t.lemma, t.pos, t.tag) for t in relevant.values()
+            ],
+            serialise=metrics.wrap("serialise", serialise)
+            if metrics
+            else serialise,
+        )
 
-                spilled_context = " ".join(
-                    pre_spill + raw_context + post_spill
-                )
+    @classmethod
+    def _serialise_window(
+        cls, window: ParsedWindow, lemma_id_dict: dict[str, LemmaId]
+    ) -> str:
+        db_data = {
+            t.text: IntermediaryDbDatum(
+                t.lemma,
+                lemma_id_dict[t.lemma],
+                t.tag,
+                t.pos,
+            )
+            for t in window.relevant
+        }
+        return cls._construct_context_value(window.tokens, db_data)
 
-                doc_spilled = self.nlp(spilled_context)
+    def _parse_windows_parallel(
+        self,
+        content_path: str,
+        content_line_num: int,
+        workers: int,
+        base_vocab: Container[str],
+        irrelevant_vocab: Container[str],
+        batch_size: int,
+        metrics: StageMetrics,
+    ) -> Iterator[ParsedWindow]:
+        """
+        Parses the shards of the content in a pool of worker processes.
+        Yields the parsed windows in the same order as a serial run.
+        The stages recorded by the workers are added to metrics.
+        """
+        shards = self._shard_content(content_path, content_line_num, workers)
+        with _worker_pool(
+            workers, base_vocab, irrelevant_vocab, batch_size
+        ) as pool:
+            for parsed_windows, stages in pool.imap(_parse_shard, shards):
+                metrics.merge(stages)
+                yield from parsed_windows
+
+    @classmethod
+    def _parse_windows(
+        cls,
+        nlp: Language,
+        windows: Iterable[ContextWindow],
+        base_vocab: Container[str],
+        irrelevant_vocab: Container[str],
+        batch_size: int,
+        metrics: Union[StageMetrics, None] = None,
+    ) -> Iterator[ParsedWindow]:
+        metrics = metrics or StageMetrics()
+        # nlp.pipe reads the windows lazily, the reading isn't nlp time
+        spilled_docs = metrics.timed(
+            "nlp",
+            nlp.pipe(
+                (
+                    (" ".join(w.pre_spill + w.raw_context + w.post_spill), w)
+                    for w in metrics.timed("read", windows)
+                ),
+                as_tuples=True,
+                batch_size=batch_size,
+            ),
+            nested=["read"],
+        )
+        for doc_spilled, window in spilled_docs:
+            with metrics.time("spill"):
+                doc_context = cls._context_span(doc_spilled, window)
+
+            with metrics.time("filter"):
+                parsed = ParsedWindow(
+                    tokens=[
+                        ContextToken(t.text, t.whitespace_)
+                        for t in doc_context
+                    ],
+                    # TODO: I think spacy lowers lemma text by default
+                    relevant=[
+                        RelevantToken(
+                            t.text, t.lemma_.lower(), t.tag_, UposTag(t.pos_)
+                        )
+                        for t in doc_context
+                        if cls._is_relevant_token(
+                            t, base_vocab, irrelevant_vocab
+                        )
+                    ],
+                )
+            yield parsed
 
-                # TODO: only tokenise, don't use all the other pipes
-                pre_spill_len = len(self.nlp(" ".join(pre_spill)))
-                post_spill_len = len(self.nlp(" ".join(post_spill)))
+    @staticmethod
+    def _context_span(doc_spilled: Doc, window: ContextWindow) -> Span:
+        """
+        Returns the part of the spilled doc which belongs to the raw context,
+        located by character offsets so that the spills don't need to be
+        parsed separately.
+        """
+        start = len(" ".join(window.pre_spill)) + 1 if window.pre_spill else 0
+        end = start + len(" ".join(window.raw_context))
+        span = doc_spilled.char_span(start, end, alignment_mode="expand")
+        return span if span is not None else doc_spilled[0:0]
+
+    @classmethod
+    def _parse_batches(
+        cls,
+        nlp: Language,
+        lines: Iterator[str],
+        base_vocab: Container[str],
+        irrelevant_vocab: Container[str],
+        batch_size: int,
+    ) -> Iterator[set[str]]:
+        """
+        Yields the relevant lemmata of every batch of
+        Const.CONTEXT_LINE_NUM lines.
+        """
+        batches = (
+            " ".join(line.strip() for line in batch_lines)
+            for batch_lines in iter(
+                lambda: list(islice(lines, Const.CONTEXT_LINE_NUM)), []
+            )
+        )
+        for doc in nlp.pipe(batches, batch_size=batch_size):
+            yield {
+                t.lemma_.lower()
+                for t in doc
+                if cls._is_relevant_token(t, base_vocab, irrelevant_vocab)
+            }
 
-                if raw_context and len(raw_context) >= Const.SPILL_LINE_NUM:
-                    pre_spill = [raw_context[-Const.SPILL_LINE_NUM]]
-                elif raw_context:
-                    pre_spill = raw_context
-                else:
-                    pre_spill = []
+    @staticmethod
+    def _iter_windows(
+        lines: Iterator[str], pre_spill: Union[list[str], None] = None
+    ) -> Iterator[ContextWindow]:
+        """
+        Splits a stream of lines into context windows of
+        Const.CONTEXT_LINE_NUM lines. The first Const.SPILL_LINE_NUM lines
+        of a window are the post-spill of the previous window, a single line
+        of the previous window is used as pre-spill.
 
-                doc_context = doc_spilled[
-                    pre_spill_len : len(doc_spilled) - post_spill_len
+        pre_spill is used for the first window when the stream starts in
+        the middle of a file.
+        """
+        pre_spill = pre_spill or []
+        post_spill: list[str] = []
+        while True:
+            if not post_spill:
+                raw_context = [
+                    line.strip()
+                    for line in islice(lines, Const.CONTEXT_LINE_NUM)
                 ]
-
-                doc_filtered = list(
-                    filter(
-                        lambda t: self._is_relevant_token(
-                            t,
-                            existing_base_vocab,
-                            existing_irrelevant_vocab,
-                        ),
-                        doc_context,
+            else:
+                raw_context = post_spill + [
+                    line.strip()
+                    for line in islice(
+                        lines, Const.CONTEXT_LINE_NUM - Const.SPILL_LINE_NUM
                     )
-                )
+                ]
 
-                if not doc_filtered:
-                    context_value = self._construct_context_value(
-                        doc_context, {}
-                    )
-                    self.api.post_context(context_value, source_id)
-                    continue
+            if not raw_context:
+                return
 
-                # TODO: I think spacy lowers lemma text by default
-                lemmata_values = [t.lemma_.lower() for t in doc_filtered]
+            post_spill = [
+                line.strip() for line in islice(lines, Const.SPILL_LINE_NUM)
+            ]
 
-                self.api.bulk_post_lemmata(
-                    lemmata_values=lemmata_values,
-                    status_id=status_id_staged,
-                    source_id=source_id,
-                )
+            yield ContextWindow(pre_spill, raw_context, post_spill)
 
-                lemma_id_dict = self.api.bulk_get_lemma_id_dict(lemmata_values)
+            if len(raw_context) >= Const.SPILL_LINE_NUM:
+                pre_spill = [raw_context[-Const.SPILL_LINE_NUM]]
+            else:
+                pre_spill = raw_context
 
-                db_data = {
-                    t.text: IntermediaryDbDatum(
-                        lemma := t.lemma_.lower(),
-                        lemma_id_dict[lemma],
-                        t.tag_,
-                        UposTag(t.pos_),
-                    )
-                    for t in doc_filtered
-                }
+    @staticmethod
+    def _iter_shard_windows(
+        f: Iterator[str], shard: Shard
+    ) -> Iterator[ContextWindow]:
+        """
+        Yields the same windows for the shard's line range as
+        _iter_windows yields for the whole file.
+        """
+        pre_spill: list[str] = []
+        if shard.first_line > 0:
+            lines = islice(f, shard.first_line - Const.SPILL_LINE_NUM, None)
+            pre_spill = [next(lines).strip()]
+            lines = islice(lines, Const.SPILL_LINE_NUM - 1, None)
+        else:
+            lines = iter(f)
+
+        windows = TextParser._iter_windows(lines, pre_spill)
+        if shard.line_num is None:
+            return windows
+        return islice(windows, shard.line_num // Const.CONTEXT_LINE_NUM)
 
-                context_value = self._construct_context_value(
-                    doc_context, db_data
+    @staticmethod
+    def _shard_content(
+        content_path: str, content_line_num: int, workers: int
+    ) -> list[Shard]:
+        """
+        Splits the content into shards along window boundaries. Each worker
+        gets Const.SHARDS_PER_WORKER shards on average to balance the load.
+        """
+        window_num = -(-content_line_num // Const.CONTEXT_LINE_NUM)
+        if window_num == 0:
+            return [Shard(content_path, 0, None)]
+        shard_num = max(1, min(window_num, workers * Const.SHARDS_PER_WORKER))
+        windows_per_shard = -(-window_num // shard_num)
+
+        shards = []
+        for first_window in range(0, window_num, windows_per_shard):
+            last = first_window + windows_per_shard >= window_num
+            shards.append(
+                Shard(
+                    content_path=content_path,
+                    first_line=first_window * Const.CONTEXT_LINE_NUM,
+                    line_num=None
+                    if last
+                    else windows_per_shard * Const.CONTEXT_LINE_NUM,
                 )
-                context_id = self.api.post_context(context_value, source_id)
-
-                source_rels = []
-                context_rels = []
-                for datum in db_data.values():
-                    source_rels.append(
-                        LemmaSourceRelation(
-                            lemma_id=datum.lemma_id, source_id=source_id
-                        )
-                    )
-                    context_rels.append(
-                        LemmaContextRelation(
-                            lemma_id=datum.lemma_id,
-                            context_id=context_id,
-                            upos_tag=datum.pos,
-                            detailed_tag=datum.tag,
-                        )
-                    )
+            )
+        return shards
 
-                self.api.bulk_post_lemma_source_relations(source_rels)
-                self.api.bulk_post_lemma_context_relations(context_rels)
+    @staticmethod
+    def _load_nlp() -> Language:
+        nlp = en_core_web_trf.load()  # TODO @ej localisation-relevant
+        TextParser._customise_tokenisation(nlp)
+        return nlp
 
-    def _customise_tokenisation(self):
-        prefixes = self.nlp.Defaults.prefixes + [r"""^-+"""]  # type: ignore
+    @staticmethod
+    def _customise_tokenisation(nlp: Language):
+        prefixes = nlp.Defaults.prefixes + [r"""^-+"""]  # type: ignore
         prefix_regex = spacy.util.compile_prefix_regex(prefixes)
-        self.nlp.tokenizer.prefix_search = prefix_regex.search
+        nlp.tokenizer.prefix_search = prefix_regex.search
 
-        suffixes = self.nlp.Defaults.suffixes + [
+        suffixes = nlp.Defaults.suffixes + [
             r"""-+$""",
         ]  # type: ignore
         suffix_regex = spacy.util.compile_suffix_regex(suffixes)
-        self.nlp.tokenizer.suffix_search = suffix_regex.search
+        nlp.tokenizer.suffix_search = suffix_regex.search
 
     @staticmethod
     def _load_metadata(path: str) -> SourceMetadata:
@@ -274,35 +512,55 @@ class TextParser:
         return SourceMetadata(**metadata)
 
     @staticmethod
-    def _load_vocab(path: str) -> set[str]:
-        with open(path) as f:
-            vocab = set(f.read().split())
-        return vocab
+    def _load_vocab(path: str) -> VocabIndex:
+        """
+        Maps the compiled index of the vocabulary file, which is rebuilt if
+        the file changed since.
+        """
+        return VocabIndex.load(path)
+
+    @classmethod
+    @contextmanager
+    def _load_vocabs(cls) -> Iterator[tuple[VocabIndex, VocabIndex]]:
+        """
+        Maps the base and the irrelevant vocabulary, and closes them again.
+        """
+        with cls._load_vocab(Const.PATH_BASE_VOCAB) as base_vocab:
+            with cls._load_vocab(Const.PATH_IRRELEVANT_VOCAB) as irrelevant:
+                yield base_vocab, irrelevant
 
     @staticmethod
     def _is_relevant_token(
-        token: Token, base_vocab: set[str], irrelevant_vocab: set[str]
+        token: Token,
+        base_vocab: Container[str],
+        irrelevant_vocab: Container[str],
     ):
-        lemma = token.lemma_.lower()
-        return (
-            lemma not in base_vocab
-            and lemma not in irrelevant_vocab
-            and token.pos_ in Const.UPOS_RELEVANT
+        # The token attributes are checked before the vocabulary lookups,
+        # which are more expensive
+        if not (
+            token.pos_ in Const.UPOS_RELEVANT
+            and token.is_alpha
             and not token.is_stop
-            and not is_stop(lemma, STOP_WORDS)
             and not token.like_num
             and not token.is_space
             and not token.is_digit
-            and token.is_alpha
+        ):
+            return False
+        lemma = token.lemma_.lower()
+        return (
+            not is_stop(lemma, STOP_WORDS)
+            and lemma not in base_vocab
+            and lemma not in irrelevant_vocab
         )
 
     @staticmethod
     def _construct_context_value(
-        doc: Doc, db_data: dict[str, IntermediaryDbDatum]
+        tokens: Iterable[ContextToken],
+        db_data: dict[str, IntermediaryDbDatum],
     ) -> str:
         context_value = []
 
-        for t in doc:
+        for t in tokens:
             if (token := t.text) in db_data:
                 context_value.append(
                     f"{token}::{db_data[token].lemma_id}{t.whitespace_}"
@@ -355,6 +613,90 @@ class TextParser:
             f.writelines(wrapped_lines)
 
 
+_worker_nlp: Union[Language, None] = None
+_worker_args: tuple[Container[str], Container[str], int] = (
+    set(),
+    set(),
+    1,
+)
+
+
+def _init_worker(
+    base_vocab: Container[str],
+    irrelevant_vocab: Container[str],
+    batch_size: int,
+):
+    global _worker_nlp, _worker_args
+    _worker_nlp = TextParser._load_nlp()
+    _worker_nlp.select_pipes(enable=PARSING_PIPES)
+    _worker_args = (base_vocab, irrelevant_vocab, batch_size)
+    for vocab in (base_vocab, irrelevant_vocab):
+        if isinstance(vocab, VocabIndex):
+            # Workers have no teardown hook, the vocabularies are closed
+            # when the worker exits
+            Finalize(vocab, vocab.close, exitpriority=0)
+
+
+@contextmanager
+def _worker_pool(
+    workers: int,
+    base_vocab: Container[str],
+    irrelevant_vocab: Container[str],
+    batch_size: int,
+) -> Iterator[Pool]:
+    # Forking after torch has been initialised in the parent can dead-lock,
+    # so every worker loads its own pipeline in a fresh process
+    pool = multiprocessing.get_context("spawn").Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(base_vocab, irrelevant_vocab, batch_size),
+    )
+    try:
+        yield pool
+    except BaseException:
+        pool.terminate()
+        raise
+    # Lets the workers exit on their own, which runs their finalisers,
+    # unlike terminating them
+    pool.close()
+    pool.join()
+
+
+def _parse_shard(
+    shard: Shard,
+) -> tuple[list[ParsedWindow], dict[str, StageStats]]:
+    assert _worker_nlp is not None
+    metrics = StageMetrics()
+    with open(shard.content_path) as f:
+        parsed_windows = list(
+            TextParser._parse_windows(
+                _worker_nlp,
+                TextParser._iter_shard_windows(f, shard),
+                *_worker_args,
+                metrics,
+            )
+        )
+    return parsed_windows, metrics.stages
+
+
+def _parse_base_vocab_shard(shard: Shard) -> set[str]:
+    assert _worker_nlp is not None
+    lemmata: set[str] = set()
+    with open(shard.content_path) as f:
+        lines = islice(
+            f,
+            shard.first_line,
+            None
+            if shard.line_num is None
+            else shard.first_line + shard.line_num,
+        )
+        for batch_lemmata in TextParser._parse_batches(
+            _worker_nlp, lines, *_worker_args
+        ):
+            lemmata.update(batch_lemmata)
+    return lemmata
+
+
 if __name__ == "__main__":
     tp = TextParser()
     tp.parse_into_db(
@@ -9,9 +9,9 @@ from typing import Union
 
 from api._const import Const
 from api._dbtypes import LemmaId, StatusVal
+from api._vocabindex import VocabIndex
 
 from .apirequestor import ApiRequestor
-from .textparser import TextParser
 
 
 class VocabManager:
@@ -24,10 +24,13 @@ class VocabManager:
     def transfer_lemma_to_irrelevant_vocab(self, lemma: str) -> bool:
         lemma_id = self.api.get_lemma_id(lemma)
         if result := self.api.delete_lemmata({lemma_id}):
-            irrelevant_vocab = TextParser._load_vocab(
-                Const.PATH_IRRELEVANT_VOCAB
-            )
-            if lemma not in irrelevant_vocab:
+            # A single lookup doesn't warrant rebuilding the index after
+            # every rm
+            with VocabIndex.load(
+                Const.PATH_IRRELEVANT_VOCAB, keep_appended=True
+            ) as irrelevant_vocab:
+                is_irrelevant = lemma in irrelevant_vocab
+            if not is_irrelevant:
                 with open(Const.PATH_IRRELEVANT_VOCAB, "a") as f, open(
                     Const.PATH_METADATA_DELETION, "a"
                 ) as fmeta:
@@ -40,8 +43,11 @@ class VocabManager:
     def transfer_lemmata_to_irrelevant_vocab(
         self, lemma_ids: set[LemmaId]
     ) -> bool:
-        irrelevant_vocab = TextParser._load_vocab(Const.PATH_IRRELEVANT_VOCAB)
-        with open(Const.PATH_IRRELEVANT_VOCAB, "a") as f, open(
+        with VocabIndex.load(
+            Const.PATH_IRRELEVANT_VOCAB, keep_appended=True
+        ) as irrelevant_vocab, open(
+            Const.PATH_IRRELEVANT_VOCAB, "a"
+        ) as f, open(
             Const.PATH_METADATA_DELETION, "a"
         ) as fmeta:
             for lid in lemma_ids:
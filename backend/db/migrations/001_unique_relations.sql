@@ -0,0 +1,27 @@
+-- Stores every lemma-source and lemma-context relation only once, so that
+-- bulk inserts can skip relations which are already in the database.
+
+DELETE FROM lemma_source a USING lemma_source b
+WHERE
+    a.id > b.id
+    AND a.lemma_id = b.lemma_id
+    AND a.source_id = b.source_id;
+
+ALTER TABLE lemma_source
+ADD CONSTRAINT unique_lemma_source UNIQUE (lemma_id, source_id);
+
+DELETE FROM lemma_context a USING lemma_context b
+WHERE
+    a.id > b.id
+    AND a.lemma_id = b.lemma_id
+    AND a.context_id = b.context_id
+    AND a.upos_tag = b.upos_tag
+    AND a.detailed_tag = b.detailed_tag;
+
+ALTER TABLE lemma_context
+ADD CONSTRAINT unique_lemma_context UNIQUE (
+    lemma_id,
+    context_id,
+    upos_tag,
+    detailed_tag
+);
@@ -0,0 +1,49 @@
+-- Deletes lemmata and their related data in a single transaction.
+--
+-- Removes the '::<lemma_id>' references from the context values, deletes
+-- the lemma-source and lemma-context relations, increases
+-- removed_lemmata_num of the sources the lemmata were found in and deletes
+-- the lemmata. Returns false without any changes if one of the lemmata
+-- doesn't exist.
+
+CREATE OR REPLACE FUNCTION bulk_delete_lemmata(lemma_ids bigint[])
+RETURNS boolean
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    lid bigint;
+BEGIN
+    lemma_ids := ARRAY(SELECT DISTINCT unnest(lemma_ids));
+
+    IF (SELECT count(*) FROM lemma WHERE id = ANY (lemma_ids))
+        <> cardinality(lemma_ids) THEN
+        RETURN false;
+    END IF;
+
+    FOREACH lid IN ARRAY lemma_ids LOOP
+        UPDATE context
+        SET context_value = regexp_replace(
+            context_value, '::' || lid || '(\D)', '\1', 'g'
+        )
+        WHERE id IN (
+            SELECT context_id FROM lemma_context WHERE lemma_id = lid
+        );
+    END LOOP;
+
+    UPDATE source
+    SET removed_lemmata_num = source.removed_lemmata_num + removed.num
+    FROM (
+        SELECT found_in_source, count(*) AS num
+        FROM lemma
+        WHERE id = ANY (lemma_ids)
+        GROUP BY found_in_source
+    ) AS removed
+    WHERE source.id = removed.found_in_source;
+
+    DELETE FROM lemma_context WHERE lemma_id = ANY (lemma_ids);
+    DELETE FROM lemma_source WHERE lemma_id = ANY (lemma_ids);
+    DELETE FROM lemma WHERE id = ANY (lemma_ids);
+
+    RETURN true;
+END;
+$$;
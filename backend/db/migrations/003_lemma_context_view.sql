@@ -0,0 +1,24 @@
+-- Contexts joined with the lemmata they contain, one row per lemma and
+-- context. Lets the contexts of a lemma be read and paginated with a
+-- single query, using the unique_lemma_context index.
+--
+-- A lemma may be related to a context with several tags. Only the first
+-- of these relations is kept, which is decided per row with the index, so
+-- that a page by (lemma_id, id) is an index range scan that stops after
+-- the page instead of deduplicating every context of the lemma first.
+
+CREATE OR REPLACE VIEW lemma_context_view AS
+SELECT
+    lc.lemma_id,
+    lc.context_id AS id,
+    c.context_value,
+    c.created,
+    c.source_id
+FROM lemma_context lc
+JOIN context c ON c.id = lc.context_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM lemma_context dup
+    WHERE dup.lemma_id = lc.lemma_id
+    AND dup.context_id = lc.context_id
+    AND dup.id < lc.id
+);
@@ -0,0 +1,61 @@
+-- Adds the contexts which are not in the database yet, in the order of the
+-- input, and returns the ids of all of them in the order of the input.
+--
+-- Contexts are matched by (context_value, source_id) like in add_context,
+-- contexts which occur more than once share one row. Adding the same
+-- contexts again, e.g. when an ingest is rerun after a crash or a request
+-- is retried, returns the existing ids instead of duplicating the rows.
+-- Calls for the same source are serialised, so that concurrent calls
+-- don't both insert a context neither of them found.
+--
+-- Contexts are looked up with idx_context_source_value. It indexes the md5
+-- of the context, as contexts may be longer than a btree entry can be.
+
+CREATE INDEX IF NOT EXISTS idx_context_source_value
+ON context (source_id, md5(context_value));
+
+CREATE OR REPLACE FUNCTION bulk_add_contexts(contexts jsonb)
+RETURNS bigint[]
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    sid bigint;
+BEGIN
+    FOR sid IN
+        SELECT DISTINCT (c ->> 'source_id')::bigint
+        FROM jsonb_array_elements(contexts) AS c
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(sid);
+    END LOOP;
+
+    INSERT INTO context (context_value, source_id)
+    SELECT added.context_value, added.source_id
+    FROM (
+        SELECT DISTINCT ON (c ->> 'context_value', c ->> 'source_id')
+            c ->> 'context_value' AS context_value,
+            (c ->> 'source_id')::bigint AS source_id,
+            ord
+        FROM jsonb_array_elements(contexts) WITH ORDINALITY AS e (c, ord)
+        ORDER BY c ->> 'context_value', c ->> 'source_id', ord
+    ) AS added
+    WHERE NOT EXISTS (
+        SELECT 1 FROM context
+        WHERE context.source_id = added.source_id
+        AND md5(context.context_value) = md5(added.context_value)
+        AND context.context_value = added.context_value
+    )
+    ORDER BY added.ord;
+
+    RETURN ARRAY(
+        SELECT (
+            SELECT min(context.id) FROM context
+            WHERE context.source_id = (e.c ->> 'source_id')::bigint
+            AND md5(context.context_value) = md5(e.c ->> 'context_value')
+            AND context.context_value = e.c ->> 'context_value'
+        )
+        FROM jsonb_array_elements(contexts) WITH ORDINALITY AS e (c, ord)
+        ORDER BY e.ord
+    );
+END;
+$$;
@@ -58,7 +58,8 @@ CREATE TABLE
     IF NOT EXISTS lemma_source (
         id INTEGER PRIMARY KEY AUTO_INCREMENT,
         lemma_id INTEGER NOT NULL,
-        source_id INTEGER NOT NULL
+        source_id INTEGER NOT NULL,
+        CONSTRAINT unique_lemma_source UNIQUE (lemma_id, source_id)
     );
 
 CREATE TABLE
@@ -89,5 +90,34 @@ CREATE TABLE
             'PUNCT',
             'X'
         ) NOT NULL,
-        detailed_tag VARCHAR(10) NOT NULL
+        detailed_tag VARCHAR(10) NOT NULL,
+        CONSTRAINT unique_lemma_context UNIQUE (
+            lemma_id,
+            context_id,
+            upos_tag,
+            detailed_tag
+        )
+    );
+
+CREATE VIEW
+    lemma_context_view AS
+SELECT
+    lc.lemma_id,
+    lc.context_id AS id,
+    c.context_value,
+    c.created,
+    c.source_id
+FROM
+    lemma_context lc
+    JOIN context c ON c.id = lc.context_id
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            lemma_context dup
+        WHERE
+            dup.lemma_id = lc.lemma_id
+            AND dup.context_id = lc.context_id
+            AND dup.id < lc.id
     );
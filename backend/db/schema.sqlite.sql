@@ -0,0 +1,119 @@
+CREATE TABLE
+    IF NOT EXISTS lemma_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL UNIQUE CHECK (
+            status IN ('staged', 'committed', 'pushed')
+        )
+    );
+
+CREATE TABLE
+    IF NOT EXISTS lemma (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lemma TEXT NOT NULL UNIQUE,
+        created DATETIME DEFAULT CURRENT_TIMESTAMP,
+        status_id INTEGER NOT NULL,
+        found_in_source INTEGER NOT NULL
+    );
+
+CREATE INDEX IF NOT EXISTS idx_lemma_status_id ON lemma (status_id, id);
+
+CREATE TABLE
+    IF NOT EXISTS source_kind (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL UNIQUE CHECK (
+            kind IN ('book', 'article', 'conversation', 'film', 'other')
+        )
+    );
+
+CREATE TABLE
+    IF NOT EXISTS source (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        source_kind_id INTEGER NOT NULL,
+        author TEXT NOT NULL,
+        lang TEXT NOT NULL,
+        removed_lemmata_num INTEGER NOT NULL DEFAULT 0,
+        CONSTRAINT unique_title_kind_id UNIQUE (title, source_kind_id)
+    );
+
+CREATE TABLE
+    IF NOT EXISTS lemma_source (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lemma_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        CONSTRAINT unique_lemma_source UNIQUE (lemma_id, source_id)
+    );
+
+CREATE INDEX IF NOT EXISTS idx_lemma_source_source_id ON lemma_source (source_id);
+
+CREATE TABLE
+    IF NOT EXISTS context (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        context_value TEXT NOT NULL,
+        created DATETIME DEFAULT CURRENT_TIMESTAMP,
+        source_id INTEGER NOT NULL
+    );
+
+CREATE INDEX IF NOT EXISTS idx_context_source_id ON context (source_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_context_source_value ON context (source_id, context_value);
+
+CREATE TABLE
+    IF NOT EXISTS lemma_context (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lemma_id INTEGER NOT NULL,
+        context_id INTEGER NOT NULL,
+        upos_tag TEXT NOT NULL CHECK (
+            upos_tag IN (
+                'NOUN',
+                'VERB',
+                'ADJ',
+                'ADV',
+                'PROPN',
+                'PRON',
+                'DET',
+                'ADP',
+                'NUM',
+                'CONJ',
+                'PRT',
+                'PUNCT',
+                'X'
+            )
+        ),
+        detailed_tag TEXT NOT NULL,
+        CONSTRAINT unique_lemma_context UNIQUE (
+            lemma_id,
+            context_id,
+            upos_tag,
+            detailed_tag
+        )
+    );
+
+CREATE INDEX IF NOT EXISTS idx_lemma_context_context_id ON lemma_context (context_id);
+
+-- Replaced on every start, so that databases created with an earlier
+-- definition pick up the current one
+DROP VIEW IF EXISTS lemma_context_view;
+
+CREATE VIEW
+    lemma_context_view AS
+SELECT
+    lc.lemma_id,
+    lc.context_id AS id,
+    c.context_value,
+    c.created,
+    c.source_id
+FROM
+    lemma_context lc
+    JOIN context c ON c.id = lc.context_id
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            lemma_context dup
+        WHERE
+            dup.lemma_id = lc.lemma_id
+            AND dup.context_id = lc.context_id
+            AND dup.id < lc.id
+    );
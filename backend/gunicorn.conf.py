@@ -0,0 +1,29 @@
+"""
+Gunicorn Config
+===============
+Lets the workers share their Prometheus metrics, so that /metrics reports
+the whole server no matter which worker answers it (see api/_metrics.py).
+"""
+
+import os
+import shutil
+import tempfile
+
+# Must be set before prometheus_client is imported, the forked workers
+# inherit it
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "lex-prometheus"),
+)
+
+
+def on_starting(server):
+    # Metrics of a previous run would be added to the new ones
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
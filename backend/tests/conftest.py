@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The CLI imports the API as a top-level package (api), as both are run
+# from backend/. Tests of the CLI and of the app import them the same way,
+# so that every module is only loaded once.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# api.index connects to the PROD database on import. Import it on an
+# in-memory SQLite database instead, the tests replace its db anyway.
+with pytest.MonkeyPatch.context() as mp:
+    mp.setenv("LEX_DB_BACKEND", "sqlite")
+    mp.setenv("LEX_SQLITE_PATH_PROD", ":memory:")
+    import api.index  # noqa: F401
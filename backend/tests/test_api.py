@@ -0,0 +1,190 @@
+from collections.abc import Iterator
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from api import index
+from api._db import AsyncLexDbIntegrator, LexDbIntegrator
+from api._dbtypes import (
+    Context,
+    DbEnvironment,
+    LemmaContextRelation,
+    LemmaId,
+    Source,
+    SourceKindVal,
+    StatusVal,
+    UposTag,
+)
+from api._metrics import record_db_call
+from api._storage import ObservedBackend, SqliteBackend
+from cli.apirequestor import EmbeddedTransport
+
+PAGE_SIZE = 3
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> LexDbIntegrator:
+    # Observed like in index.set_db_env, so the database calls are counted
+    db = LexDbIntegrator(
+        DbEnvironment.DEV,
+        ObservedBackend(SqliteBackend(":memory:"), [record_db_call]),
+    )
+    monkeypatch.setattr(index, "db", AsyncLexDbIntegrator(db))
+    return db
+
+
+@pytest.fixture
+def client(db: LexDbIntegrator) -> Iterator[httpx.Client]:
+    with httpx.Client(
+        transport=EmbeddedTransport(index.app), base_url="http://api"
+    ) as client:
+        yield client
+
+
+def populate(db: LexDbIntegrator, context_num: int) -> LemmaId:
+    """
+    Adds a source with context_num contexts which all mention the same
+    lemma, and returns the lemma's id.
+    """
+    source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+    for title in ("The Hobbit", "The Silmarillion"):
+        db.add_source(
+            Source(
+                title=title,
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+    source_id = db.get_source_id("The Hobbit", source_kind_id)
+    lemma_id = db.bulk_add_lemma(
+        ["hobbit"], db.add_status(StatusVal.STAGED), source_id
+    )["hobbit"]
+    context_ids = db.bulk_add_contexts(
+        [
+            Context(context_value=f"Context {i}.", source_id=source_id)
+            for i in range(context_num)
+        ]
+    )
+    db.bulk_add_lemma_context_relations(
+        [
+            LemmaContextRelation(
+                lemma_id=lemma_id,
+                context_id=context_id,
+                upos_tag=UposTag.NOUN,
+                detailed_tag="NN",
+            )
+            for context_id in context_ids
+        ]
+    )
+    return lemma_id
+
+
+def follow_cursor(client: httpx.Client, path: str, **params) -> list[list]:
+    """
+    Requests the pages of path by following X-Next-Cursor, returns the ids
+    of every page.
+    """
+    pages = []
+    params["page_size"] = PAGE_SIZE
+    while True:
+        r = client.get(path, params=params)
+        assert r.status_code == 200
+        pages.append([row["id"] for row in r.json()])
+        if (cursor := r.headers.get("X-Next-Cursor")) is None:
+            return pages
+        assert cursor == str(pages[-1][-1])
+        params["after_id"] = cursor
+
+
+@pytest.mark.parametrize(
+    "context_num, page_lengths", [(7, [3, 3, 1]), (6, [3, 3, 0]), (0, [0])]
+)
+def test_next_cursor_pages_through_contexts(
+    client: httpx.Client,
+    db: LexDbIntegrator,
+    context_num: int,
+    page_lengths: list[int],
+):
+    lemma_id = populate(db, context_num)
+    context_ids = [c.id for c in db.get_paginated_contexts(1, 100)]
+    for path in (
+        "/contexts",
+        f"/lemma_contexts/{lemma_id}",
+        "/source_contexts/1",
+    ):
+        pages = follow_cursor(client, path)
+        assert [len(page) for page in pages] == page_lengths
+        assert [i for page in pages for i in page] == context_ids
+
+
+def test_next_cursor_pages_through_sources_and_lemmata(
+    client: httpx.Client, db: LexDbIntegrator
+):
+    populate(db, 0)
+    assert follow_cursor(client, "/sources") == [[1, 2]]
+    assert follow_cursor(
+        client, "/status_lemmata", status_val=StatusVal.STAGED.value
+    ) == [[1]]
+
+
+def sample_sum(name: str, **labels: str) -> float:
+    """
+    Sums the samples of the metric with the labels, over all other labels.
+    """
+    return sum(
+        sample.value
+        for metric in REGISTRY.collect()
+        for sample in metric.samples
+        if sample.name == name and labels.items() <= sample.labels.items()
+    )
+
+
+def test_metrics_label_requests_by_route_template(
+    client: httpx.Client, db: LexDbIntegrator
+):
+    lemma_id = populate(db, 2)
+    route = "/lemma_contexts/{lemma_id}"
+    requests_before = sample_sum(
+        "lex_http_request_duration_seconds_count",
+        method="GET",
+        route=route,
+        status="200",
+    )
+    db_calls_before = sample_sum("lex_db_calls_total")
+    request_db_calls_before = sample_sum(
+        "lex_http_request_db_calls_sum", method="GET", route=route
+    )
+
+    for _ in range(2):
+        r = client.get(
+            f"/lemma_contexts/{lemma_id}", params={"page_size": PAGE_SIZE}
+        )
+        assert r.status_code == 200
+    assert client.get("/no/such/route").status_code == 404
+
+    assert (
+        sample_sum(
+            "lex_http_request_duration_seconds_count",
+            method="GET",
+            route=route,
+            status="200",
+        )
+        == requests_before + 2
+    )
+    db_calls = sample_sum("lex_db_calls_total") - db_calls_before
+    assert db_calls >= 2
+    assert (
+        sample_sum("lex_http_request_db_calls_sum", method="GET", route=route)
+        - request_db_calls_before
+        == db_calls
+    )
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain")
+    assert f'route="{route}"' in r.text
+    assert f'route="/lemma_contexts/{lemma_id}"' not in r.text
+    assert 'route="unmatched",status="404"' in r.text
+    assert "lex_db_calls_total{" in r.text
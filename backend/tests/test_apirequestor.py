@@ -0,0 +1,300 @@
+import asyncio
+from concurrent.futures import wait
+
+import httpx
+import pytest
+
+from api import index
+from api._const import Const
+from api._db import AsyncLexDbIntegrator, LexDbIntegrator
+from api._dbtypes import (
+    DbEnvironment,
+    LemmaSourceRelation,
+    SourceId,
+    SourceKindVal,
+    StatusId,
+    StatusVal,
+    UposTag,
+)
+from api._storage import SqliteBackend
+from cli.apirequestor import (
+    ApiConnectionError,
+    ApiMode,
+    ApiRequestError,
+    ApiRequestor,
+    ApiResponseError,
+    AsyncApiRequestor,
+    EmbeddedTransport,
+    PendingContext,
+    PendingLemma,
+)
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> LexDbIntegrator:
+    db = LexDbIntegrator(DbEnvironment.DEV, SqliteBackend(":memory:"))
+    monkeypatch.setattr(index, "db", AsyncLexDbIntegrator(db))
+    return db
+
+
+@pytest.fixture
+def api(db: LexDbIntegrator) -> ApiRequestor:
+    return ApiRequestor(ApiMode.EMBEDDED)
+
+
+def add_source(api: ApiRequestor) -> tuple[SourceId, StatusId]:
+    source_id = api.post_source(
+        title="The Hobbit",
+        source_kind_id=api.post_source_kind(SourceKindVal.BOOK),
+        author="Some Author",
+        lang="en",
+    )
+    return source_id, api.post_status(StatusVal.STAGED)
+
+
+def pending_context(i: int, lemmata: list[str]) -> PendingContext:
+    return PendingContext(
+        lemmata=[PendingLemma(lemma, UposTag.NOUN, "NN") for lemma in lemmata],
+        serialise=lambda lemma_id_dict: f"Context {i}: "
+        + " ".join(f"{lemma}::{lemma_id_dict[lemma]}" for lemma in lemmata),
+    )
+
+
+def context_values(db: LexDbIntegrator) -> list[str]:
+    return [c.context_value for c in db.get_paginated_contexts(1, 100)]
+
+
+def test_buffered_writer_writes_contexts_in_order(
+    api: ApiRequestor, db: LexDbIntegrator
+):
+    source_id, status_id = add_source(api)
+    with api.buffered_writer(source_id, status_id, buffer_size=2) as writer:
+        for i in range(5):
+            writer.add(pending_context(i, ["hobbit", f"lemma{i}"]))
+
+    lemma_id = db.get_lemma_id("hobbit")
+    assert context_values(db) == [
+        f"Context {i}: hobbit::{lemma_id} lemma{i}::"
+        f"{db.get_lemma_id(f'lemma{i}')}"
+        for i in range(5)
+    ]
+    assert len(db.get_lemma_contexts(lemma_id, page=1, page_size=10)) == 5
+    assert [s.id for s in db.get_lemma_sources(lemma_id)] == [source_id]
+
+
+def test_buffered_writer_flushes_before_error(
+    api: ApiRequestor, db: LexDbIntegrator
+):
+    source_id, status_id = add_source(api)
+    with pytest.raises(RuntimeError):
+        with api.buffered_writer(source_id, status_id) as writer:
+            for i in range(3):
+                writer.add(pending_context(i, ["hobbit"]))
+            raise RuntimeError("parsing failed")
+
+    assert len(context_values(db)) == 3
+
+
+def test_embedded_mode_reads_and_writes(api: ApiRequestor):
+    source_id, status_id = add_source(api)
+    assert api.get_lemma_id("hobbit") == -1
+    lemma_id = api.post_lemma("hobbit", status_id, source_id)
+    assert api.get_lemma_name(lemma_id) == "hobbit"
+    lemma_ids = api.bulk_post_lemmata(["hobbit", "ring"], status_id, source_id)
+    assert lemma_ids["hobbit"] == lemma_id
+    assert api.get_lemma_id("ring") == lemma_ids["ring"]
+    assert api.get_lemma_status(StatusVal.STAGED) == status_id
+
+
+def test_error_status_raises_api_request_error(api: ApiRequestor):
+    with pytest.raises(ApiRequestError) as e:
+        api._request("GET", "/lemma/not-an-id")
+    assert e.value.status_code == 422
+
+
+def test_app_error_raises_api_request_error(
+    api: ApiRequestor, db: LexDbIntegrator, monkeypatch: pytest.MonkeyPatch
+):
+    def fail(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(db, "bulk_get_lemma_id_dict", fail)
+    with pytest.raises(ApiRequestError) as e:
+        api.bulk_get_lemma_id_dict(["hobbit"])
+    assert e.value.status_code == 500
+
+
+def test_failed_operation_raises_api_response_error(api: ApiRequestor):
+    with pytest.raises(ApiResponseError):
+        api.post_lemma("hobbit", StatusId(1), SourceId(1))
+
+
+def test_transport_error_raises_api_connection_error(
+    api: ApiRequestor, monkeypatch: pytest.MonkeyPatch
+):
+    def fail(self, request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("unreachable", request=request)
+
+    monkeypatch.setattr(EmbeddedTransport, "handle_request", fail)
+    with pytest.raises(ApiConnectionError):
+        api.get_lemma_status(StatusVal.STAGED)
+
+
+def test_refused_relation_clears_lemma_id_cache(
+    api: ApiRequestor, db: LexDbIntegrator
+):
+    source_id, status_id = add_source(api)
+    lemma_id = api.bulk_post_lemmata(["hobbit"], status_id, source_id)[
+        "hobbit"
+    ]
+    # Deleted by another process, the requestor still has it cached
+    assert db.bulk_delete_lemmata({lemma_id})
+    with pytest.raises(ApiResponseError):
+        api.bulk_post_lemma_source_relations(
+            [LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)]
+        )
+    assert len(api.lemma_id_cache) == 0
+    assert api.bulk_post_lemmata(["hobbit"], status_id, source_id)[
+        "hobbit"
+    ] == db.get_lemma_id("hobbit")
+
+
+def test_pooled_session_retries_idempotent_methods():
+    retry = (
+        ApiRequestor._pooled_session()
+        .get_adapter(Const.API_LOCAL_URL)
+        .max_retries
+    )
+    assert retry.is_retry("POST", 503)
+    assert retry.is_retry("GET", 502)
+    assert not retry.is_retry("DELETE", 503)
+    assert not retry.is_retry("PATCH", 503)
+    assert not retry.is_retry("POST", 400)
+
+
+def failing_requestor(
+    monkeypatch: pytest.MonkeyPatch, failures: list
+) -> tuple[AsyncApiRequestor, list[str]]:
+    """
+    Requestor whose requests fail with the failures, an exception or a
+    status, before they succeed.
+    """
+    monkeypatch.setattr(Const, "API_RETRY_BACKOFF", 0)
+    sent: list[str] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        sent.append(request.method)
+        if not failures:
+            return httpx.Response(200, json=True)
+        if isinstance(failure := failures.pop(0), int):
+            return httpx.Response(failure)
+        raise failure(request.method, request=request)
+
+    requestor = AsyncApiRequestor(ApiMode.HTTP)
+    requestor.client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    return requestor, sent
+
+
+@pytest.mark.parametrize(
+    "method, failures, attempts",
+    [
+        ("POST", [503, httpx.ReadTimeout], 3),
+        ("DELETE", [httpx.ConnectError], 2),
+        ("PATCH", [httpx.ConnectTimeout], 2),
+    ],
+)
+def test_async_requestor_retries(
+    monkeypatch: pytest.MonkeyPatch,
+    method: str,
+    failures: list,
+    attempts: int,
+):
+    requestor, sent = failing_requestor(monkeypatch, failures)
+    r = asyncio.run(requestor._request(method, "/lemma"))
+    assert r.status_code == 200
+    assert sent == [method] * attempts
+
+
+@pytest.mark.parametrize(
+    "method, failure, error",
+    [
+        ("POST", 400, ApiRequestError),
+        ("DELETE", 503, ApiRequestError),
+        ("PATCH", 503, ApiRequestError),
+        ("PATCH", httpx.ReadTimeout, ApiConnectionError),
+        ("DELETE", httpx.ReadTimeout, ApiConnectionError),
+    ],
+)
+def test_async_requestor_does_not_retry(
+    monkeypatch: pytest.MonkeyPatch, method: str, failure, error
+):
+    requestor, sent = failing_requestor(monkeypatch, [failure])
+    with pytest.raises(error):
+        asyncio.run(requestor._request(method, "/lemma"))
+    assert sent == [method]
+
+
+def test_pipelined_writer_keeps_order_of_contexts(
+    api: ApiRequestor, db: LexDbIntegrator, monkeypatch: pytest.MonkeyPatch
+):
+    request = AsyncApiRequestor._request
+    # The first request of the first flush is slow, so the later flushes
+    # would overtake it if they weren't ordered
+    delays = iter([0.2])
+
+    async def slow_request(self, method: str, path: str, **kwargs):
+        await asyncio.sleep(next(delays, 0))
+        return await request(self, method, path, **kwargs)
+
+    monkeypatch.setattr(AsyncApiRequestor, "_request", slow_request)
+    source_id, status_id = add_source(api)
+    with api.pipelined_writer(
+        source_id, status_id, buffer_size=2, max_in_flight=3
+    ) as writer:
+        for i in range(6):
+            writer.add(pending_context(i, [f"lemma{i}"]))
+
+    lemma_ids = [db.get_lemma_id(f"lemma{i}") for i in range(6)]
+    assert lemma_ids == sorted(lemma_ids)
+    assert context_values(db) == [
+        f"Context {i}: lemma{i}::{lemma_id}"
+        for i, lemma_id in enumerate(lemma_ids)
+    ]
+
+
+def test_pipelined_writer_flushes_before_error(
+    api: ApiRequestor, db: LexDbIntegrator
+):
+    source_id, status_id = add_source(api)
+    with pytest.raises(RuntimeError):
+        with api.pipelined_writer(source_id, status_id) as writer:
+            for i in range(3):
+                writer.add(pending_context(i, ["hobbit"]))
+            raise RuntimeError("parsing failed")
+
+    assert len(context_values(db)) == 3
+
+
+def test_pipelined_writer_keeps_contexts_pending_after_failed_write(
+    api: ApiRequestor,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture,
+):
+    async def fail(self, *args, **kwargs):
+        raise ApiConnectionError("unreachable")
+
+    monkeypatch.setattr(AsyncApiRequestor, "bulk_post_lemmata", fail)
+    source_id, status_id = add_source(api)
+    with pytest.raises(ApiConnectionError):
+        with api.pipelined_writer(
+            source_id, status_id, buffer_size=2
+        ) as writer:
+            for i in range(2):
+                writer.add(pending_context(i, ["hobbit"]))
+            wait(writer._futures)
+            writer.add(pending_context(2, ["hobbit"]))
+            with pytest.raises(ApiConnectionError):
+                writer.add(pending_context(3, ["hobbit"]))
+            assert len(writer._pending) == 2
+
+    assert "Could not write 2 buffered contexts" in capsys.readouterr().out
@@ -1,8 +1,14 @@
+import asyncio
+import os
 import subprocess
+import threading
+import time
+from typing import Union
 
 import pytest
 
-from ..api._db import LexDbIntegrator
+from ..api._const import Const
+from ..api._db import AsyncLexDbIntegrator, LexDbIntegrator
 from ..api._dbtypes import (
     Context,
     ContextId,
@@ -20,19 +26,36 @@ from ..api._dbtypes import (
     StatusVal,
     UposTag,
 )
+from ..api._storage import (
+    ObservedBackend,
+    SqliteBackend,
+    StorageBackend,
+    StorageCall,
+    create_backend,
+)
+from ..api._tracing import TRACER
 from ..api._utils import absolutify_path_from_root
 
+# Tests run against an in-memory SQLite database unless LEX_TEST_BACKEND is
+# set to 'supabase'
+REMOTE_BACKEND = os.getenv("LEX_TEST_BACKEND", "sqlite") == "supabase"
+
+
+def make_backend() -> Union[StorageBackend, None]:
+    return None if REMOTE_BACKEND else SqliteBackend(":memory:")
+
 
 @pytest.fixture
 def db():
-    db = LexDbIntegrator(DbEnvironment.DEV)
+    db = LexDbIntegrator(DbEnvironment.DEV, make_backend())
     db.truncate_all_tables()
     yield db
     db.truncate_all_tables()
 
 
 db_changed = pytest.mark.skipif(
-    condition=not bool(
+    condition=REMOTE_BACKEND
+    and not bool(
         subprocess.run(
             [
                 "git",
@@ -52,7 +75,7 @@ class TestInexpensiveDbMethods:
         assert db.connection is not None
 
     def test_empty_all_tables_prod_fail(self):
-        db = LexDbIntegrator(DbEnvironment.PROD)
+        db = LexDbIntegrator(DbEnvironment.PROD, make_backend())
         with pytest.raises(AssertionError):
             db.truncate_all_tables()
 
@@ -208,6 +231,15 @@ class TestExpensiveDbMethods:
         status_id = db.add_status(StatusVal.STAGED)
         assert db.get_status_id(StatusVal.STAGED) == status_id
 
+    def test_get_status_id_added_by_other_integrator(
+        self, db: LexDbIntegrator
+    ):
+        db.add_status(StatusVal.STAGED)
+        assert db.get_status_id(StatusVal.COMMITTED) == -1
+        other = LexDbIntegrator(db.env, db.connection)
+        status_id = other.add_status(StatusVal.COMMITTED)
+        assert db.get_status_id(StatusVal.COMMITTED) == status_id
+
     def test_get_status_by_id_invalid_status_id(self, db: LexDbIntegrator):
         assert db.get_status_by_id(StatusId(-1)) is None
 
@@ -308,6 +340,34 @@ class TestExpensiveDbMethods:
         )
         assert lemma_id_1 == lemma_id_2
 
+    def test_bulk_add_lemma_complete_map(self, db: LexDbIntegrator):
+        status_id = db.add_status(StatusVal.STAGED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        existing_id = db.add_lemma(
+            Lemma(
+                lemma="existing",
+                status_id=status_id,
+                found_in_source=source_id,
+            )
+        )
+        lemma_ids = db.bulk_add_lemma(
+            ["new", "existing", "new", "other"],
+            status_id=status_id,
+            found_in_source=source_id,
+        )
+        assert lemma_ids.keys() == {"new", "existing", "other"}
+        assert lemma_ids["existing"] == existing_id
+        assert lemma_ids["new"] == db.get_lemma_id("new")
+        assert lemma_ids["other"] == db.get_lemma_id("other")
+
     def test_get_lemma_id_invalid_lemma(self, db: LexDbIntegrator):
         assert db.get_lemma_id("invalid_lemma") == -1
 
@@ -424,6 +484,34 @@ class TestExpensiveDbMethods:
             LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)
         )
 
+    def test_bulk_add_lemma_source_relations_no_duplicates(
+        self, db: LexDbIntegrator
+    ):
+        status_id = db.add_status(StatusVal.STAGED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        lemma_id = db.add_lemma(
+            Lemma(
+                lemma="test-lemma",
+                status_id=status_id,
+                found_in_source=source_id,
+            )
+        )
+        rels = [
+            LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)
+            for _ in range(3)
+        ]
+        assert db.bulk_add_lemma_source_relations(rels)
+        assert db.bulk_add_lemma_source_relations(rels)
+        assert len(db.get_lemma_source_relation_ids(lemma_id, source_id)) == 1
+
     def test_get_lemma_source_ids_invalid_ids(self, db: LexDbIntegrator):
         assert (
             db.get_lemma_source_relation_ids(LemmaId(-1), SourceId(-1)) == []
@@ -509,7 +597,7 @@ class TestExpensiveDbMethods:
         db.add_lemma_source_relation(
             LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)
         )
-        assert len(db.get_lemma_source_relation_ids(lemma_id, source_id)) == 2
+        assert len(db.get_lemma_source_relation_ids(lemma_id, source_id)) == 1
 
     def test_add_context_invalid_source_id(self, db: LexDbIntegrator):
         assert (
@@ -554,6 +642,92 @@ class TestExpensiveDbMethods:
         )
         assert context_id_1 == context_id_2
 
+    def test_bulk_add_contexts_invalid_source_id(self, db: LexDbIntegrator):
+        assert (
+            db.bulk_add_contexts(
+                [Context(context_value="context", source_id=SourceId(-1))]
+            )
+            == []
+        )
+
+    def test_bulk_add_contexts_ordered_ids(self, db: LexDbIntegrator):
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        context_values = ["context-1", "context-2", "context-1", "context-3"]
+        context_ids = db.bulk_add_contexts(
+            [
+                Context(context_value=value, source_id=source_id)
+                for value in context_values
+            ]
+        )
+        assert len(context_ids) == len(context_values)
+        assert context_ids[0] == context_ids[2]
+        for value, context_id in zip(context_values, context_ids):
+            assert (context := db.get_context(context_id)) is not None
+            assert context.context_value == value
+
+    def test_bulk_add_contexts_same_windows_twice(self, db: LexDbIntegrator):
+        status_id = db.add_status(StatusVal.STAGED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id, other_source_id = (
+            db.add_source(
+                Source(
+                    title=title,
+                    source_kind_id=source_kind_id,
+                    author="Some Author",
+                    lang="en",
+                )
+            )
+            for title in ("The Hobbit", "The Silmarillion")
+        )
+        lemma_ids = db.bulk_add_lemma(["hobbit", "ring"], status_id, source_id)
+        existing_id = db.add_context(
+            Context(context_value="context-2", source_id=source_id)
+        )
+
+        def ingest() -> list[ContextId]:
+            context_ids = db.bulk_add_contexts(
+                [
+                    Context(context_value=value, source_id=source_id)
+                    for value in ("context-1", "context-2", "context-3")
+                ]
+            )
+            assert db.bulk_add_lemma_context_relations(
+                [
+                    LemmaContextRelation(
+                        lemma_id=lemma_id,
+                        context_id=context_id,
+                        upos_tag=UposTag.NOUN,
+                        detailed_tag="NN",
+                    )
+                    for context_id in context_ids
+                    for lemma_id in lemma_ids.values()
+                ]
+            )
+            return context_ids
+
+        context_ids = ingest()
+        assert context_ids[1] == existing_id
+        assert ingest() == context_ids
+        assert [c.id for c in db.get_paginated_contexts(1, 10)] == sorted(
+            context_ids
+        )
+        for lemma_id in lemma_ids.values():
+            contexts = db.get_lemma_contexts(lemma_id, page=1, page_size=10)
+            assert [c.id for c in contexts] == sorted(context_ids)
+
+        other_ids = db.bulk_add_contexts(
+            [Context(context_value="context-1", source_id=other_source_id)]
+        )
+        assert other_ids[0] not in context_ids
+
     def test_get_context_id_invalid_context(self, db: LexDbIntegrator):
         assert db.get_context_id("invalid_context", SourceId(-1)) == -1
 
@@ -694,9 +868,9 @@ class TestExpensiveDbMethods:
             upos_tag=UposTag.NOUN,
             detailed_tag="NNP",
         )
-        db.add_lemma_context_relation(lcr)
-        db.add_lemma_context_relation(lcr)
-        assert len(db.get_lemma_context_relations(lcr)) == 2
+        lemma_context_id = db.add_lemma_context_relation(lcr)
+        assert db.add_lemma_context_relation(lcr) == lemma_context_id
+        assert len(db.get_lemma_context_relations(lcr)) == 1
 
     def test_update_lemma_status_invalid_id(self, db: LexDbIntegrator):
         status_id = db.add_status(StatusVal.STAGED)
@@ -964,3 +1138,305 @@ class TestExpensiveDbMethods:
         assert str(lemma_id_delete) not in cr.context_value
         assert str(lemma_id_remain) in cr.context_value
         assert db.get_lemma(lemma_id_delete) is None
+
+    def test_bulk_delete_lemmata_invalid_id_deletes_none(
+        self, db: LexDbIntegrator
+    ):
+        status_id = db.add_status(StatusVal.STAGED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        lemma_id = db.add_lemma(
+            Lemma(
+                lemma="test-lemma",
+                status_id=status_id,
+                found_in_source=source_id,
+            )
+        )
+        assert db.bulk_delete_lemmata({lemma_id, LemmaId(-1)}) is False
+        assert db.get_lemma(lemma_id) is not None
+        assert (source := db.get_source(source_id)) is not None
+        assert source.removed_lemmata_num == 0
+
+    def test_bulk_delete_lemmata_invalidates_lemma_id_cache(
+        self, db: LexDbIntegrator
+    ):
+        status_id = db.add_status(StatusVal.STAGED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        lemma_ids = db.bulk_add_lemma(
+            ["a-lemma", "b-lemma"], status_id, source_id
+        )
+        assert db.bulk_get_lemma_id_dict(["a-lemma", "b-lemma"]) == lemma_ids
+        assert db.lemma_id_cache.hits == 2
+        assert db.bulk_delete_lemmata({lemma_ids["a-lemma"]})
+        assert db.get_lemma_id("a-lemma") == -1
+        assert db.get_lemma_id("b-lemma") == lemma_ids["b-lemma"]
+
+    def test_refused_relation_evicts_lemma_deleted_elsewhere(
+        self, db: LexDbIntegrator
+    ):
+        # Another process, e.g. another API worker, on the same database
+        other_db = LexDbIntegrator(DbEnvironment.DEV, db.connection)
+        status_id = db.add_status(StatusVal.STAGED)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=db.add_source_kind(SourceKindVal.BOOK),
+                author="Some Author",
+                lang="en",
+            )
+        )
+        lemma_id = db.bulk_add_lemma(["hobbit"], status_id, source_id)[
+            "hobbit"
+        ]
+        context_id = db.add_context(
+            Context(context_value="somecontext", source_id=source_id)
+        )
+        assert other_db.bulk_delete_lemmata({lemma_id})
+
+        assert db.bulk_add_lemma(["hobbit"], status_id, source_id) == {
+            "hobbit": lemma_id
+        }
+        assert not db.bulk_add_lemma_source_relations(
+            [LemmaSourceRelation(lemma_id=lemma_id, source_id=source_id)]
+        )
+        new_lemma_id = db.bulk_add_lemma(["hobbit"], status_id, source_id)[
+            "hobbit"
+        ]
+        assert new_lemma_id != lemma_id
+        assert db.bulk_add_lemma_context_relations(
+            [
+                LemmaContextRelation(
+                    lemma_id=new_lemma_id,
+                    context_id=context_id,
+                    upos_tag=UposTag.NOUN,
+                    detailed_tag="NN",
+                )
+            ]
+        )
+
+    def test_get_paginated_contexts_after_id_matches_pages(
+        self, db: LexDbIntegrator
+    ):
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        db.bulk_add_contexts(
+            [
+                Context(context_value=f"context {i}", source_id=source_id)
+                for i in range(7)
+            ]
+        )
+        first = db.get_paginated_contexts(1, 3)
+        second = db.get_paginated_contexts(
+            1, 3, after_id=ContextId(first[-1].id)
+        )
+        assert second == db.get_paginated_contexts(2, 3)
+        assert db.get_paginated_source_contexts(
+            source_id, 1, 3, after_id=ContextId(second[-1].id)
+        ) == db.get_paginated_contexts(3, 3)
+
+    def test_get_lemma_contexts_distinct_contexts(self, db: LexDbIntegrator):
+        reset_and_populate(db)
+        lemma_id = db.get_lemma_id("hobbit")
+        context_id = db.get_context_id("somecontext", SourceId(1))
+        db.add_lemma_context_relation(
+            LemmaContextRelation(
+                lemma_id=lemma_id,
+                context_id=context_id,
+                upos_tag=UposTag.VERB,
+                detailed_tag="VB",
+            )
+        )
+        contexts = db.get_lemma_contexts(lemma_id, page=1, page_size=10)
+        assert [c.id for c in contexts] == [context_id]
+        assert contexts[0].context_value == "somecontext"
+
+    def test_get_sources_keeps_order_skips_invalid_ids(
+        self, db: LexDbIntegrator
+    ):
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_ids = [
+            db.add_source(
+                Source(
+                    title=title,
+                    source_kind_id=source_kind_id,
+                    author="Some Author",
+                    lang="en",
+                )
+            )
+            for title in ("The Hobbit", "The Silmarillion")
+        ]
+        sources = db.get_sources(
+            [source_ids[1], SourceId(-1), source_ids[0], source_ids[1]]
+        )
+        assert [s.id for s in sources] == [source_ids[1], source_ids[0]]
+
+    def test_update_lemmata_status_one_unchanged_updates_none(
+        self, db: LexDbIntegrator
+    ):
+        staged_id = db.add_status(StatusVal.STAGED)
+        committed_id = db.add_status(StatusVal.COMMITTED)
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        staged = db.bulk_add_lemma(
+            ["a-lemma", "b-lemma"], staged_id, source_id
+        )
+        committed = db.bulk_add_lemma(["c-lemma"], committed_id, source_id)
+        lemma_ids = [*staged.values(), *committed.values()]
+        assert db.update_lemmata_status(lemma_ids, committed_id) is False
+        assert db.update_lemmata_status(list(staged.values()), committed_id)
+        for lemma_id in lemma_ids:
+            assert (status := db.get_lemma_status(lemma_id)) is not None
+            assert status.id == committed_id
+
+    def test_async_integrator_awaits_methods(self, db: LexDbIntegrator):
+        async_db = AsyncLexDbIntegrator(db)
+        status_id = db.add_status(StatusVal.STAGED)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=db.add_source_kind(SourceKindVal.BOOK),
+                author="Some Author",
+                lang="en",
+            )
+        )
+
+        async def read() -> list:
+            return await asyncio.gather(
+                async_db.get_status_id(StatusVal.STAGED),
+                async_db.get_source(source_id),
+                async_db.get_lemma(LemmaId(-1)),
+            )
+
+        assert asyncio.run(read()) == [
+            status_id,
+            db.get_source(source_id),
+            None,
+        ]
+        assert async_db.env == db.env
+
+    def test_async_integrator_runs_methods_in_worker_thread(
+        self, db: LexDbIntegrator, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(
+            db, "get_lemma", lambda lemma_id: threading.get_ident()
+        )
+        thread_id = asyncio.run(AsyncLexDbIntegrator(db).get_lemma(LemmaId(1)))
+        assert thread_id != threading.get_ident()
+
+    def test_async_integrator_limits_worker_threads(
+        self, db: LexDbIntegrator, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(Const, "DB_MAX_THREADS", 2)
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+
+        def get_lemma(lemma_id: LemmaId) -> None:
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        monkeypatch.setattr(db, "get_lemma", get_lemma)
+        async_db = AsyncLexDbIntegrator(db)
+
+        async def read() -> None:
+            await asyncio.gather(
+                *(async_db.get_lemma(LemmaId(i)) for i in range(8))
+            )
+
+        asyncio.run(read())
+        assert most_running[0] == 2
+
+    def test_observed_backend_reports_queries(self):
+        calls: list[StorageCall] = []
+        db = LexDbIntegrator(
+            DbEnvironment.DEV,
+            ObservedBackend(
+                make_backend() or create_backend(DbEnvironment.DEV),
+                [calls.append],
+            ),
+        )
+        db.truncate_all_tables()
+        source_kind_id = db.add_source_kind(SourceKindVal.BOOK)
+        assert ("source_kind", "insert", 1) in [
+            (c.table, c.op, c.rows) for c in calls
+        ]
+
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=source_kind_id,
+                author="Some Author",
+                lang="en",
+            )
+        )
+        calls.clear()
+        assert db.get_sources([source_id, SourceId(-1)])
+        assert [(c.table, c.op, c.rows) for c in calls] == [
+            ("source", "select", 1)
+        ]
+
+        calls.clear()
+        db.truncate_all_tables()
+        assert [c.op for c in calls] == ["truncate"]
+
+    def test_query_tracer_attributes_queries_to_public_method(self):
+        db = LexDbIntegrator(
+            DbEnvironment.DEV,
+            ObservedBackend(
+                make_backend() or create_backend(DbEnvironment.DEV), [TRACER]
+            ),
+        )
+        db.truncate_all_tables()
+        status_id = db.add_status(StatusVal.STAGED)
+        source_id = db.add_source(
+            Source(
+                title="The Hobbit",
+                source_kind_id=db.add_source_kind(SourceKindVal.BOOK),
+                author="Some Author",
+                lang="en",
+            )
+        )
+        with TRACER.collect() as traces:
+            db.add_lemma(
+                Lemma(
+                    lemma="hobbit",
+                    status_id=status_id,
+                    found_in_source=source_id,
+                )
+            )
+        assert {trace.caller for trace in traces} == {"add_lemma"}
+        assert ("lemma", "insert") in {(t.table, t.op) for t in traces}
+        db.truncate_all_tables()
@@ -0,0 +1,103 @@
+import json
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from cli.stagemetrics import StageMetrics, StageStats
+
+
+def test_record_adds_up_stages():
+    metrics = StageMetrics()
+    metrics.record("parse", 1.5)
+    metrics.record("parse", 0.5, calls=3)
+    metrics.record("write", 2.0)
+    assert metrics.stages == {
+        "parse": StageStats(seconds=2.0, calls=4),
+        "write": StageStats(seconds=2.0, calls=1),
+    }
+    assert metrics.seconds("parse") == 2.0
+    assert metrics.seconds("read") == 0.0
+
+
+def test_merge_adds_stages_of_other_metrics():
+    metrics = StageMetrics()
+    metrics.record("parse", 1.0)
+    metrics.merge({"parse": StageStats(2.0, 2), "read": StageStats(0.5, 5)})
+    assert metrics.stages == {
+        "parse": StageStats(seconds=3.0, calls=3),
+        "read": StageStats(seconds=0.5, calls=5),
+    }
+
+
+def test_timed_counts_one_call_per_item():
+    metrics = StageMetrics()
+    assert list(metrics.timed("parse", ["a", "b", "c"])) == ["a", "b", "c"]
+    assert metrics.stages["parse"].calls == 3
+    assert list(metrics.timed("empty", [])) == []
+    assert metrics.stages["empty"].calls == 0
+
+
+def test_timed_does_not_count_nested_stages_twice(monkeypatch):
+    now = 0.0
+
+    def sleep(seconds: float):
+        nonlocal now
+        now += seconds
+
+    monkeypatch.setattr(time, "perf_counter", lambda: now)
+    metrics = StageMetrics()
+
+    def read() -> Iterator[int]:
+        for i in range(3):
+            with metrics.time("read"):
+                sleep(2)
+            yield i
+
+    def parse(lines: Iterator[int]) -> Iterator[int]:
+        for line in lines:
+            sleep(1)
+            yield line
+
+    items = metrics.timed("parse", parse(read()), nested=["read"])
+    assert list(items) == [0, 1, 2]
+    assert metrics.stages["read"] == StageStats(seconds=6.0, calls=3)
+    assert metrics.stages["parse"] == StageStats(seconds=3.0, calls=3)
+
+
+def test_wrap_records_calls():
+    metrics = StageMetrics()
+    double = metrics.wrap("double", lambda x: 2 * x)
+    assert [double(1), double(2)] == [2, 4]
+    assert metrics.stages["double"].calls == 2
+
+
+def test_to_json():
+    metrics = StageMetrics()
+    metrics.record("parse", 1.5, calls=2)
+    data = json.loads(metrics.to_json())
+    assert data["stages"] == {"parse": {"seconds": 1.5, "calls": 2}}
+    assert data["elapsed_seconds"] >= 0
+
+
+def test_to_prometheus_escapes_labels():
+    metrics = StageMetrics()
+    metrics.record('api "bulk"\\post\n', 1.5, calls=2)
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE lex_ingest_stage_seconds_total counter" in lines
+    assert (
+        'lex_ingest_stage_seconds_total{stage="api \\"bulk\\"\\\\post\\n"} 1.5'
+        in lines
+    )
+    assert (
+        'lex_ingest_stage_calls_total{stage="api \\"bulk\\"\\\\post\\n"} 2'
+        in lines
+    )
+
+
+def test_write_chooses_format_by_suffix(tmp_path: Path):
+    metrics = StageMetrics()
+    metrics.record("parse", 1.0)
+    metrics.write(tmp_path / "metrics.json")
+    metrics.write(tmp_path / "metrics.prom")
+    assert json.loads((tmp_path / "metrics.json").read_text())["stages"]
+    assert (tmp_path / "metrics.prom").read_text().startswith("# HELP")
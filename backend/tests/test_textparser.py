@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+
+# textparser loads the spaCy model on import
+pytest.importorskip("en_core_web_trf")
+
+from cli.textparser import Shard, TextParser  # noqa: E402
+
+
+def write_content(tmp_path: Path, line_num: int) -> str:
+    path = tmp_path / "content.txt"
+    path.write_text("".join(f"Line {i}.\n" for i in range(line_num)))
+    return str(path)
+
+
+def serial_windows(content_path: str) -> list:
+    with open(content_path) as f:
+        return list(TextParser._iter_windows(f))
+
+
+def shard_windows(content_path: str, shards: list[Shard]) -> list:
+    windows = []
+    for shard in shards:
+        with open(content_path) as f:
+            windows.extend(TextParser._iter_shard_windows(f, shard))
+    return windows
+
+
+@pytest.mark.parametrize("line_num", [0, 1, 10, 11, 137])
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_shard_windows_match_serial_windows(
+    tmp_path: Path, line_num: int, workers: int
+):
+    content_path = write_content(tmp_path, line_num)
+    shards = TextParser._shard_content(content_path, line_num, workers)
+    assert shards[-1].line_num is None
+    assert shard_windows(content_path, shards) == serial_windows(content_path)
+
+
+def test_shard_content_empty_content(tmp_path: Path):
+    content_path = write_content(tmp_path, 0)
+    assert TextParser._shard_content(content_path, 0, 4) == [
+        Shard(content_path, 0, None)
+    ]
+    assert serial_windows(content_path) == []
+
+
+def test_iter_windows_covers_every_line_once(tmp_path: Path):
+    content_path = write_content(tmp_path, 137)
+    windows = serial_windows(content_path)
+    assert [line for w in windows for line in w.raw_context] == [
+        f"Line {i}." for i in range(137)
+    ]
+    assert windows[0].pre_spill == []
+    for previous, window in zip(windows, windows[1:]):
+        assert (
+            previous.post_spill
+            == window.raw_context[: len(previous.post_spill)]
+        )
@@ -1,9 +1,14 @@
+import os
+import pickle
+import shutil
+import stat
 import subprocess
 
 import pytest
 
 from ..api._const import Const
 from ..api._utils import buf_count_newlines
+from ..api._vocabindex import VocabIndex
 
 base_vocab_changed = pytest.mark.skipif(
     condition=not bool(
@@ -38,3 +43,134 @@ def test_no_irrelevant_duplicates():
     with open(Const.PATH_IRRELEVANT_VOCAB) as f:
         set_count = len(set(f.readlines()))
     assert total_count == set_count
+
+
+@pytest.fixture
+def vocab_path(tmp_path):
+    path = tmp_path / "vocabulary.test.txt"
+    path.write_text("hobbit\nwizard\n\nmithril\nwizard\nélan\n")
+    return path
+
+
+def test_vocab_index_contains_entries(vocab_path):
+    index = VocabIndex.load(vocab_path)
+    assert len(index) == 4
+    assert list(index) == sorted(["élan", "hobbit", "mithril", "wizard"])
+    for entry in ("hobbit", "wizard", "mithril", "élan"):
+        assert entry in index
+    for entry in ("", "hobbits", "orc", "wizar", "zzz", 42):
+        assert entry not in index
+
+
+def test_vocab_index_matches_base_vocab(tmp_path):
+    vocab_path = tmp_path / "vocabulary.base.txt"
+    shutil.copy(Const.PATH_BASE_VOCAB, vocab_path)
+    with open(vocab_path) as f:
+        vocab = set(f.read().split())
+    index = VocabIndex.load(vocab_path)
+    assert set(index) == vocab
+    assert all(entry in index for entry in vocab)
+    assert not any(f"{entry}_" in index for entry in vocab)
+
+
+def test_vocab_index_rebuilt_only_when_text_changes(vocab_path):
+    index_path = vocab_path.with_suffix(".idx")
+    VocabIndex.load(vocab_path).close()
+    built_ns = index_path.stat().st_mtime_ns
+
+    index = VocabIndex.load(vocab_path)
+    assert index_path.stat().st_mtime_ns == built_ns
+    assert "orc" not in index
+
+    with open(vocab_path, "a") as f:
+        f.write("orc\n")
+    index = VocabIndex.load(vocab_path)
+    assert "orc" in index
+
+
+def test_vocab_index_pickles_as_path(vocab_path):
+    index = VocabIndex.load(vocab_path)
+    data = pickle.dumps(index)
+    assert b"hobbit" not in data
+    assert "hobbit" in pickle.loads(data)
+
+
+def test_vocab_index_reads_appended_entries_without_rebuilding(vocab_path):
+    index_path = vocab_path.with_suffix(".idx")
+    VocabIndex.load(vocab_path).close()
+    built_ns = index_path.stat().st_mtime_ns
+
+    for lemma in ("orc", "balrog", "hobbit"):
+        with open(vocab_path, "a") as f:
+            f.write(f"{lemma}\n")
+        index = VocabIndex.load(vocab_path, keep_appended=True)
+        assert lemma in index
+    assert index_path.stat().st_mtime_ns == built_ns
+    assert len(index) == 6
+    assert list(index) == sorted(
+        ["balrog", "élan", "hobbit", "mithril", "orc", "wizard"]
+    )
+    assert "orc" in pickle.loads(pickle.dumps(index))
+
+
+def test_vocab_index_rebuilt_when_text_changes_otherwise(vocab_path):
+    index_path = vocab_path.with_suffix(".idx")
+    VocabIndex.load(vocab_path).close()
+    built_ns = index_path.stat().st_mtime_ns
+
+    vocab_path.write_text("hobbit\norc\n")
+    index = VocabIndex.load(vocab_path, keep_appended=True)
+    assert index_path.stat().st_mtime_ns != built_ns
+    assert list(index) == ["hobbit", "orc"]
+
+
+def test_vocab_index_rebuilt_when_entry_is_continued(tmp_path):
+    vocab_path = tmp_path / "vocabulary.test.txt"
+    vocab_path.write_text("hobbit\norc")
+    VocabIndex.load(vocab_path).close()
+    with open(vocab_path, "a") as f:
+        f.write("s\n")
+    index = VocabIndex.load(vocab_path, keep_appended=True)
+    assert list(index) == ["hobbit", "orcs"]
+
+
+def test_vocab_index_rebuilt_when_too_many_entries_appended(
+    vocab_path, monkeypatch
+):
+    monkeypatch.setattr(Const, "VOCAB_MAX_APPENDED", 1)
+    VocabIndex.load(vocab_path).close()
+    with open(vocab_path, "a") as f:
+        f.write("orc\nbalrog\n")
+    index = VocabIndex.load(vocab_path, keep_appended=True)
+    assert index._appended == frozenset()
+    assert len(index) == 6
+
+
+def test_vocab_index_rebuilt_after_append_by_default(vocab_path):
+    index_path = vocab_path.with_suffix(".idx")
+    VocabIndex.load(vocab_path).close()
+    built_ns = index_path.stat().st_mtime_ns
+
+    with open(vocab_path, "a") as f:
+        f.write("orc\n")
+    index = VocabIndex.load(vocab_path)
+    assert index._appended == frozenset()
+    assert index_path.stat().st_mtime_ns != built_ns
+    assert "orc" in index
+
+
+def test_vocab_index_mode_follows_umask(vocab_path):
+    umask = os.umask(0o027)
+    try:
+        VocabIndex.load(vocab_path).close()
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(vocab_path.with_suffix(".idx").stat().st_mode) == (
+        0o640
+    )
+
+
+def test_vocab_index_closes_on_exit(vocab_path):
+    with VocabIndex.load(vocab_path) as index:
+        assert "hobbit" in index
+    assert index._map.closed
@@ -1,10 +1,18 @@
 import useSWRImmutable, { Fetcher } from "swr";
 
 import { Context } from "@/components/Context";
-import { useEffect, useState } from "react";
+import { useState } from "react";
 
-const fetcher: Fetcher<Context[]> = (url: RequestInfo | URL) =>
-  fetch(url).then((r) => r.json());
+type ContextPage = {
+  contexts: Context[];
+  nextCursor: string | null;
+};
+
+const fetcher: Fetcher<ContextPage> = (url: RequestInfo | URL) =>
+  fetch(url).then(async (r) => ({
+    contexts: await r.json(),
+    nextCursor: r.headers.get("X-Next-Cursor"),
+  }));
 
 function ContextSetDisplayer({
   fetchQuery,
@@ -19,7 +27,7 @@ function ContextSetDisplayer({
   if (isLoading) return <div>Loading...</div>;
   return (
     <>
-      {data!.map((context: Context) => {
+      {data!.contexts.map((context: Context) => {
         return (
           <span key={context.id} id={String(context.id)}>
             <Context
@@ -43,38 +51,38 @@ export default function PaginatedContexts({
   page_size: number;
   highlightedLemmaId?: number;
 }) {
-  const [page, setPage] = useState(1);
-  const [allLoaded, setAllLoaded] = useState(false);
-
-  useEffect(() => {
-    const spans = document.getElementsByTagName("span");
-    const contextSpans = Array.from(spans).filter((span) => {
-      return span.innerText.includes(" § ");
-    });
-
-    if (contextSpans.length < (page - 1) * page_size) {
-      setAllLoaded(true);
-    } else {
-      setAllLoaded(false);
-    }
-  }, [page, page_size]);
+  // Pages are fetched by cursor: each page starts after the last context
+  // id of the previous one, so deep pages are as cheap as the first
+  const [cursors, setCursors] = useState<string[]>([""]);
+  const pageQuery = (cursor: string) =>
+    `${fetchQuery}?page_size=${page_size}${cursor && `&after_id=${cursor}`}`;
+  // Read from the same cache entry as the last page's displayer, so that
+  // it is also known when the page is served from the cache. undefined
+  // while the last page is loading, null after the last page.
+  const { data: lastPage } = useSWRImmutable(
+    pageQuery(cursors[cursors.length - 1]),
+    fetcher
+  );
+  const nextCursor = lastPage?.nextCursor;
 
   return (
     <>
-      {[...Array(page).keys()].map((i) => {
+      {cursors.map((cursor) => {
         return (
           <ContextSetDisplayer
-            key={i}
-            fetchQuery={`${fetchQuery}?page=${i + 1}&page_size=${page_size}`}
+            key={cursor}
+            fetchQuery={pageQuery(cursor)}
             highlightedLemmaId={highlightedLemmaId}
           />
         );
       })}
       <br />
-      {!allLoaded && (
-        <button onClick={() => setPage(page + 1)}>Load more</button>
+      {nextCursor && (
+        <button onClick={() => setCursors([...cursors, nextCursor])}>
+          Load more
+        </button>
       )}
-      {allLoaded && <div>All data returned. ₍ᐢ. ̫.ᐢ₎</div>}
+      {nextCursor === null && <div>All data returned. ₍ᐢ. ̫.ᐢ₎</div>}
     </>
   );
 }